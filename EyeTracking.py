@@ -11,6 +11,16 @@ import random
 import re
 
 from glob import glob
+from collections import deque
+
+from gazeFilters import gazeRingBuffer
+from blinkDetection import blinkMask
+from driftCorrection import driftEstimator
+from gazeCalibration import fitCalibration, nTerms, targetTour, vectorColumns
+from gazeValidation import padSamples, validationMetrics, judgeValidation, metricsToDict, spreadTargets
+from recordStore import recordStore
+from participantStore import participantStore
+from fileAllocation import allocateIndex
 
 
 # to test if input objects are valid psychopy classes:
@@ -31,10 +41,16 @@ from pyglet.window import key
 
 
 
+# text shown by the EyeTracker during calibration:
+calibrationText = 'calibration'
+redoCalibrationText = 'not enough fixations detected\n\nadjust eye-tracker?\n\n    press  [ SPACE ]\nto redo calibration'
+
+
 # this file has just 1 object that is needed: EyeTracker
 # for now, it can be used as:
 # -  from EyeTracker import EyeTracker
 # -  myEyeTracker = EyeTracker(tracker='LiveTrack', trackEyes=[True,True], fixationWindow=2, psychopyWindow=cfg['hw']['win'])
+# without a window (psychopyWindow=None) there are no calibration screens: only the samples can be used
 # I could set up the folder to work like a proper Python module later where that is taken care of
 
 
@@ -60,7 +76,13 @@ class EyeTracker:
         # they can also be used later on to change how the object works
         # and are supposed to be device-agnostic
 
-        self.setPsychopyWindow(psychopyWindow)
+        # no window: headless, e.g. for benchmarks (not for the EyeLink, which needs the monitor)
+        if psychopyWindow == None:
+            if tracker == 'eyelink':
+                raise Warning("the EyeLink needs a psychopyWindow")
+            self.psychopyWindow = None
+        else:
+            self.setPsychopyWindow(psychopyWindow)
         self.setCalibrationpoints(calibrationpoints)
         self.setColors(colors)
         self.setEyetracker(tracker)
@@ -91,14 +113,36 @@ class EyeTracker:
         self.__N_calibrations = 0
         self.__N_rawdatafiles = 0
 
-        self.__createTargetStim()
+        # coefficients of the last calibration, until it is validated and goes in the calibration store:
+        self.__calibrationRecord = None
+
+        # raw pupil-glint vectors of the recorded samples (LiveTrack only, see flushVectors):
+        self.__vectorFile = None
+
+        # recent samples seen by gazeInFixationWindow, for online velocity / smoothing:
+        self.gazeBuffer = gazeRingBuffer(capacity=1000)
+        # (off by default: every missing sample is a fixation break, tasks can opt in)
+        self.setBlinkTolerance(maxBlinkDur=None)
+        self.setDriftCorrection()
+        self.setCalibrationRetries()
+        self.setValidation()
+        self.setFrameTimer()
+
+        self.target = None
+        # one text stim for the prompts that change with every call (see __prompt):
+        self.__promptStim = None
+        if self.psychopyWindow != None:
+            self.__createTargetStim()
+
+            # the calibration screens are laid out once, here:
+            prewarmTextScreens(self.psychopyWindow, [calibrationText, redoCalibrationText], wrapWidth=30)
 
 
 
 
     def setEyetracker(self, tracker):
         if isinstance(tracker, str):
-            if tracker in ['eyelink', 'livetrack', 'mouse']:
+            if tracker in ['eyelink', 'livetrack', 'mouse', 'simulated']:
 
                 if tracker == 'eyelink':
                     # set up the eyelink device here
@@ -112,6 +156,10 @@ class EyeTracker:
                     # not sure what to do here
                     self.setupMouse()
 
+                if tracker == 'simulated':
+                    # LiveTrack code, with a simulated device (simLiveTrack.py)
+                    self.setupLiveTrack(simulated=True)
+
                 self.tracker = tracker
             else:
                 raise Warning("unkown eye-tracker: %s"%(tracker))
@@ -177,6 +225,7 @@ class EyeTracker:
         self.storefiles = False
         self.filefolder = None
         self.filename = None
+        self.calibrationStore = None
         if isinstance(filefolder, str):
             if len(filefolder) > 0:
                 # self.storefiles = False
@@ -187,15 +236,16 @@ class EyeTracker:
 
                             # check if target file already exists:
                             if len(glob(os.path.join(filefolder, filename + '.*'))):
-                                y = 1
-                                while len(glob(os.path.join(filefolder, filename + '_' + str(y) + '.*'))):
-                                    y += 1
+                                y = allocateIndex(filefolder, filename + '_', exists=lambda y: len(glob(os.path.join(filefolder, filename + '_' + str(y) + '.*'))) > 0)
                                 filename = filename + '_' + str(y)
                                 print('NOTE: target eye-tracking data file already exists, changing to: '+filename)
 
                             self.storefiles  = True
                             self.filefolder  = filefolder
                             self.filename    = filename
+
+                            # all validated calibrations for this participant (see restorecalibration):
+                            self.calibrationStore = recordStore(os.path.join(filefolder, 'calibrations.jsonl'), indices=[['kind'], ['kind','accepted']])
                         else:
                             print('NOTE: not storing any data since filename is an empty string')
                     else:
@@ -389,6 +439,7 @@ class EyeTracker:
         self.initialize = self.__EL_initialize
         self.calibrate  = self.__EL_calibrate
         self.savecalibration = self.__EL_savecalibration
+        self.restorecalibration = self.__EL_restorecalibration
 
         self.lastsample = self.__EL_lastsample
 
@@ -399,18 +450,26 @@ class EyeTracker:
 
         self.comment = self.__EL_comment
         self.shutdown = self.__EL_shutdown
+
+        # the EyeLink validates its own calibration:
+        self.validationSamples = None
+        self.flushVectors = self.__EL_flushVectors
         # ...
         # here we map other functions
         # ...
 
-    def setupLiveTrack(self):
-        import LiveTrack
+    def setupLiveTrack(self, simulated=False):
+        if simulated:
+            import simLiveTrack as LiveTrack
+        else:
+            import LiveTrack
         self.LiveTrack = LiveTrack
 
         # remap functions:
         self.initialize = self.__LT_initialize
         self.calibrate  = self.__LT_calibrate
         self.savecalibration = self.__LT_savecalibration
+        self.restorecalibration = self.__LT_restorecalibration
 
         self.lastsample = self.__LT_lastsample
 
@@ -421,6 +480,9 @@ class EyeTracker:
 
         self.comment = self.__LT_comment
         self.shutdown = self.__LT_shutdown
+
+        self.validationSamples = self.__LT_validationSamples
+        self.flushVectors = self.__LT_flushVectors
         # ...
         # here we map other functions
         # ...
@@ -434,6 +496,7 @@ class EyeTracker:
         self.initialize = self.__DM_initialize
         self.calibrate  = self.__DM_calibrate
         self.savecalibration = self.__DM_savecalibration
+        self.restorecalibration = self.__DM_restorecalibration
 
         self.lastsample = self.__DM_lastsample
 
@@ -444,6 +507,10 @@ class EyeTracker:
 
         self.comment = self.__DM_comment
         self.shutdown = self.__DM_shutdown
+
+        # nothing to validate with a mouse:
+        self.validationSamples = None
+        self.flushVectors = self.__DM_flushVectors
         # ...
         # here we map other functions
         # ...
@@ -665,6 +732,7 @@ class EyeTracker:
                                    'sampleRate' : sampleRate,
                                    'offsetX'    : offsetX,
                                    'offsetY'    : offsetY      }
+        self.gazeBuffer.sampleRate = sampleRate
 
         # these checks can be much simpler! but leave it be for now...
         if isinstance(calibrationPoints, np.ndarray):
@@ -711,6 +779,7 @@ class EyeTracker:
         result = self.tracker.runSetupProcedure()
         print("Calibration returned: ", result)
         self.showWindow(self.psychopyWindow)
+        self.resetDrift()
 
         self.__N_calibrations += 1
         self.comment('calibration %d'%(self.__N_calibrations))
@@ -719,28 +788,16 @@ class EyeTracker:
     def __LT_calibrate(self):
         # print('calibrate livetrack')
 
-        calTargets = copy.deepcopy(self.__calibrationTargets)
-
-        # print(self.calibrationpoints)
-
-        # midTarget = calTargets[0]
-        # extTargets = calTargets[1:]
-
-        # np.random.shuffle(extTargets)
-
-        # calTargets = [midTarget].append(extTargets).append(midTarget)
-
-        # ntargets = len(calTargets)
-
-        mididx = list(range(1,len(calTargets)))
-        random.shuffle(mididx)
-        allidx = [0] + mididx + [0]
+        # the centre target is shown first and last, the others in a short (but not fixed) tour,
+        # so there are no long back-and-forth saccades on the wide target sets:
+        allidx = targetTour(self.__calibrationTargets, start=0)
         ntargets = len(allidx)
 
 
         # configure calibration:
-        setupDelay = 1000.0 # time before collecting any samples in ms
+        settleDelay = 200.0 # time after target onset before the fixation can start (saccade latency + landing) in ms
         minDur = 300 # min fixation duration in ms
+        setupDelay = settleDelay + minDur # a point is accepted as soon as a stable fixation is found after this
         fixTimeout = 5  # timeout duration in seconds (point is skipped!)
         fixThreshold = 5 # pixel window for all samples within a 'fixation'
 
@@ -771,221 +828,220 @@ class EyeTracker:
         self.LiveTrack.SetTracking(self.trackEyes[0], self.trackEyes[1]) # make sure we're only tracking the requires eyes
         # print(self.LiveTrack.GetTracking()) # see what's being tracked
 
-        if self.trackEyes[0]:
-            VectXL = [None] * ntargets
-            VectYL = [None] * ntargets
-            GlintXL = [None] * ntargets
-            GlintYL = [None] * ntargets
-        if self.trackEyes[1]:
-            VectXR = [None] * ntargets
-            VectYR = [None] * ntargets
-            GlintXR = [None] * ntargets
-            GlintYR = [None] * ntargets
+        eyes = [eye for eye, track in zip(['left', 'right'], self.trackEyes) if track]
 
-        visual.TextStim(self.psychopyWindow,'calibration', height = 1,wrapWidth=30, color = 'black').draw()
+        textScreen(self.psychopyWindow, calibrationText, wrapWidth=30).draw()
         self.psychopyWindow.flip()
         time.sleep(0.3333) # is this necessary? well, we just show this briefly, so the participant knows what's going to happen
 
-        for target_idx in range(ntargets):
-            # plot a circle at the fixation position.
-            # self.cal_dot_o.pos = self.calibrationTargets[target_idx,:]
-            # self.cal_dot_o.draw()
-            # self.cal_dot_i.pos = self.calibrationTargets[target_idx,:]
-            # self.cal_dot_i.draw()
+        while True:
 
-            targetpos = tgtLocs[target_idx]
+            # one row per target presentation: VectX, VectY, GlintX, GlintY (NaN until a good fixation is found)
+            fixations = {eye: np.full((ntargets, 4), np.nan) for eye in eyes}
 
-            self.target.pos = targetpos
-            self.target.draw()
+            # first all targets, then only the ones that failed or were outliers for either eye
+            # (each eye keeps its good fixations, and only collects data on its own bad targets):
+            badTargets = {eye: list(range(ntargets)) for eye in eyes}
+            for attempt in range(self.__calibrationRetries['maxRetries'] + 1):
 
-            self.psychopyWindow.flip()
-
-            # This flag will be set to true when a valid fixation has been acquired
-            gotFixLeft = 0  
-            gotFixRight = 0
-            
-            t0 = time.time() # reset fixation timer 
-        
-            # Loop until fixation data has been aquired for this dot (or timed out) 
-            while 1:
-                d = self.LiveTrack.GetBufferedEyePositions(0,fixDurSamples,0)
-
-                if self.trackEyes[0]:
-
-                    VectX = self.LiveTrack.GetFieldAsList(d,'VectX')
-                    VectY = self.LiveTrack.GetFieldAsList(d,'VectY')
-                    GlintX = self.LiveTrack.GetFieldAsList(d,'GlintX')
-                    GlintY = self.LiveTrack.GetFieldAsList(d,'GlintY')
-                    Tracked = self.LiveTrack.GetFieldAsList(d,'Tracked')
-
-                    # Calculate the maximum difference in the pupil-to-glint 
-                    # vectors for the samples in the buffer, for left eye
-                    pgDistL = max([max(VectX)-min(VectX),max(VectY)-min(VectY)])
-
-                    # Check if the maximum vector difference is within the defined
-                    # limit for a fixation (fixWindow) and all samples ajsone tracked, and
-                    # the time to wait for fixations (waitTimeForFix) has passed, for
-                    # the left eye
-                    if pgDistL<=fixThreshold and np.all(Tracked) and (time.time()-t0)>setupDelay/1000:
-                        # Check if there are enough samples in the buffer for the
-                        # defined duration (fixDurSamples)
-                        if len(d)>=fixDurSamples and gotFixLeft==0:
-                            # save the data for this fixation
-                            VectXL[target_idx] = np.median(VectX)
-                            VectYL[target_idx] = np.median(VectY)
-                            GlintXL[target_idx] = np.median(GlintX)
-                            GlintYL[target_idx] = np.median(GlintY)
-                            print('Fixation #',str(target_idx+1),str(targetpos),': Found valid fixation for left eye')
-                            gotFixLeft = 1 # good fixation aquired
-                
-                if self.trackEyes[1]:
-                    VectXRight = self.LiveTrack.GetFieldAsList(d,'VectXRight')
-                    VectYRight = self.LiveTrack.GetFieldAsList(d,'VectYRight')
-                    GlintXRight = self.LiveTrack.GetFieldAsList(d,'GlintXRight')
-                    GlintYRight = self.LiveTrack.GetFieldAsList(d,'GlintYRight')
-                    TrackedRight = self.LiveTrack.GetFieldAsList(d,'TrackedRight')
-                
-                    # and for the right eye
-                    pgDistR = max([max(VectXRight)-min(VectXRight),max(VectYRight)-min(VectYRight)])
-
-
-                    # and for the right eye
-                    if pgDistR<=fixThreshold and np.all(TrackedRight) and (time.time()-t0)>setupDelay/1000:
-                        # Check if there are enough samples in the buffer for the
-                        # defined duration (fixDurSamples)
-                        if  len(d)>=fixDurSamples and gotFixRight==0:
-                            # save the data for this fixation
-                            VectXR[target_idx] = np.median(VectXRight)
-                            VectYR[target_idx] = np.median(VectYRight)
-                            GlintXR[target_idx] = np.median(GlintXRight)
-                            GlintYR[target_idx] = np.median(GlintYRight)
-                            print('Fixation #',str(target_idx+1),str(targetpos),': Found valid fixation for right eye')
-                            gotFixRight = 1 # good fixation aquired
-                
-
-                if (time.time()-t0)>fixTimeout:
-                    if not gotFixLeft and self.trackEyes[0]>0:
-                        print('Fixation #',str(target_idx+1),str(targetpos),': Did not get fixation for left eye (timeout)')
-                    if not gotFixRight and self.trackEyes[1]>0:
-                        print('Fixation #',str(target_idx+1),str(targetpos),': Did not get fixation for right eye (timeout)')
-                    break # fixation timed out
-
-                
-                # Exit if all eyes that are enabled have got a fixation
-                if (gotFixLeft or self.trackEyes[0]==False) and (gotFixRight or self.trackEyes[1]==False):
-                    self.psychopyWindow.flip()
+                present = sorted(set().union(*badTargets.values()))
+                if len(present) == 0:
                     break
+                if attempt > 0:
+                    print('calibration retry %d: %d targets'%(attempt, len(present)))
 
-        # Stop buffering data to the library
-        ######################################################### NOT SURE ABOUT THIS:
+                for target_idx in present:
+                    need = [eye for eye in eyes if target_idx in badTargets[eye]]
+                    found = self.__LT_collectFixation( targetpos     = tgtLocs[target_idx],
+                                                       eyes          = need,
+                                                       fixDurSamples = fixDurSamples,
+                                                       setupDelay    = setupDelay,
+                                                       fixTimeout    = fixTimeout,
+                                                       fixThreshold  = fixThreshold,
+                                                       label         = target_idx+1 )
+                    for eye in found.keys():
+                        fixations[eye][target_idx] = found[eye]
 
-        # self.LiveTrack.StopTracking()
+                badTargets = {eye: self.__LT_badCalibrationTargets(tgtLocs, fixations[eye], eye) for eye in eyes}
 
-        # Clear the data in the buffer
-        self.LiveTrack.ClearDataBuffer()
+            # Stop buffering data to the library
+            ######################################################### NOT SURE ABOUT THIS:
 
+            # self.LiveTrack.StopTracking()
 
-        viewDist = self.psychopyWindow.monitor.getDistance()
+            # Clear the data in the buffer (the raw vectors are logged if a file is open)
+            self.__LT_bufferedSamples()
 
-        redoCalibration = False
+            # whatever is still bad after the last retry is left out:
+            for eye in eyes:
+                fixations[eye][badTargets[eye]] = np.nan
 
-        # %% remove failed fixations from data
-
-        if self.trackEyes[0]:
-            # left eye
-            failedFixL = []
-            for i in range(0,len(VectXL)):
-                if VectXL[i] is None:
-                    failedFixL.append(i)
-            
-            # %% remove failed fixations from data
-            VectXL = np.delete(VectXL, failedFixL).tolist()
-            VectYL = np.delete(VectYL, failedFixL).tolist()
-            GlintXL = np.delete(GlintXL, failedFixL).tolist()
-            GlintYL = np.delete(GlintYL, failedFixL).tolist()
-            tgtLocsXL = np.delete(tgtLocs[:,0], failedFixL).tolist()
-            tgtLocsYL = np.delete(tgtLocs[:,1], failedFixL).tolist()
-
-            if len(tgtLocsXL) < 2:
-                print('left eye calibration fewer than 3 good points: redoing calibration')
-                redoCalibration = True
-            else:
-                # %% send fixation data to LiveTrack to calibrate
-                calErrL = self.LiveTrack.CalibrateDevice(0, len(tgtLocsXL), tgtLocsXL, tgtLocsYL, VectXL, VectYL, viewDist, np.median(GlintXL), np.median(GlintYL))
-                print('Left eye calibration accuraccy: ',str(math.sqrt(float(calErrL)/len(tgtLocsXL))), 'errors in dva')
+            redoCalibration = False
+            for eye in eyes:
+                if np.sum(~np.isnan(fixations[eye][:,0])) < self.__calibrationRetries['minPoints']:
+                    print('%s eye calibration fewer than %d good points: redoing calibration'%(eye, self.__calibrationRetries['minPoints']))
+                    redoCalibration = True
 
-
-        if self.trackEyes[1]:
-            # right eye
-            failedFixR = []
-            for i in range(0,len(VectXR)):
-                if VectXR[i] is None:
-                    failedFixR.append(i)
-
-            # %% remove failed fixations from data
-            VectXR = np.delete(VectXR, failedFixR).tolist()
-            VectYR = np.delete(VectYR, failedFixR).tolist()
-            GlintXR = np.delete(GlintXR, failedFixR).tolist()
-            GlintYR = np.delete(GlintYR, failedFixR).tolist()
-            tgtLocsXR = np.delete(tgtLocs[:,0], failedFixR).tolist()
-            tgtLocsYR = np.delete(tgtLocs[:,1], failedFixR).tolist()
-            
-            if len(tgtLocsXR) < 2:
-                print('right eye calibration fewer than 3 good points: redoing calibration')
-                redoCalibration = True
-            else:
-                calErrR = self.LiveTrack.CalibrateDevice(1, len(tgtLocsXR), tgtLocsXR, tgtLocsYR, VectXR, VectYR, viewDist, np.median(GlintXR), np.median(GlintYR))
-                print('Right eye calibration accuraccy: ',str(math.sqrt(float(calErrR)/len(tgtLocsXR))), 'errors in dva')
-        
-
-        if redoCalibration:
+            if not redoCalibration:
+                break
 
             # redo_text = visual.TextStim(win = self.psychopyWindow,
             #                             'not enough fixations detected\n\nadjust eye-tracker?\n\n    press  [ SPACE ]\nto redo calibration')
-            visual.TextStim(self.psychopyWindow,'not enough fixations detected\n\nadjust eye-tracker?\n\n    press  [ SPACE ]\nto redo calibration', height = 1,wrapWidth=30, color = 'black').draw()
+            textScreen(self.psychopyWindow, redoCalibrationText, wrapWidth=30).draw()
             # redo_text.draw()
             self.psychopyWindow.flip()
 
-            k=[]
+            k = ['']
             while k[0] not in ['q','space']:
                 k = event.waitKeys()
             event.clearEvents(eventType='keyboard')
-            self.__LT_calibrate()
-            
-        else:
 
-            # %% plot the estimated fixation locations for the calibration
-            #if trackLeftEye:
-            #    [gazeXL, gazeYL] = LiveTrack.CalcGaze(0, len(tgtLocsXL), VectXL, VectYL)
-            #
-            #if trackRightEye:
-            #    [gazeXR, gazeYR] = LiveTrack.CalcGaze(1, len(tgtLocsXR), VectXR, VectYR)
-            # errors are added?
-            # gazeXL = [x+10 for x in tgtLocsXL]
-            # gazeYL = [x+10 for x in tgtLocsYL]
-            # gazeXR = [x-10 for x in tgtLocsXR]
-            # gazeYR = [x-10 for x in tgtLocsYR]
+
+        viewDist = self.psychopyWindow.monitor.getDistance()
+
+        # the fixations are stored with the calibration, so it can be refit offline (see gazeCalibration.py):
+        self.calibrationFixations = {}
+
+        for eye in eyes:
+            good = ~np.isnan(fixations[eye][:,0])
+            VectX, VectY, GlintX, GlintY = [fixations[eye][good,i].tolist() for i in range(4)]
+            tgtLocsX = tgtLocs[good,0].tolist()
+            tgtLocsY = tgtLocs[good,1].tolist()
+
+            self.calibrationFixations[eye] = { 'targetX' : tgtLocsX,
+                                               'targetY' : tgtLocsY,
+                                               'vectX'   : VectX,
+                                               'vectY'   : VectY,
+                                               'glintX'  : GlintX,
+                                               'glintY'  : GlintY }
+
+            # %% send fixation data to LiveTrack to calibrate
+            calErr = self.LiveTrack.CalibrateDevice({'left':0, 'right':1}[eye], len(tgtLocsX), tgtLocsX, tgtLocsY, VectX, VectY, viewDist, np.median(GlintX), np.median(GlintY))
+            print('%s eye calibration accuraccy: '%(eye.capitalize()),str(math.sqrt(float(calErr)/len(tgtLocsX))), 'errors in dva')
+
+
+        # %% plot the estimated fixation locations for the calibration
+        #if trackLeftEye:
+        #    [gazeXL, gazeYL] = LiveTrack.CalcGaze(0, len(tgtLocsXL), VectXL, VectYL)
+        #
+        #if trackRightEye:
+        #    [gazeXR, gazeYR] = LiveTrack.CalcGaze(1, len(tgtLocsXR), VectXR, VectYR)
+        # errors are added?
+        # gazeXL = [x+10 for x in tgtLocsXL]
+        # gazeYL = [x+10 for x in tgtLocsYL]
+        # gazeXR = [x-10 for x in tgtLocsXR]
+        # gazeYR = [x-10 for x in tgtLocsYR]
+        
+        # if useVideo:
+        #     self.LiveTrackGS.VideoStop()
+
+        self.LiveTrack.SetResultsTypeCalibrated()
+        self.resetDrift()
+        # self.LiveTrack.StartTracking()
+
+        if self.storefiles:
             
-            # if useVideo:
-            #     self.LiveTrackGS.VideoStop()
+            self.__N_calibrations = self.__nextCalibrationIndex()
+            self.comment('calibration %d'%(self.__N_calibrations))
 
-            self.LiveTrack.SetResultsTypeCalibrated()
-            # self.LiveTrack.StartTracking()
+            self.savecalibration()
 
-            if self.storefiles:
-                
-                cal_files = glob( os.path.join(self.filefolder, 'calibration_*.json' ) )
-                if len(cal_files):
-                    idx = np.max([int(os.path.splitext(os.path.basename(x))[0].split('_')[1]) for x in cal_files]) + 1
-                else:
-                    idx = 1
+    def __LT_collectFixation(self, targetpos, eyes, fixDurSamples, setupDelay, fixTimeout, fixThreshold, label):
+
+        # show one calibration target, and wait for a stable fixation of each eye in `eyes`
+        # returns a dictionary with the median VectX, VectY, GlintX, GlintY for each eye that got one
+
+        # LiveTrack field names per eye:
+        fields = { 'left'  : ['VectX', 'VectY', 'GlintX', 'GlintY', 'Tracked'],
+                   'right' : ['VectXRight', 'VectYRight', 'GlintXRight', 'GlintYRight', 'TrackedRight'] }
 
-                self.__N_calibrations = idx
-                self.comment('calibration %d'%(self.__N_calibrations))
+        self.target.pos = targetpos
+        self.target.draw()
 
-                self.savecalibration()
+        self.psychopyWindow.flip()
+
+        # only samples after target onset can be part of the fixation:
+        self.__LT_bufferedSamples()
+
+        found = {}
+
+        t0 = time.time() # reset fixation timer 
+    
+        # Loop until fixation data has been aquired for this dot (or timed out) 
+        while 1:
+            d = self.LiveTrack.GetBufferedEyePositions(0,fixDurSamples,0)
+
+            for eye in eyes:
+                if eye in found.keys():
+                    continue
+
+                VectX, VectY, GlintX, GlintY, Tracked = [self.LiveTrack.GetFieldAsList(d, field) for field in fields[eye]]
+
+                # Check if there are enough samples in the buffer for the defined duration (fixDurSamples),
+                # if the maximum difference in the pupil-to-glint vectors is within the limit for a
+                # fixation (fixThreshold), all samples are tracked, and the setup delay has passed
+                if len(d)>=fixDurSamples and (time.time()-t0)>setupDelay/1000:
+                    pgDist = max([max(VectX)-min(VectX),max(VectY)-min(VectY)])
+                    if pgDist<=fixThreshold and np.all(Tracked):
+                        # save the data for this fixation
+                        found[eye] = [np.median(VectX), np.median(VectY), np.median(GlintX), np.median(GlintY)]
+                        print('Fixation #',str(label),str(targetpos),': Found valid fixation for %s eye'%(eye))
+
+            if (time.time()-t0)>fixTimeout:
+                for eye in eyes:
+                    if not eye in found.keys():
+                        print('Fixation #',str(label),str(targetpos),': Did not get fixation for %s eye (timeout)'%(eye))
+                break # fixation timed out
+
+            # Exit if all eyes that are needed have got a fixation
+            if len(found) == len(eyes):
+                self.psychopyWindow.flip()
+                break
+
+        return(found)
+
+    def __LT_badCalibrationTargets(self, tgtLocs, fixations, eye):
+
+        # targets without a fixation, and targets that don't fit the others:
+        # a linear model is fit to the good fixations (see gazeCalibration.py), and points with a
+        # residual above the outlier criterion are re-presented
+        # (a 2nd order fit has so many terms that it partly absorbs a bad point on 9 targets)
+        good = ~np.isnan(fixations[:,0])
+        bad = list(np.flatnonzero(~good))
+
+        # an outlier can only be detected with more points than the model has terms:
+        if good.sum() <= nTerms(1):
+            return(bad)
+
+        model = fitCalibration(tgtLocs[good,0], tgtLocs[good,1], fixations[good,0], fixations[good,1], order=1)
+        criterion = max(self.__calibrationRetries['outlierResidual'], 3 * np.median(model['residuals']))
+        outliers = []
+        for target_idx, residual in zip(np.flatnonzero(good), model['residuals']):
+            if residual > criterion:
+                print('Fixation #',str(target_idx+1),str(tgtLocs[target_idx]),': outlier for %s eye (%0.2f dva off)'%(eye, residual))
+                outliers.append(target_idx)
+
+        return(sorted(bad + list(outliers)))
+
+    def setCalibrationRetries(self, maxRetries=2, minPoints=3, outlierResidual=1.0):
+
+        # adaptive LiveTrack calibration:
+        # maxRetries: number of times failed / outlier targets are shown again after the first sweep
+        # minPoints: fewest good points per eye to accept the calibration (otherwise: start over)
+        # outlierResidual: (dva) minimum residual to count a point as outlier, relative to a polynomial fit
+        if not isinstance(maxRetries, int) or maxRetries < 0:
+            raise Warning("maxRetries must be a non-negative integer")
+        if not isinstance(minPoints, int) or minPoints < 3:
+            raise Warning("minPoints must be an integer of at least 3")
+        if not isinstance(outlierResidual, numbers.Number) or outlierResidual <= 0:
+            raise Warning("outlierResidual must be a positive number")
+
+        self.__calibrationRetries = { 'maxRetries'      : maxRetries,
+                                      'minPoints'       : minPoints,
+                                      'outlierResidual' : outlierResidual }
 
     def __DM_calibrate(self):
+        self.resetDrift()
         self.__N_calibrations += 1
         self.comment('calibration %d'%(self.__N_calibrations))
     
@@ -1006,6 +1062,8 @@ class EyeTracker:
             calibrations['left']  = self.LiveTrack.GetCalibration(eye=0)
         if self.trackEyes[1]:
             calibrations['right'] = self.LiveTrack.GetCalibration(eye=1)
+        if hasattr(self, 'calibrationFixations'):
+            calibrations['fixations'] = self.calibrationFixations
 
         # write calibration info to a json file:
         filename = '%s/calibration_%s.json'%(self.filefolder, self.__N_calibrations)
@@ -1015,9 +1073,83 @@ class EyeTracker:
                    indent=4)
         out_file.close()
 
+        # validate() adds the quality metrics and puts it in the calibration store:
+        self.__calibrationRecord = { 'kind'        : 'calibration',
+                                     'n'           : self.__N_calibrations,
+                                     'calibration' : calibrations,
+                                     'viewPos'     : [float(x) for x in self.psychopyWindow.viewPos] }
+
     def __DM_savecalibration(self):
         print('not saving 1:1 mouse calibration')
 
+    def restorecalibration(self, confirm=True):
+        raise Warning("default function: tracker not set")
+
+    def __EL_restorecalibration(self, confirm=True):
+        print('not restoring calibrations for the EyeLink')
+        return(False)
+
+    def __LT_restorecalibration(self, confirm=True):
+
+        # reuse the most recent good calibration of this participant (if the participant hasn't moved),
+        # and check it with a short validation instead of calibrating from scratch
+        # returns True if the restored calibration passed, False if the caller should calibrate
+
+        if self.calibrationStore == None:
+            return(False)
+        record = self.calibrationStore.latest(kind='calibration', accepted=True)
+        if record == None:
+            return(False)
+
+        eyes = [eye for eye, track in zip(['left', 'right'], self.trackEyes) if track]
+        if not all([eye in record['calibration'].keys() for eye in eyes]):
+            print('NOTE: previous calibration did not track the same eyes, not restoring')
+            return(False)
+        if not np.allclose(record['viewPos'], self.psychopyWindow.viewPos):
+            print('NOTE: previous calibration was done with another window position, not restoring')
+            return(False)
+
+        if confirm:
+            self.__prompt('restore calibration from %s?\n(accuracy %0.2f dva)\n\n[ SPACE ]  restore and check\n[ C ]  calibrate'%(record['timestamp'], record['quality']['accuracy'])).draw()
+            self.psychopyWindow.flip()
+
+            k = ['']
+            while k[0] not in ['c','space']:
+                k = event.waitKeys()
+            event.clearEvents(eventType='keyboard')
+            self.psychopyWindow.flip()
+
+            if k[0] == 'c':
+                return(False)
+
+        for eye in eyes:
+            cal, viewDist, xGlintMedian, yGlintMedian = record['calibration'][eye]
+            self.LiveTrack.SetCalibration({'left':0, 'right':1}[eye], cal, viewDist, xGlintMedian, yGlintMedian)
+
+        self.LiveTrack.SetResultsTypeCalibrated()
+        self.resetDrift()
+
+        if 'fixations' in record['calibration'].keys():
+            self.calibrationFixations = record['calibration']['fixations']
+
+        self.__N_calibrations = self.__nextCalibrationIndex()
+        self.comment('calibration %d restored from %d'%(self.__N_calibrations, record['n']))
+        self.savecalibration()
+
+        # a short check with fewer targets:
+        if self.validate(confirm=False, nTargets=3):
+            return(True)
+
+        print('restored calibration did not pass validation: calibrating')
+        return(False)
+
+    def __DM_restorecalibration(self, confirm=True):
+        return(False)
+
+    def __nextCalibrationIndex(self):
+
+        return(allocateIndex(self.filefolder, 'calibration_', exists=lambda x: os.path.isfile(os.path.join(self.filefolder, 'calibration_%d.json'%(x)))))
+
     
     # endregion
 
@@ -1068,10 +1200,20 @@ class EyeTracker:
 
         # filename = self.saneFilename(self.filename, ext='.csv')
 
+        # samples from before the file are not part of the recording:
+        self.__LT_bufferedSamples()
 
         print(os.path.join(self.filefolder,self.filename)+'.csv')
         self.LiveTrack.SetDataFilename(os.path.join(self.filefolder,self.filename)+'.csv')
 
+        # the file only gets calibrated gaze: the raw vectors of the same samples go in a second file,
+        # for offline recalibration (gazeCalibration.py)
+        vectorFilename = os.path.join(self.filefolder,self.filename)+'_vectors.csv'
+        newFile = not os.path.isfile(vectorFilename)
+        self.__vectorFile = open(vectorFilename, 'a')
+        if newFile:
+            self.__vectorFile.write(','.join(vectorColumns) + '\n')
+
         self.__fileOpen = True
         self.__N_rawdatafiles += 1
 
@@ -1173,6 +1315,10 @@ class EyeTracker:
     def __LT_closefile(self):
         if self.__fileOpen:
             self.LiveTrack.CloseDataFile()
+            # (after the data file: every sample in it has its vectors)
+            self.__LT_bufferedSamples()
+            self.__vectorFile.close()
+            self.__vectorFile = None
             self.__fileOpen = False
         else:
             print('no file to close, moving on')
@@ -1248,6 +1394,14 @@ class EyeTracker:
                 else:
                     sample['right'] = np.array([np.NaN, np.NaN])
 
+        # pupil size for blink detection (0 when not tracked), averaged over tracked eyes:
+        pupils = []
+        if self.trackEyes[0]:
+            pupils.append(data.PupilMajorAxis if data.Tracked else 0)
+        if self.trackEyes[1]:
+            pupils.append(data.PupilMajorAxisRight if data.TrackedRight else 0)
+        sample['pupil'] = np.mean(pupils)
+
         if self.samplemode == 'average':
             X = []
             Y = []
@@ -1263,6 +1417,74 @@ class EyeTracker:
 
         return(sample)
 
+    def __LT_bufferedSamples(self):
+
+        # takes all samples out of the device buffer (everything that empties it goes through here),
+        # and writes their raw pupil-glint vectors to the vector file when one is open
+        if self.LiveTrack.GetResultsCount() == 0:
+            return([])
+        data = self.LiveTrack.GetBufferedEyePositions(1, -1, 1)
+
+        if len(data) and self.__vectorFile != None:
+            columns = [self.LiveTrack.GetFieldAsList(data, 'Timestamp')]
+            for suffix in ['', 'Right']:
+                tracked = np.array(self.LiveTrack.GetFieldAsList(data, 'Tracked' + suffix), dtype=bool)
+                for field in ['VectX', 'VectY', 'GlintX', 'GlintY']:
+                    columns.append(np.where(tracked, self.LiveTrack.GetFieldAsList(data, field + suffix), np.nan))
+            np.savetxt(self.__vectorFile, np.column_stack(columns), fmt=['%d'] + ['%0.5f']*8, delimiter=',')
+
+        return(data)
+
+    def flushVectors(self):
+        raise Warning("default function: tracker not set")
+
+    def __LT_flushVectors(self):
+
+        # empties the device buffer into the vector file: the buffer holds a limited time of samples,
+        # so this has to be done regularly during a recording (e.g. once per trial)
+        # returns the number of samples
+        return(len(self.__LT_bufferedSamples()))
+
+    def __EL_flushVectors(self):
+        # (the EDF file has the raw data)
+        return(0)
+
+    def __DM_flushVectors(self):
+        return(0)
+
+    def __LT_validationSamples(self):
+
+        # all samples the device buffered since the last call (at the sample rate, not once per frame),
+        # as time (s) and calibrated gaze, averaged over the tracked eyes that the sample mode uses,
+        # and the raw vectors per tracked eye ({'left': [vectX, vectY], ...}, NaN when not tracked)
+        data = self.__LT_bufferedSamples()
+        if len(data) == 0:
+            return([], [], [], {})
+
+        t = np.array(self.LiveTrack.GetFieldAsList(data, 'Timestamp'), dtype=float) / 1e6
+        X, Y = [], []
+        vectors = {}
+        for eye, suffix in [[0, ''], [1, 'Right']]:
+            if not self.trackEyes[eye]:
+                continue
+            tracked = np.array(self.LiveTrack.GetFieldAsList(data, 'Tracked' + suffix), dtype=bool)
+            vectors[['left', 'right'][eye]] = [ np.where(tracked, self.LiveTrack.GetFieldAsList(data, 'VectX' + suffix), np.nan),
+                                                np.where(tracked, self.LiveTrack.GetFieldAsList(data, 'VectY' + suffix), np.nan) ]
+            if (self.samplemode == 'left' and eye == 1) or (self.samplemode == 'right' and eye == 0):
+                continue
+            X.append(np.where(tracked, self.LiveTrack.GetFieldAsList(data, 'GazeX' + suffix), np.nan))
+            Y.append(np.where(tracked, self.LiveTrack.GetFieldAsList(data, 'GazeY' + suffix), np.nan))
+        if len(X) == 0:
+            return([], [], [], {})
+
+        with warnings.catch_warnings():
+            # (samples where no eye was tracked stay NaN)
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            x = np.nanmean(X, axis=0)
+            y = np.nanmean(Y, axis=0)
+
+        return(list(t), list(x), list(y), vectors)
+
     def __DM_lastsample(self):
         # print('not implemented: getting last dummy mouse sample')
         data = np.array(self.__mousetracker.getPos())
@@ -1291,6 +1513,28 @@ class EyeTracker:
 
         sample = self.lastsample()
         check_samples = self.getSamplesToCheck()
+
+        self.bufferSample(sample, check_samples)
+        self.__lap('sample')
+
+        # the fixation location is shifted by the drift (gaze - offset vs fixloc == gaze vs fixloc + offset)
+        # so the samples in the buffer stay as they came from the tracker
+        fixated = self.__checkFixation(sample, check_samples, np.array(fixloc) + self.gazeOffset)
+
+        # during a short blink, keep the decision from before the blink started:
+        if not fixated and self.maxBlinkDur != None:
+            blinkStart = self.blinkOnset()
+            if blinkStart != None:
+                fixated = self.__heldVerdict(blinkStart - self.blinkPadding[0])
+                self.__verdicts.append((self.gazeBuffer.latest(1)[0,0], fixated, True))
+                self.__lap('fixation')
+                return(fixated)
+
+        self.__verdicts.append((self.gazeBuffer.latest(1)[0,0], fixated, False))
+        self.__lap('fixation')
+        return(fixated)
+
+    def __checkFixation(self, sample, check_samples, fixloc):
         
         for cs in check_samples: # skipping irrelevant sample types
             if cs in sample.keys():
@@ -1304,7 +1548,89 @@ class EyeTracker:
 
         return(True) # should only get here if all samples exist, are not nans, and are within the fixation window
 
+    def setBlinkTolerance(self, maxBlinkDur=None, padBefore=0.05, padAfter=0.10):
+
+        # samples that are missing (not tracked / collapsed pupil) for at most maxBlinkDur
+        # plus padAfter are treated as a blink, not as a fixation break
+        # set maxBlinkDur to None to treat every missing sample as a fixation break
+        if maxBlinkDur == None:
+            self.maxBlinkDur = None
+        elif isinstance(maxBlinkDur, numbers.Number) and maxBlinkDur > 0:
+            self.maxBlinkDur = maxBlinkDur
+        else:
+            raise Warning("maxBlinkDur must be None or a number larger than 0")
+        self.blinkPadding = [padBefore, padAfter]
+        self.__verdicts = deque(maxlen=250)
+
+    def blinkOnset(self):
+
+        # start time of the blink the most recent sample is in (None if not in a blink, or if it's too long)
+        # uses the same detection as the offline scoring, on the tail of the gaze buffer
+        tail = self.gazeBuffer.latest(self.gazeBuffer.capacity)
+        now = tail[0,-1]
+        tail = tail[:, tail[0] >= now - (self.maxBlinkDur + self.blinkPadding[1] + 0.25)]
+        if tail.shape[1] < 2:
+            return(None)
+
+        # the buffer is filled once per frame, not at the tracker sample rate:
+        rate = 1 / max(np.median(np.diff(tail[0])), 0.001)
+        pupil = None if np.all(np.isnan(tail[3])) else np.nan_to_num(tail[3], nan=0)
+        mask = blinkMask(tail[0], pupil=pupil, x=tail[1], sampleRate=rate, padBefore=0, padAfter=self.blinkPadding[1])
+        if not mask[-1]:
+            return(None)
+
+        clean = np.flatnonzero(~mask)
+        if len(clean) == 0:
+            # blink started before the inspected tail: too long
+            return(None)
+        start = tail[0, clean[-1]+1]
+        if (now - start) > (self.maxBlinkDur + self.blinkPadding[1]):
+            return(None)
+
+        return(start)
+
+    def __heldVerdict(self, before):
+
+        # the last decision on a clean sample, taken at or before the given time
+        for t, verdict, held in reversed(self.__verdicts):
+            if t <= before and not held:
+                return(verdict)
+        return(False)
+
+    def bufferSample(self, sample, check_samples=None):
+
+        # store the (average of the) checked samples in the ring buffer
+        # missing or untracked samples are stored as NaN, so gaps stay visible
+        if check_samples == None:
+            check_samples = self.getSamplesToCheck()
+        xy = [sample[cs] for cs in check_samples if cs in sample.keys()]
+        if len(xy) and not np.all(np.isnan(xy)):
+            xy = np.nanmean(xy, axis=0)
+        else:
+            xy = [np.nan, np.nan]
+        pupil = sample['pupil'] if 'pupil' in sample.keys() else np.nan
+        self.gazeBuffer.append(time.time(), xy[0], xy[1], pupil)
+
+    def gazeVelocity(self, method='central', window=7):
+
+        # current gaze speed in deg/s, computed the same way as in the offline scoring
+        return(self.gazeBuffer.velocity(method=method, window=window))
+
+    def setFrameTimer(self, timer=None):
+
+        # a frameTiming.frameTimer that gets the time spent on getting samples and checking fixation
+        # (in gazeInFixationWindow) and the frames of waitForFixation, None to not time anything
+        self.frameTimer = timer
+
+    def __lap(self, section):
+
+        if self.frameTimer != None:
+            self.frameTimer.lap(section)
 
+    def __pauseTimer(self):
+
+        if self.frameTimer != None:
+            self.frameTimer.pause()
 
     def getSamplesToCheck(self):
 
@@ -1345,11 +1671,17 @@ class EyeTracker:
 
         fixationStart = None
 
+        if self.frameTimer != None:
+            self.frameTimer.setPhase('waitForFixation')
+
         while now < timeout:
 
             for stim in fixationStimuli:
                 stim.draw()
+            self.__lap('draw')
             self.psychopyWindow.flip()
+            if self.frameTimer != None:
+                self.frameTimer.flipped()
 
             now = time.time()
 
@@ -1360,12 +1692,248 @@ class EyeTracker:
                     fixationStart = now
                 else:
                     if (now - fixationStart) >= minFixDur:
+                        self.__addDriftEpoch(fixationStart, fixloc)
+                        self.__pauseTimer()
                         return True
             else:
                 fixationStart = None
-        
+
+        self.__pauseTimer()
         return False
 
+    def __addDriftEpoch(self, fixationStart, fixloc):
+
+        # the samples of a successful fixation tell us how far the calibration has drifted
+        t, x, y = self.gazeBuffer.latest()[:3]
+        epoch = t >= fixationStart
+        # (epochs further off than the fixation window, as it is now, are not drift)
+        self.drift.addEpoch(x[epoch], y[epoch], fixloc=fixloc, timestamp=t[-1], maxOffset=self.fixationWindow)
+
+        if self.applyDriftCorrection:
+            self.gazeOffset = self.drift.current()
+
+        if self.drift.exceeded():
+            print('WARNING: calibration drifted %0.2f dva (threshold %0.2f): recalibration recommended'%(self.drift.magnitude(), self.drift.threshold))
+
+    def driftcheck(self, targets=None, maxOffset=None, minFixDur=None, fixTimeout=None, dispersion=1.0):
+
+        # quick alternative to a full calibration: show one (or a few) targets, measure
+        # where the current calibration puts the gaze, and correct for the offset
+        # if the offset is larger than maxOffset, or differs between targets (not a simple shift),
+        # this falls back to a full calibration
+        # returns True if the offset was applied, False if a full calibration was run
+
+        if targets == None:
+            targets = [[0,0]]
+        if maxOffset == None:
+            maxOffset = self.fixationWindow
+        if minFixDur == None:
+            minFixDur = max(self.minFixDur, 0.3)
+        if fixTimeout == None:
+            fixTimeout = self.fixTimeout
+
+        self.comment('driftcheck start')
+
+        offsets = []
+        for target in targets:
+            self.target.pos = target
+            starttime = time.time()
+            offset = None
+            while (time.time() - starttime) < fixTimeout:
+                self.target.draw()
+                self.psychopyWindow.flip()
+
+                self.bufferSample(self.lastsample())
+
+                # a stable fixation: all samples of the last minFixDur valid and close together
+                t, x, y = self.gazeBuffer.latest()[:3]
+                recent = t >= (t[-1] - minFixDur)
+                if (t[-1] - starttime) < minFixDur or (t[-1] - t[recent][0]) < 0.9 * minFixDur:
+                    continue
+                if np.any(np.isnan(x[recent])) or np.any(np.isnan(y[recent])):
+                    continue
+                if max(np.ptp(x[recent]), np.ptp(y[recent])) > dispersion:
+                    continue
+                offset = np.array([np.median(x[recent]) - target[0], np.median(y[recent]) - target[1]])
+                break
+
+            if offset is None:
+                print('driftcheck: no stable fixation on target %s, running full calibration'%(str(target)))
+                self.comment('driftcheck failed')
+                self.__recalibrate()
+                return(False)
+            offsets.append(offset)
+
+        self.psychopyWindow.flip()
+
+        offsets = np.array(offsets)
+        offset = np.mean(offsets, axis=0)
+        spread = np.max(np.hypot(*(offsets - offset).T))
+
+        if np.hypot(*offset) > maxOffset or spread > maxOffset/2:
+            print('driftcheck: offset %0.2f dva (spread %0.2f), running full calibration'%(np.hypot(*offset), spread))
+            self.comment('driftcheck failed')
+            self.__recalibrate()
+            return(False)
+
+        # the new offset replaces the running drift estimate:
+        self.drift.setOffset(offset, timestamp=time.time())
+        self.gazeOffset = self.drift.current()
+
+        print('driftcheck: corrected offset of %0.2f dva'%(np.hypot(*offset)))
+        self.comment('driftcheck %0.4f %0.4f'%(offset[0], offset[1]))
+
+        return(True)
+
+    def __recalibrate(self):
+
+        # full calibration, until it validates (or the operator accepts it)
+        self.calibrate()
+        while not self.validate():
+            self.calibrate()
+
+    def setValidation(self, targets=None, nTargets=5, duration=0.8, settle=0.4, maxAccuracy=1.0, maxPrecision=0.5):
+
+        # validation after calibration (see validate):
+        # targets: list of [x,y] to show, or None to pick nTargets spread over the calibration targets
+        # duration: seconds of samples per target, collected after `settle` seconds (saccade + landing)
+        # maxAccuracy, maxPrecision: thresholds in dva for the offset and RMS sample-to-sample of each target
+        if targets is not None:
+            targets = np.array(targets, dtype=float)
+            if targets.ndim != 2 or targets.shape[1] != 2:
+                raise Warning("validation targets must be a list of [x,y] coordinates")
+        if not all([isinstance(x, numbers.Number) and x > 0 for x in [nTargets, duration, maxAccuracy, maxPrecision]]):
+            raise Warning("nTargets, duration, maxAccuracy and maxPrecision must be numbers larger than 0")
+
+        self.validation = { 'targets'      : targets,
+                            'nTargets'     : nTargets,
+                            'duration'     : duration,
+                            'settle'       : settle,
+                            'maxAccuracy'  : maxAccuracy,
+                            'maxPrecision' : maxPrecision }
+
+    def validate(self, confirm=True, nTargets=None):
+
+        # show a subset of the targets, and check the calibrated gaze on them
+        # per target: accuracy (offset from the target) and precision (RMS sample-to-sample, SD),
+        # from all samples the tracker recorded on the target (consecutive samples at the sample rate,
+        # with the drift offset removed)
+        # the metrics are stored in validation_<n>.json, next to calibration_<n>.json, with the median
+        # raw vectors per target (as 'fixations': a calibration can be fit from them, see gazeCalibration.py)
+        # returns True when accepted (or when the operator continues anyway), False to recalibrate
+        # (backends that don't give buffered samples, EyeLink and mouse, are not validated here: True)
+
+        if self.validationSamples == None:
+            return(True)
+
+        targets = self.validation['targets']
+        if nTargets == None:
+            nTargets = self.validation['nTargets']
+        if targets is None:
+            calTargets = np.array(self.__calibrationTargets, dtype=float)
+            targets = calTargets[spreadTargets(calTargets, n=nTargets)]
+        targets = targets[:nTargets]
+        targets = targets[targetTour(targets, start=0)[:-1]]
+
+        self.comment('validation start')
+
+        samples = []
+        targetVectors = []
+        for target in targets:
+            self.target.pos = target
+            onset = time.time()
+            settled = False
+            while (time.time() - onset) < (self.validation['settle'] + self.validation['duration']):
+                self.target.draw()
+                self.psychopyWindow.flip()
+                if not settled and (time.time() - onset) >= self.validation['settle']:
+                    # samples from the saccade to the target are dropped:
+                    self.validationSamples()
+                    settled = True
+            t, x, y, vectors = self.validationSamples()
+            samples.append((t, list(np.array(x) - self.gazeOffset[0]), list(np.array(y) - self.gazeOffset[1])))
+            targetVectors.append(vectors)
+
+        self.psychopyWindow.flip()
+
+        T, X, Y = padSamples(samples)
+        metrics = validationMetrics(X, Y, targets[:,0], targets[:,1])
+        accepted, passed = judgeValidation(metrics, maxAccuracy=self.validation['maxAccuracy'], maxPrecision=self.validation['maxPrecision'])
+        metrics['passed'] = passed
+
+        for i in range(len(targets)):
+            print('validation %s: accuracy %0.2f dva, precision %0.2f dva (RMS s2s) %0.2f dva (SD), %d samples%s'%(str(targets[i]), metrics['accuracy'][i], metrics['rms_s2s'][i], metrics['sd'][i], metrics['samples'][i], '' if passed[i] else '  <- FAIL'))
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            summary = 'mean accuracy %0.2f dva, mean precision %0.2f dva'%(np.nanmean(metrics['accuracy']), np.nanmean(metrics['rms_s2s']))
+        print('validation %s: %s'%('accepted' if accepted else 'REJECTED', summary))
+        self.comment('validation %s'%('accepted' if accepted else 'rejected'))
+
+        if self.storefiles:
+            # median raw vector per target and eye, in the same form as the calibration fixations:
+            fixations = {}
+            with warnings.catch_warnings():
+                # (NaN for a target without tracked samples)
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                for eye in [eye for eye, tracked in zip(['left', 'right'], self.trackEyes) if tracked]:
+                    medians = [[float(np.nanmedian(v)) for v in vectors.get(eye, [[np.nan], [np.nan]])] for vectors in targetVectors]
+                    fixations[eye] = { 'targetX' : [float(target[0]) for target in targets],
+                                       'targetY' : [float(target[1]) for target in targets],
+                                       'vectX'   : [median[0] for median in medians],
+                                       'vectY'   : [median[1] for median in medians] }
+
+            filename = '%s/validation_%s.json'%(self.filefolder, self.__N_calibrations)
+            out_file = open(filename, "w")
+            json.dump( dict(metricsToDict(metrics), accepted=accepted, thresholds={'accuracy':self.validation['maxAccuracy'], 'precision':self.validation['maxPrecision']}, fixations=fixations),
+                       fp=out_file,
+                       indent=4)
+            out_file.close()
+
+        self.lastValidation = dict(metrics, accepted=accepted)
+
+        if self.calibrationStore != None and self.__calibrationRecord != None:
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                quality = { 'accuracy'  : float(np.nanmean(metrics['accuracy'])),
+                            'precision' : float(np.nanmean(metrics['rms_s2s'])) }
+            self.calibrationStore.append(dict(self.__calibrationRecord, accepted=accepted, quality=quality, validation=metricsToDict(metrics)))
+            self.__calibrationRecord = None
+
+        if accepted or not confirm:
+            return(accepted)
+
+        # let the operator decide:
+        self.__prompt('calibration not accurate enough\n%s\n\n[ R ]  recalibrate\n[ SPACE ]  continue anyway'%(summary)).draw()
+        self.psychopyWindow.flip()
+
+        k = ['']
+        while k[0] not in ['r','space']:
+            k = event.waitKeys()
+        event.clearEvents(eventType='keyboard')
+        self.psychopyWindow.flip()
+
+        return(k[0] == 'space')
+
+    def setDriftCorrection(self, apply=True, threshold=1.5, window=5):
+
+        # apply: shift the fixation checks by the estimated drift
+        # threshold: drift in dva above which driftExceeded() is True
+        # window: number of recent fixations used for the estimate
+        if not isinstance(threshold, numbers.Number) or threshold <= 0:
+            raise Warning("drift threshold must be a number larger than 0")
+        self.applyDriftCorrection = apply
+        self.drift = driftEstimator(threshold=threshold, window=window)
+        self.resetDrift()
+
+    def resetDrift(self):
+
+        self.drift.reset()
+        self.gazeOffset = np.zeros(2)
+
+    def driftExceeded(self):
+
+        return(self.drift.exceeded())
+
 
 
 
@@ -1459,26 +2027,65 @@ class EyeTracker:
     #     self.shutdown()
 
 
+    def __prompt(self, text):
+
+        # the operator prompts include numbers (accuracy, dates), so they can't be cached screens:
+        # the same stim gets the new text
+        if self.__promptStim == None:
+            self.__promptStim = visual.TextStim(self.psychopyWindow, text, height=1, wrapWidth=30, color='black')
+        elif self.__promptStim.text != text:
+            self.__promptStim.text = text
+
+        return(self.__promptStim)
+
     def __createTargetStim(self):
         
         # should these be accessible / changeble by the user?
         fixDotInDeg  = 0.2 # inner circle
         fixDotOutDeg = 1.0
         
+        # (no borders: the line width doesn't show, but newer psychopy versions can't make a circle with width 0)
         self.target = visual.TargetStim(self.psychopyWindow, 
                                         name='fixTarget',
                                         radius=fixDotOutDeg/2, 
                                         innerRadius=fixDotInDeg/2, 
                                         fillColor=[-1,-1,-1], 
                                         innerFillColor=[1,1,1], 
-                                        lineWidth=0, 
-                                        innerLineWidth=0, 
+                                        lineWidth=1, 
+                                        innerLineWidth=1, 
                                         borderColor=None, 
                                         innerBorderColor=None,
                                         units='deg')
 
 
 
+# text screens that have been laid out, per window (TextStim layout is slow, and allocates textures):
+textScreens = {}
+
+def textScreen(win, text, height=1, wrapWidth=15, color='black'):
+
+    key = (win, text, height, wrapWidth, str(color))
+    if not key in textScreens.keys():
+        textScreens[key] = visual.TextStim(win, text, height=height, wrapWidth=wrapWidth, color=color)
+
+    return(textScreens[key])
+
+def prewarmTextScreens(win, texts, **kwargs):
+
+    # lay out all screens of a session at the start, and draw them once (so their textures are
+    # uploaded), then clear the back buffer: nothing is shown
+    for text in texts:
+        textScreen(win, text, **kwargs).draw()
+    win.clearBuffer()
+
+def forgetTextScreens(win):
+
+    # the screens keep their window (and its textures) alive: drop them before closing it
+    for key in [key for key in textScreens.keys() if key[0] is win]:
+        del textScreens[key]
+
+
+
 def localizeSetup( trackEyes, filefolder, filename, location=None, glasses='RG', colors=None, task=None, ID=None, noEyeTracker=False, offset=[0,0] ):
     
     # sanity checks on trackEyes, filefolder and filename are done by the eyetracker object
@@ -1491,6 +2098,9 @@ def localizeSetup( trackEyes, filefolder, filename, location=None, glasses='RG',
             location = 'toronto'
         if location in ['Glasgow', 'glasgow', 'gla', 'GLA', 'g', 'G', 'EGPF']:
             location = 'glasgow'
+        if location in ['simulated', 'sim']:
+            # the Toronto setup, in a window on the first screen, with a simulated LiveTrack (soak tests)
+            location = 'simulated'
     else:
         raise Warning("set location to a string: Glasgow or Toronto")
 
@@ -1509,7 +2119,7 @@ def localizeSetup( trackEyes, filefolder, filename, location=None, glasses='RG',
                     colors['back']   = [ 0.55,  0.45, -1.00] 
                     colors['red']    = [ 0.55, -1.00, -1.00]
                     colors['blue']   = [-1.00,  0.45, -1.00]
-                if location == 'toronto':
+                if location in ['toronto', 'simulated']:
                     colors['back']   = [ 0.5,  0.5, -1.0 ]
                     colors['red']    = [ 0.5, -1.0, -1.0 ]
                     colors['blue']   = [-1.0,  0.5, -1.0 ]
@@ -1550,7 +2160,9 @@ def localizeSetup( trackEyes, filefolder, filename, location=None, glasses='RG',
 
         tracker = 'eyelink'
 
-    if location == 'toronto':
+    fullscr = True
+
+    if location in ['toronto', 'simulated']:
         # color calibrated monitor:
         gammaGrid = np.array([ [  0., 135.44739,  2.4203537, np.nan, np.nan, np.nan  ],
                                [  0.,  27.722954, 2.4203537, np.nan, np.nan, np.nan  ],
@@ -1568,15 +2180,20 @@ def localizeSetup( trackEyes, filefolder, filename, location=None, glasses='RG',
         # 2 * (np.arctan(29.4/49.53)/np.pi)*180
         # = 2 * 30.69 degrees.... 61.385 degrees
 
+    if location == 'simulated':
+        screen  = 0
+        fullscr = False
+        tracker = 'simulated'
+
     mymonitor = monitors.Monitor(name='temp',
                                  distance=distance,
                                  width=size[0])
-    if location == 'toronto':
+    if location in ['toronto', 'simulated']:
         mymonitor.setGammaGrid(gammaGrid)
     mymonitor.setSizePix(resolution)
 
     #win = visual.Window([1000, 500], allowGUI=True, monitor='ccni', units='deg', fullscr=True, color = back_col, colorSpace = 'rgb')
-    win = visual.Window(resolution, monitor=mymonitor, allowGUI=True, units='deg', fullscr=True, color=colors['back'], colorSpace = 'rgb', screen=screen)
+    win = visual.Window(resolution, monitor=mymonitor, allowGUI=True, units='deg', fullscr=fullscr, color=colors['back'], colorSpace = 'rgb', screen=screen)
             # size = [34.5, 19.5]filefolder,
 
     fixation = visual.ShapeStim(win, 
@@ -1622,7 +2239,7 @@ def localizeSetup( trackEyes, filefolder, filename, location=None, glasses='RG',
                         calibrationpoints = 5,
                         colors            = colors )
 
-        if location == 'toronto':
+        if location in ['toronto', 'simulated']:
             if not tracker == 'mouse':
                 ET.initialize(calibrationPoints = np.array([[0,0],   [-10.437,0],[0,5.916],[10.437,0],[0,-5.916]                                 ]) )
             else:
@@ -1726,33 +2343,24 @@ def getColors(colors={}, task=None, ID=None):
         return(colors)
 
     ## colour (eye) parameters
-    all_files = glob('data/' + task + '/color/' + ID + '_col_cal*.txt')
-    if len(all_files) == 0:
+    col_param = participantStore(task).latest(ID, 'color')
+    if col_param == None:
         # no color calibration done, skip
-        print('NO color calibration found:')
-        print('data/' + task + '/color/' + ID + '_col_cal*.txt')
+        print('NO color calibration found for %s in: data/%s'%(ID, task))
         return(colors)
 
-    # find the largest color calibration file index:
-    idx = np.argmax([int(os.path.splitext(os.path.basename(x))[0].split('_')[3]) for x in all_files])
-    
-    col_file = open(all_files[idx],'r')
-    col_param = col_file.read().replace('\t','\n').split('\n')
-    col_file.close()
     # print(col_param)
     # let's flip this depending on the task run, in each of the experiments?
-    # col_ipsi = eval(col_param[3]) if hemifield == 'left' else eval(col_param[5]) # left or right
-    # col_cont = eval(col_param[5]) if hemifield == 'left' else eval(col_param[3]) # right or left
     
     # so use the left / right things for now
-    colors['left']  = eval(col_param[3])
-    colors['right'] = eval(col_param[5])
+    colors['left']  = col_param['left']
+    colors['right'] = col_param['right']
 
     # 'both' should be defined in 1 way... up for grabs how, afaic
     # colors['both']  = [-0.7, -0.7, -0.7] # from 2nd FBE version of the distance task
 
     # this comes down to black in ALL cases:
-    colors['both']  = [eval(col_param[3])[1], eval(col_param[5])[0], -1]
+    colors['both']  = [col_param['left'][1], col_param['right'][0], -1]
     # print(colors)
     return(colors)
 
@@ -1771,26 +2379,20 @@ def makeBlindSpotMarkers(win, task, ID, colors):
     hemifields = []
 
     ## read blindspot parameters... if any...
-    left_files = glob(os.path.join('data', task, 'mapping', ID + '_LH_blindspot*.txt' ) )
-    if len(left_files):
-        idx = np.argmax([int(os.path.splitext(os.path.basename(x))[0].split('_')[3]) for x in left_files])
-        bs_file = open(left_files[idx], 'r')
-        bs_param = bs_file.read().replace('\t','\n').split('\n')
-        bs_file.close()
-        spot_left_cart = eval(bs_param[1])
+    store = participantStore(task)
+
+    bs_param = store.latest(ID, 'blindspot_left')
+    if bs_param != None:
+        spot_left_cart = bs_param['position']
         spot_left = cart2pol(spot_left_cart[0], spot_left_cart[1])
-        spot_left_size = eval(bs_param[3])
+        spot_left_size = bs_param['size']
         hemifields.append('left')
 
-    right_files = glob(os.path.join('data', task, 'mapping', ID + '_RH_blindspot*.txt' ) )
-    if len(right_files):
-        idx = np.argmax([int(os.path.splitext(os.path.basename(x))[0].split('_')[3]) for x in right_files])
-        bs_file = open(right_files[idx],'r')
-        bs_param = bs_file.read().replace('\t','\n').split('\n')
-        bs_file.close()
-        spot_righ_cart = eval(bs_param[1])
+    bs_param = store.latest(ID, 'blindspot_right')
+    if bs_param != None:
+        spot_righ_cart = bs_param['position']
         spot_righ = cart2pol(spot_righ_cart[0], spot_righ_cart[1])
-        spot_righ_size = eval(bs_param[3])
+        spot_righ_size = bs_param['size']
         hemifields.append('right')
 
     # print(hemifields)
@@ -1839,6 +2441,11 @@ def makeBlindSpotMarkers(win, task, ID, colors):
 
 class fusionStim:
 
+    # checkerboard-like patch of randomly coloured squares, to help fusion of the two eyes' images
+    # the element array is only rebuilt when the number or size of the squares changes:
+    # a new trial (resetProperties) just reshuffles the colours in place, and a new position
+    # only updates the element positions
+
     def __init__(self, 
                  win, 
                  pos     = [0,0],
@@ -1856,22 +2463,46 @@ class fusionStim:
         self.square  = square
         self.units   = units
 
+        # seeded from the random module, so the tasks' random.seed() still makes sessions reproducible:
+        self.rng = np.random.default_rng(random.getrandbits(32))
+
+        self.elementArray = None
+        self.__geometry = None
+        self.__layout = None
+
         self.resetProperties()
 
     def resetProperties(self):
         self.nElements = (self.columns*2 + 1) * (self.rows*2 + 1)
 
-        self.setColorArray()
-        self.setPositions()
-        self.createElementArray()
+        geometry = (self.rows, self.columns, self.square, self.units, tuple(np.array(self.colors, dtype=float).flatten()))
+        layout = tuple(self.pos)
+
+        if geometry != self.__geometry:
+            # enough copies of the colours to fill all squares:
+            self.__colorPool = np.tile(np.array(self.colors, dtype=float), (int(np.ceil(self.nElements/len(self.colors))), 1))
+            self.setColorArray()
+            self.setPositions()
+            self.createElementArray()
+        else:
+            self.setColorArray()
+            self.elementArray.colors = self.colorArray
+            if layout != self.__layout:
+                self.setPositions()
+                self.elementArray.xys = self.xys
+
+        self.__geometry = geometry
+        self.__layout = layout
 
     def setColorArray(self):
-        self.colorArray = (self.colors * int(np.ceil(((self.columns*2 + 1) * (self.rows*2 + 1))/len(self.colors))))
-        random.shuffle(self.colorArray)
-        self.colorArray = self.colorArray[:self.nElements]
+        # shuffle the colours in place, and use as many as there are squares:
+        self.rng.shuffle(self.__colorPool, axis=0)
+        # (a copy: the element array may keep a reference, and the pool is shuffled again next trial)
+        self.colorArray = self.__colorPool[:self.nElements].copy()
 
     def setPositions(self):
-        self.xys = [[(i*self.square)+self.pos[0], (j*self.square)+self.pos[1]] for i in range(-self.columns, self.columns+1) for j in range(-self.rows, self.rows+1)]
+        i, j = np.meshgrid(np.arange(-self.columns, self.columns+1), np.arange(-self.rows, self.rows+1), indexing='ij')
+        self.xys = np.stack([i.flatten()*self.square + self.pos[0], j.flatten()*self.square + self.pos[1]], axis=1)
 
     def createElementArray(self):
         self.elementArray = visual.ElementArrayStim( win         = self.win, 
@@ -1885,3 +2516,110 @@ class fusionStim:
 
     def draw(self):
         self.elementArray.draw()
+
+
+
+class elementLayer:
+
+    # the dots, crosses and blind spot marker of a trial, packed into one element array per shape
+    # (circles and plus signs), so a frame needs 1 or 2 draw calls instead of 1 per stimulus
+    # elements are hidden by setting their opacity to 0: in the trial loop only visibility,
+    # positions or colours change, and only the changed attributes are sent to the element array
+    #
+    # usage:
+    # -  layer = elementLayer(win)
+    # -  layer.add('point_1', shape='plus', size=2, color=col_both)
+    # -  layer.add('blindspot', pos=blindspot.pos, size=blindspot.size, color=colors[hemifield])
+    # -  layer.build()
+    # -  layer.setVisible('point_1', False); layer.setPos('point_3', [1,2]); layer.draw()
+
+    def __init__(self, win, units='deg'):
+
+        self.win = win
+        self.units = units
+
+        self.__index = {}
+        self.__elements = {'circle':[], 'plus':[]}
+        self.__data = {}
+        self.__stims = {}
+        self.__changed = {'circle':set(), 'plus':set()}
+
+    def add(self, name, shape='circle', pos=[0,0], size=1, color=[-1,-1,-1], ori=0, visible=True):
+
+        if not shape in self.__elements.keys():
+            raise Warning("shape must be 'circle' or 'plus'")
+        if name in self.__index.keys():
+            raise Warning("element already exists: %s"%(name))
+        if len(self.__stims):
+            raise Warning("add all elements before building the layer")
+
+        size = np.array(size, dtype=float) * np.ones(2)
+        self.__index[name] = (shape, len(self.__elements[shape]))
+        self.__elements[shape].append([pos[0], pos[1], size[0], size[1], color[0], color[1], color[2], ori, float(visible)])
+
+    def build(self):
+
+        for shape, elements in self.__elements.items():
+            if len(elements) == 0:
+                continue
+            elements = np.array(elements, dtype=float)
+            self.__data[shape] = { 'xys'       : elements[:,0:2],
+                                   'sizes'     : elements[:,2:4],
+                                   'colors'    : elements[:,4:7],
+                                   'oris'      : elements[:,7],
+                                   'opacities' : elements[:,8] }
+            self.__stims[shape] = visual.ElementArrayStim( win         = self.win,
+                                                           nElements   = len(elements),
+                                                           units       = self.units,
+                                                           colorSpace  = 'rgb',
+                                                           elementTex  = None,
+                                                           elementMask = {'circle':'circle', 'plus':plusMask()}[shape],
+                                                           sfs         = 0,
+                                                           interpolate = True,
+                                                           **{attribute: np.copy(values) for attribute, values in self.__data[shape].items()} )
+
+    def __set(self, name, attribute, value):
+
+        shape, idx = self.__index[name]
+        if np.any(self.__data[shape][attribute][idx] != value):
+            self.__data[shape][attribute][idx] = value
+            self.__changed[shape].add(attribute)
+
+    def setPos(self, name, pos):
+        self.__set(name, 'xys', pos)
+
+    def setSize(self, name, size):
+        self.__set(name, 'sizes', size)
+
+    def setColor(self, name, color):
+        self.__set(name, 'colors', color)
+
+    def setOri(self, name, ori):
+        self.__set(name, 'oris', ori)
+
+    def setVisible(self, name, visible=True):
+        self.__set(name, 'opacities', float(visible))
+
+    def hideAll(self):
+        for name in self.__index.keys():
+            self.setVisible(name, False)
+
+    def draw(self):
+
+        for shape, stim in self.__stims.items():
+            # send only what changed since the last frame:
+            for attribute in self.__changed[shape]:
+                setattr(stim, attribute, np.copy(self.__data[shape][attribute]))
+            self.__changed[shape].clear()
+            if np.any(self.__data[shape]['opacities'] > 0):
+                stim.draw()
+
+
+def plusMask(resolution=64, width=0.2):
+
+    # mask for element arrays: a plus sign with arms `width` wide (as a fraction of the element size),
+    # the same shape as the plus / cross ShapeStims in the saccade task
+    coords = np.abs(np.linspace(-1, 1, resolution))
+    inside = (coords[np.newaxis,:] <= width) | (coords[:,np.newaxis] <= width)
+
+    return(np.where(inside, 1.0, -1.0))
@@ -33,13 +33,41 @@ import pandas as pd
 
 import sys
 sys.path.append(os.path.join('..', 'EyeTracking'))
-from EyeTracking import localizeSetup
+from EyeTracking import localizeSetup, elementLayer, textScreen, prewarmTextScreens, forgetTextScreens
+from frameTiming import warmUp, frameTimer
+from fileAllocation import allocateIndex
+from profiling import profilingRequested, callProfiler
+
+
+def sessionPlan(n_blocks=4):
+
+    # the conditions, and the order of the trials in each block (shuffled with the random module,
+    # so this depends on the random.seed() set for the participant)
+    bs_tilt = [0, 90, 0] * 6
+    ad_tilt = [90, 0, 0] * 6
+    eye = ['both'] * 3 + ['ipsi'] * 3 + ['contra'] * 3 + ['both'] * 3 + ['ipsi'] * 3 + ['contra'] * 3
+    dist_diff = [-2] * 9 + [2] * 9
+
+    conditions = pd.DataFrame({'bs_tilt': bs_tilt, 'ad_tilt': ad_tilt, 'eye': eye, 'dist_diff': dist_diff})
+
+    cond_idx = list(range(len(conditions)))
+    blocks = []
+    for block_no in range(n_blocks):
+        block_def = {}
+        block_def['block_no'] = block_no
+        random.shuffle(cond_idx)
+        block_def['trials'] = copy.deepcopy(cond_idx)
+        block_def['instructions'] = 'press space to calibrate\n\nand start block ' + str(block_no+1) + ' / ' + str(n_blocks)
+        blocks.append(block_def)
+
+    return(conditions, blocks)
+
 
 ######
 #### Initialize experiment
 ######
 
-def doHVperceptionTask(ID=None, hemifield=None, location=None):
+def doHVperceptionTask(ID=None, hemifield=None, location=None, profile=None):
 
     ## files
     # expInfo = {'ID':'test', 'hemifield':['left','right']}
@@ -86,19 +114,15 @@ def doHVperceptionTask(ID=None, hemifield=None, location=None):
 
 
     # create data output filename:
-    x = 1
     # filename = '_dist_' + ('LH' if hemifield == 'left' else 'RH') + '_' + ID + '_'
     filename = ID + '_HVpercept_' + ('LH' if hemifield == 'left' else 'RH') + '_'
-    while (filename + str(x) + '.csv') in os.listdir(data_path):
-        x += 1
+    x = allocateIndex(data_path, filename, exists=lambda x: os.path.exists(data_path + filename + str(x) + '.csv'))
 
     csv_filename = data_path + filename + str(x) + '.csv'
 
     # create eye-tracking output filename:
-    x = 1
     et_filename = 'HVpr' + ('LH' if hemifield == 'left' else 'RH')
-    while len(glob(eyetracking_path + et_filename + str(x) + '.*')):
-        x += 1
+    x = allocateIndex(eyetracking_path, et_filename, exists=lambda x: len(glob(eyetracking_path + et_filename + str(x) + '.*')) > 0)
 
     # get everything shared from central:
     setup = localizeSetup(location=location, trackEyes=trackEyes, filefolder=eyetracking_path, filename=et_filename+str(x), task='perception', ID=ID) # data path is for the mapping data, not the eye-tracker data!
@@ -142,12 +166,29 @@ def doHVperceptionTask(ID=None, hemifield=None, location=None):
 
     blindspot = setup['blindspotmarkers'][hemifield]
     # print(blindspot.fillColor)
+
+    # the points and the blind spot marker are drawn together (point_1 - point_4 only keep the positions):
+    layer = elementLayer(win)
+    layer.add('blindspot', pos=blindspot.pos, size=blindspot.size, color=colors[hemifield])
+    for name in ['point_1', 'point_2', 'point_3', 'point_4']:
+        layer.add(name, size=1, color=col_both, visible=False)
+    layer.build()
     
     fixation   = setup['fixation']
     fixation_x = setup['fixation_x']
 
     tracker = setup['tracker']
 
+    # tracker calls and flips are only timed when asked for (profile=True, or HV_PROFILE=1):
+    profiler = None
+    if profilingRequested(profile):
+        profiler = callProfiler()
+        profiler.attach(tracker)
+        profiler.attach(win, methods=['flip'], category='window')
+
+    # a blink during the adjustment is not a fixation break (the dots are not hidden for it):
+    tracker.setBlinkTolerance(maxBlinkDur=0.5)
+
     # additional hardware is a mouse object:
 
     mouse = event.Mouse(visible=False, win=win) #invisible
@@ -251,23 +292,7 @@ def doHVperceptionTask(ID=None, hemifield=None, location=None):
 
     # conditions = pd.DataFrame({'bs_tilt': bs_tilt, 'ad_tilt': ad_tilt, 'eye': eye, 'dist_diff': dist_diff})
 
-    bs_tilt = [0, 90, 0] * 6
-    ad_tilt = [90, 0, 0] * 6
-    eye = ['both'] * 3 + ['ipsi'] * 3 + ['contra'] * 3 + ['both'] * 3 + ['ipsi'] * 3 + ['contra'] * 3
-    dist_diff = [-2] * 9 + [2] * 9
-
-    conditions = pd.DataFrame({'bs_tilt': bs_tilt, 'ad_tilt': ad_tilt, 'eye': eye, 'dist_diff': dist_diff})
-
-    cond_idx = list(range(len(conditions)))
-    blocks = []
-    n_blocks = 4
-    for block_no in range(n_blocks):
-        block_def = {}
-        block_def['block_no'] = block_no
-        random.shuffle(cond_idx)
-        block_def['trials'] = copy.deepcopy(cond_idx)
-        block_def['instructions'] = 'press space to calibrate\n\nand start block ' + str(block_no+1) + ' / ' + str(n_blocks)
-        blocks.append(block_def)
+    conditions, blocks = sessionPlan(n_blocks=4)
 
     block_idx = 0
     trial_idx = 0
@@ -288,12 +313,26 @@ def doHVperceptionTask(ID=None, hemifield=None, location=None):
              'final_dist':   []}
 
 
+    instructions = 'Throughout the task, use the mouse adjust the upper dot pair so that the distance between the dots matches the distance of the lower pair.\n\nPress space to continue.'
+    end_text = 'THE END\n\nThanks!'
+
+    # draw every stimulus once, so the first trial doesn't pay for shader compilation and texture uploads:
+    warmUp(win, {'fixation'           : fixation,
+                 'fixation_x'         : fixation_x,
+                 'fusion hi'          : hiFusion,
+                 'fusion lo'          : loFusion,
+                 'points'             : layer,
+                 'calibration target' : tracker.target})
+
+    # lay out all text screens of the session now, so block transitions don't have to:
+    prewarmTextScreens(win, [instructions, end_text] + [block['instructions'] for block in blocks])
+
+    # time every frame of the gaze-contingent loops, the summary goes next to the eye-tracker file:
+    timer = frameTimer(budget=win.monitorFramePeriod)
+    tracker.setFrameTimer(timer)
+
     # show first instructions
-    visual.TextStim(win,
-        'Throughout the task, use the mouse adjust the upper dot pair so that the distance between the dots matches the distance of the lower pair.\n\nPress space to continue.', 
-        height = 1, 
-        wrapWidth=15,
-        color = 'black').draw()
+    textScreen(win, instructions).draw()
     win.flip()
     k = ['wait']
     while k[0] not in ['space']:
@@ -349,6 +388,10 @@ def doHVperceptionTask(ID=None, hemifield=None, location=None):
         point_1.pos = [bs_pos[0] + temp_pos[0], bs_pos[1] + temp_pos[1]]
         point_2.pos = [bs_pos[0] - temp_pos[0], bs_pos[1] - temp_pos[1]]
 
+        for name, point in [['point_1', point_1], ['point_2', point_2], ['point_3', point_3], ['point_4', point_4]]:
+            layer.setPos(name, point.pos)
+            layer.setColor(name, point_color)
+
         distance = (test_dist+dist_diff)/2
         mouse.setPos([0, distance*mouse_factor]) # set the mouse to the starting position for the adjustable pair
         
@@ -357,11 +400,7 @@ def doHVperceptionTask(ID=None, hemifield=None, location=None):
 
         if trial_idx == 0:
             # show instruction to start with eye-tracker calibration
-            visual.TextStim(win,
-                blocks[block_idx]['instructions'], 
-                height = 1, 
-                wrapWidth=15,
-                color = 'black').draw()
+            textScreen(win, blocks[block_idx]['instructions']).draw()
             win.flip()
             k = ['wait']
             while k[0] not in ['space']:
@@ -372,7 +411,11 @@ def doHVperceptionTask(ID=None, hemifield=None, location=None):
             # calibration
             # tracker.openfile()
             # tracker.startcollecting()
-            tracker.calibrate()
+            # at the start of the session, a previous good calibration can be reused:
+            if not (block_idx == 0 and tracker.restorecalibration()):
+                tracker.calibrate()
+                while not tracker.validate():
+                    tracker.calibrate()
 
         waiting_for_response = True
 
@@ -395,21 +438,22 @@ def doHVperceptionTask(ID=None, hemifield=None, location=None):
             k = event.getKeys(['r']) # shouldn't this be space? like after the stimulus? this is confusing...
             # recalibrate if previous calibration failed...
             if k and 'r' in k:
-                print('recalibrating...')
-                tracker.calibrate()
+                print('drift check...')
+                tracker.driftcheck()
         
         fixation.pos = [0,0]
 
+        timer.setTrial(block_idx, trial_idx)
         tracker.waitForFixation()
 
 
+        timer.setPhase('adjust')
         while waiting_for_response:
             
             # show fixation
             # show fusion stimuli
             hiFusion.draw()
             loFusion.draw()
-            blindspot.draw()
 
             t = time.time() % 1
             draw_pair_1 = True
@@ -425,11 +469,9 @@ def doHVperceptionTask(ID=None, hemifield=None, location=None):
             # - use mouse to adjust the distance of the adjustable pair
             # - check for response (e.g. spacebar press)
             
-            if tracker.gazeInFixationWindow(fixloc=fixation.pos):
+            fixating = tracker.gazeInFixationWindow(fixloc=fixation.pos)
+            if fixating:
                 fixation.draw()    
-                if draw_pair_1:
-                    point_1.draw()
-                    point_2.draw()
 
                 # adjustable points are points 3 & 4:
                 distance = mouse.getPos()[1]/mouse_factor
@@ -442,29 +484,39 @@ def doHVperceptionTask(ID=None, hemifield=None, location=None):
                 # print(p3p, p4p)
                 point_3.pos = p3p
                 point_4.pos = p4p
-
-                if draw_pair_2:
-                    point_3.draw()
-                    point_4.draw()
+                layer.setPos('point_3', p3p)
+                layer.setPos('point_4', p4p)
             else:
                 mouse.setPos([0, distance*mouse_factor]) # keep mouse at a reasonable position if not fixating
                 fixation_x.draw()
+
+            # points are only shown while fixating (the blind spot marker always):
+            layer.setVisible('point_1', fixating and draw_pair_1)
+            layer.setVisible('point_2', fixating and draw_pair_1)
+            layer.setVisible('point_3', fixating and draw_pair_2)
+            layer.setVisible('point_4', fixating and draw_pair_2)
+            layer.draw()
+            timer.lap('draw')
             
             win.flip()
+            timer.flipped()
 
             # either way, check keyboard for recalibration key (or quitting key)
             k = event.getKeys(['r', 'space']) # shouldn't this be space? like after the stimulus? this is confusing...
             if k and 'r' in k:
-                # recalibrate
+                # recenter (falls back to full calibration if the offset is too large)
                 # tracker.stopcollecting()
-                print('recalibrating...')
-                tracker.calibrate()
+                print('drift check...')
+                tracker.driftcheck()
+                timer.setPhase('adjust')
                 # tracker.startcollecting()
             if k and 'space' in k:
                 # response given, move on to next trial
                 rt = time.time() - start_time
                 waiting_for_response = False
 
+        timer.pause()
+
 
         # store the collected data in the data frame
         # 
@@ -484,6 +536,8 @@ def doHVperceptionTask(ID=None, hemifield=None, location=None):
         data['final_dist'].append(distance*2) 
 
         pd.DataFrame(data).to_csv(csv_filename, index=False)
+        # raw vectors of the trial, for offline recalibration (the device buffer doesn't hold a session):
+        tracker.flushVectors()
 
         print('recorded final distance: %0.3f dva'%(distance*2))
 
@@ -505,16 +559,20 @@ def doHVperceptionTask(ID=None, hemifield=None, location=None):
     tracker.closefile()
     tracker.shutdown()
 
-    visual.TextStim(win,
-        'THE END\n\nThanks!', 
-        height = 1, 
-        wrapWidth=15,
-        color = 'black').draw()
+    timer.save(eyetracking_path + et_filename + str(x) + '_timing.json')
+
+    if profiler != None:
+        profiler.detach()
+        profiler.saveSummary(eyetracking_path + et_filename + str(x) + '_profile.json')
+        profiler.saveTrace(eyetracking_path + et_filename + str(x) + '_trace.json')
+
+    textScreen(win, end_text).draw()
     win.flip()
     k = ['wait']
     while k[0] not in ['space']:
         k = event.waitKeys()
     
+    forgetTextScreens(win)
     win.close()
 
 
@@ -33,13 +33,43 @@ import pandas as pd
 
 import sys
 sys.path.append(os.path.join('..', 'EyeTracking'))
-from EyeTracking import localizeSetup
+from EyeTracking import localizeSetup, elementLayer, textScreen, prewarmTextScreens, forgetTextScreens
+from frameTiming import warmUp, frameTimer
+from criticalSection import criticalSection
+from deferredWork import deferredQueue
+from fileAllocation import allocateIndex
+from profiling import profilingRequested, callProfiler
+
+
+def sessionPlan(n_blocks=8):
+
+    # the conditions, and the order of the trials in each block (shuffled with the random module,
+    # so this depends on the random.seed() set for the participant)
+    bs_tilt = [0, 90, 0] * 6
+    aw_tilt = [90, 0, 0] * 6
+    eye = ['both'] * 3 + ['ipsi'] * 3 + ['contra'] * 3 + ['both'] * 3 + ['ipsi'] * 3 + ['contra'] * 3
+    tpair = ['BS'] * 9 + ['AW'] * 9 # target pair
+
+    conditions = pd.DataFrame({'bs_tilt': bs_tilt, 'aw_tilt': aw_tilt, 'eye': eye, 'tpair': tpair})
+
+    cond_idx = list(range(len(conditions)))
+    blocks = []
+    for block_no in range(n_blocks):
+        block_def = {}
+        block_def['block_no'] = block_no
+        random.shuffle(cond_idx)
+        block_def['trials'] = copy.deepcopy(cond_idx)
+        block_def['instructions'] = 'press space to calibrate\n\nand start block ' + str(block_no+1) + ' / ' + str(n_blocks)
+        blocks.append(block_def)
+
+    return(conditions, blocks)
+
 
 ######
 #### Initialize experiment
 ######
 
-def doHVsaccadeTask(ID=None, hemifield=None, location=None):
+def doHVsaccadeTask(ID=None, hemifield=None, location=None, profile=None):
 
     ## files
     # expInfo = {'ID':'test', 'hemifield':['left','right']}
@@ -86,19 +116,15 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
 
 
     # create data output filename:
-    x = 1
     # filename = '_dist_' + ('LH' if hemifield == 'left' else 'RH') + '_' + ID + '_'
     filename = ID + '_HVsaccades_' + ('LH' if hemifield == 'left' else 'RH') + '_'
-    while (filename + str(x) + '.csv') in os.listdir(data_path):
-        x += 1
+    x = allocateIndex(data_path, filename, exists=lambda x: os.path.exists(data_path + filename + str(x) + '.csv'))
 
     csv_filename = data_path + filename + str(x) + '.csv'
 
     # create eye-tracking output filename:
-    x = 1
     et_filename = 'HVsc' + ('LH' if hemifield == 'left' else 'RH')
-    while len(glob(eyetracking_path + et_filename + str(x) + '.*')):
-        x += 1
+    x = allocateIndex(eyetracking_path, et_filename, exists=lambda x: len(glob(eyetracking_path + et_filename + str(x) + '.*')) > 0)
 
     # get everything shared from central:
     setup = localizeSetup(location=location, trackEyes=trackEyes, filefolder=eyetracking_path, filename=et_filename+str(x), task='saccades', ID=ID) # data path is for the mapping data, not the eye-tracker data!
@@ -180,12 +206,28 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
 
     blindspot = setup['blindspotmarkers'][hemifield]
     # print(blindspot.fillColor)
+
+    # the points and the blind spot marker are drawn together (point_1 - point_4 only keep the positions):
+    layer = elementLayer(win)
+    layer.add('blindspot', pos=blindspot.pos, size=blindspot.size, color=colors[hemifield])
+    layer.add('point_1', shape='plus', size=2, color=col_both, ori=0)
+    layer.add('point_2', shape='plus', size=2, color=col_both, ori=45)
+    layer.add('point_3', size=1, color=col_both)
+    layer.add('point_4', size=1, color=col_both)
+    layer.build()
     
     fixation   = setup['fixation']
     fixation_x = setup['fixation_x']
 
     tracker = setup['tracker']
 
+    # tracker calls and flips are only timed when asked for (profile=True, or HV_PROFILE=1):
+    profiler = None
+    if profilingRequested(profile):
+        profiler = callProfiler()
+        profiler.attach(tracker)
+        profiler.attach(win, methods=['flip'], category='window')
+
     # additional hardware is a mouse object:
 
     mouse = event.Mouse(visible=False, win=win) #invisible
@@ -286,23 +328,7 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
     # and more of a stochastic approach: we need statistics and large N
 
 
-    bs_tilt = [0, 90, 0] * 6
-    aw_tilt = [90, 0, 0] * 6
-    eye = ['both'] * 3 + ['ipsi'] * 3 + ['contra'] * 3 + ['both'] * 3 + ['ipsi'] * 3 + ['contra'] * 3
-    tpair = ['BS'] * 9 + ['AW'] * 9 # target pair
-
-    conditions = pd.DataFrame({'bs_tilt': bs_tilt, 'aw_tilt': aw_tilt, 'eye': eye, 'tpair': tpair})
-
-    cond_idx = list(range(len(conditions)))
-    blocks = []
-    n_blocks = 8
-    for block_no in range(n_blocks):
-        block_def = {}
-        block_def['block_no'] = block_no
-        random.shuffle(cond_idx)
-        block_def['trials'] = copy.deepcopy(cond_idx)
-        block_def['instructions'] = 'press space to calibrate\n\nand start block ' + str(block_no+1) + ' / ' + str(n_blocks)
-        blocks.append(block_def)    
+    conditions, blocks = sessionPlan(n_blocks=8)    
 
     block_idx = 0
     trial_idx = 0
@@ -323,12 +349,36 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
              }
 
 
+    instructions = 'In each trial first fixate in the middle, while all targets are being shown. When they disappear first look at where the plus was, then the cross, then back to the plus.\n\nBlink and press space to end each trial.\n\nPress space to continue.'
+    end_text = 'THE END\n\nThank you for participating!'
+
+    # draw every stimulus once, so the first trial doesn't pay for shader compilation and texture uploads:
+    warmUp(win, {'fixation'           : fixation,
+                 'fixation_x'         : fixation_x,
+                 'fusion hi'          : hiFusion,
+                 'fusion lo'          : loFusion,
+                 'points'             : layer,
+                 'diamond'            : diamond,
+                 'calibration target' : tracker.target})
+
+    # lay out all text screens of the session now, so block transitions don't have to:
+    prewarmTextScreens(win, [instructions, end_text] + [block['instructions'] for block in blocks])
+
+    # time every frame of the gaze-contingent loops, the summary goes next to the eye-tracker file:
+    timer = frameTimer(budget=win.monitorFramePeriod)
+    tracker.setFrameTimer(timer)
+
+    # no garbage collection during the stimulus and the saccade recording (it's done after the trial,
+    # from the deferred work queue):
+    critical = criticalSection(collect=False)
+
+    # data file writes, trial markers and stimulus reshuffles wait for frames with time to spare:
+    queue = deferredQueue(budget=timer.budget / 3)
+    queue.add('fusion', hiFusion.resetProperties)
+    queue.add('fusion', loFusion.resetProperties)
+
     # show first instructions
-    visual.TextStim(win,
-        'In each trial first fixate in the middle, while all targets are being shown. When they disappear first look at where the plus was, then the cross, then back to the plus.\n\nBlink and press space to end each trial.\n\nPress space to continue.', 
-        height = 1, 
-        wrapWidth=15,
-        color = 'black').draw()
+    textScreen(win, instructions).draw()
     win.flip()
     k = ['wait']
     while k[0] not in ['space']:
@@ -407,11 +457,7 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
 
         if trial_idx == 0:
             # show instruction to start with eye-tracker calibration
-            visual.TextStim(win,
-                blocks[block_idx]['instructions'], 
-                height = 1, 
-                wrapWidth=15,
-                color = 'black').draw()
+            textScreen(win, blocks[block_idx]['instructions']).draw()
             win.flip()
             k = ['wait']
             while k[0] not in ['space']:
@@ -422,32 +468,30 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
             # calibration
             # tracker.openfile()
             # tracker.startcollecting()
-            tracker.calibrate()
+            # at the start of the session, a previous good calibration can be reused:
+            if not (block_idx == 0 and tracker.restorecalibration()):
+                tracker.calibrate()
+                while not tracker.validate():
+                    tracker.calibrate()
 
         waiting_for_response = True
 
-        hiFusion.resetProperties()
-        loFusion.resetProperties()
+        # trial markers, a couple of samples apart (sent while waiting for fixation, all in before the stimulus):
+        timer.setTrial(block_idx, trial_idx)
+        queue.add('marker', tracker.comment, 'block %d trial %d'%(block_idx, trial_idx), gap=2/500)
+        queue.add('marker', tracker.comment, 'BS tilt %d'%(bs_tilt), gap=2/500)
+        queue.add('marker', tracker.comment, 'AW tilt %d'%(aw_tilt), gap=2/500)
+        queue.add('marker', tracker.comment, 'target pair %s'%(tpair), gap=2/500)
+        queue.add('marker', tracker.comment, 'eye %s'%(eye), gap=2/500)
 
-        tracker.comment('block %d trial %d'%(block_idx, trial_idx))
-        time.sleep(2/500)
-        tracker.comment('BS tilt %d'%(bs_tilt))
-        time.sleep(2/500)
-        tracker.comment('AW tilt %d'%(aw_tilt))
-        time.sleep(2/500)
-        tracker.comment('target pair %s'%(tpair))
-        time.sleep(2/500)
-        tracker.comment('eye %s'%(eye))
-        time.sleep(2/500)
+        queue.add('marker', tracker.comment, 'point1 %0.4f %0.4f'%(point_1.pos[0], point_1.pos[1]), gap=2/500)
+        queue.add('marker', tracker.comment, 'point2 %0.4f %0.4f'%(point_2.pos[0], point_2.pos[1]), gap=2/500)
+        queue.add('marker', tracker.comment, 'point3 %0.4f %0.4f'%(point_3.pos[0], point_3.pos[1]), gap=2/500)
+        queue.add('marker', tracker.comment, 'point4 %0.4f %0.4f'%(point_4.pos[0], point_4.pos[1]), gap=2/500)
 
-        tracker.comment('point1 %0.4f %0.4f'%(point_1.pos[0], point_1.pos[1]))
-        time.sleep(2/500)
-        tracker.comment('point2 %0.4f %0.4f'%(point_2.pos[0], point_2.pos[1]))
-        time.sleep(2/500)
-        tracker.comment('point3 %0.4f %0.4f'%(point_3.pos[0], point_3.pos[1]))
-        time.sleep(2/500)
-        tracker.comment('point4 %0.4f %0.4f'%(point_4.pos[0], point_4.pos[1]))
-        time.sleep(2/500)
+        for name, point in [['point_1', point_1], ['point_2', point_2], ['point_3', point_3], ['point_4', point_4]]:
+            layer.setPos(name, point.pos)
+            layer.setColor(name, point_color)
 
 
 
@@ -460,14 +504,27 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
         waiting_for_fixation = True
         while waiting_for_fixation:
             fixation.draw()
+            queue.drain()
             win.flip()
             if tracker.gazeInFixationWindow(fixloc=fixation.pos):
                 waiting_for_fixation = False
+
+        # whatever is left (the markers have to be in the file before the stimulus):
+        queue.flush()
         
         fixation.pos = [0,0]
 
         tracker.waitForFixation()
 
+        # small drift is corrected by the tracker, only recalibrate when it gets too large:
+        if tracker.driftExceeded():
+            tracker.comment('drift %0.4f %0.4f'%(tracker.gazeOffset[0], tracker.gazeOffset[1]))
+            print('drift too large: recalibrating...')
+            tracker.calibrate()
+            while not tracker.validate():
+                tracker.calibrate()
+            tracker.waitForFixation()
+
         # # # # # # # # # # # # # # # # # # # # #
         #
         #          REAL    TRIAL    HERE
@@ -475,31 +532,31 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
         abort = False
         stimulus_start = time.time()
 
-        tracker.comment('stimulus on')
-        while (time.time() - stimulus_start) < .75 and not abort:
+        with critical:
+            tracker.comment('stimulus on')
+            timer.setPhase('stimulus')
+            while (time.time() - stimulus_start) < .75 and not abort:
 
-            if tracker.gazeInFixationWindow():
-                pass
-            else:
-                tracker.comment('fixation broken')
-                abort = True
+                if tracker.gazeInFixationWindow():
+                    pass
+                else:
+                    tracker.comment('fixation broken')
+                    abort = True
             
-            fixation.draw()
-            blindspot.draw()
-            loFusion.draw()
-            hiFusion.draw()
-
-            if (time.time() - stimulus_start) > .25:
-                point_1.draw()
-            if (time.time() - stimulus_start) > .50:
-                point_2.draw()
-            # other pair is always there:
-            point_3.draw()
-            point_4.draw()
+                fixation.draw()
+                loFusion.draw()
+                hiFusion.draw()
 
-            win.flip()
+                # the blind spot marker and the other pair are always there:
+                layer.setVisible('point_1', (time.time() - stimulus_start) > .25)
+                layer.setVisible('point_2', (time.time() - stimulus_start) > .50)
+                layer.draw()
+                timer.lap('draw')
 
+                win.flip()
+                timer.flipped()
 
+        timer.pause()
 
         if abort:
             # handle abort
@@ -523,12 +580,10 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
             # if k[0] in ['q']:
             #     print('quitting not implemented')
 
-                # r: recalibrate eye-tracker
+                # r: recenter eye-tracker (quick drift check, full calibration only if that fails)
             if k[0] in ['r']:
                 # if cfg['eyetracking']:
-                tracker.comment('calibration start')
-                tracker.calibrate()
-                tracker.comment('calibration done')
+                tracker.driftcheck()
 
 
             event.clearEvents(eventType='keyboard') #
@@ -547,55 +602,89 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
         leftFix = False
         recording = True
 
-        while recording:
-
-            gazeCheck = tracker.gazeInFixationWindow() 
-
-            if gazeCheck:
-                if leftFix:
-                    # left fixation, and at fixation... check time:
-                    if (time.time() - leftFixTime) > 0.3:
-                        # back at fixation:
-                        recording = False
-                        # print('back at fixation')
+        # participants blink before pressing space: a blink while gaze returns is not leaving fixation
+        # (the stimulus abort criterion above stays without blink tolerance)
+        tracker.setBlinkTolerance(maxBlinkDur=0.5)
+        with critical:
+            timer.setPhase('recording')
+            while recording:
+
+                gazeCheck = tracker.gazeInFixationWindow() 
+
+                if gazeCheck:
+                    if leftFix:
+                        # left fixation, and at fixation... check time:
+                        if (time.time() - leftFixTime) > 0.3:
+                            # back at fixation:
+                            recording = False
+                            # print('back at fixation')
+                        else:
+                            # at fixation and have left fixation less than 200 ms ago... can't have made 2 saccades: don't do anything
+                            pass
                     else:
-                        # at fixation and have left fixation less than 200 ms ago... can't have made 2 saccades: don't do anything
+                        # at fixation and not left fixation... start of trial: don't do anything
                         pass
                 else:
-                    # at fixation and not left fixation... start of trial: don't do anything
-                    pass
-            else:
-                if leftFix:
-                    # left fixation, and not at fixation... still making saccades: don't do anything
-                    pass
-                else:
-                    # do not leave fixation, and not at fixation: mark fixation as left:
-                    # print('left fixation')
-                    leftFix = True
-                    leftFixTime = time.time()
-
-            k = event.getKeys(['r']) # recalibrate during saccade recording interval? hmmmmm....
-            if k and 'r' in k:
-                # recalibrate
-                # tracker.stopcollecting()
-                print('recalibrating...')
-                tracker.calibrate()
-
-            fixation.draw()
-            win.flip()
+                    if leftFix:
+                        # left fixation, and not at fixation... still making saccades: don't do anything
+                        pass
+                    else:
+                        # do not leave fixation, and not at fixation: mark fixation as left:
+                        # print('left fixation')
+                        leftFix = True
+                        leftFixTime = time.time()
+
+                k = event.getKeys(['r']) # recalibrate during saccade recording interval? hmmmmm....
+                if k and 'r' in k:
+                    # recenter
+                    # tracker.stopcollecting()
+                    print('drift check...')
+                    # (not time-critical, and it may have to calibrate)
+                    critical.end()
+                    tracker.driftcheck()
+                    critical.begin()
+                    timer.setPhase('recording')
+
+                fixation.draw()
+                timer.lap('draw')
+                win.flip()
+                timer.flipped()
 
+        timer.pause()
+        tracker.setBlinkTolerance(maxBlinkDur=None)
         # print('out of loop')
 
         event.clearEvents(eventType='keyboard')
 
         tracker.comment('gaze returned') # not a good comment...
 
+        # store the collected data in the data frame
+        # (the csv is written, and the fusion stimuli reshuffled, while waiting for space and in the blink time)
+        data['participant'].append(ID)
+        data['hemifield'].append(hemifield)
+        data['blockno'].append(block_idx+1)
+        data['trialno'].append(trial_idx+1)
+        data['jitter'].append(jitter)
+        data['bs_tilt'].append(bs_tilt)
+        data['aw_tilt'].append(aw_tilt)
+        data['eye'].append(eye)
+        data['dist'].append(test_dist)
+        data['tpair'].append(tpair)
+
+        queue.add('data file', lambda: pd.DataFrame(data).to_csv(csv_filename, index=False), replace=True)
+        # raw vectors of the trial, for offline recalibration (the device buffer doesn't hold a session):
+        queue.add('raw vectors', tracker.flushVectors)
+        queue.add('fusion', hiFusion.resetProperties)
+        queue.add('fusion', loFusion.resetProperties)
+        queue.add('garbage collection', critical.collect)
+
         fixation.ori=45
 
         k = []
         while not(k):
             k = event.getKeys(['space']) # space for next trial trial
             fixation.draw()
+            queue.drain()
             win.flip()
         
         fixation.ori=0
@@ -605,6 +694,8 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
         waitStart = time.time()
 
         while (time.time() - waitStart) < 0.5: # half a second of extra blink time?
+            # (a late frame doesn't matter here: jobs that don't fit in a frame can run)
+            queue.drain(overrun=True)
             win.flip()
 
         tracker.comment('trial ended')
@@ -662,24 +753,6 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
         #         waiting_for_response = False
 
 
-        # store the collected data in the data frame
-        # 
-        # store the data frame as a csv:
-        # data.to_csv()
-
-        data['participant'].append(ID)
-        data['hemifield'].append(hemifield)
-        data['blockno'].append(block_idx+1)
-        data['trialno'].append(trial_idx+1)
-        data['jitter'].append(jitter)
-        data['bs_tilt'].append(bs_tilt)
-        data['aw_tilt'].append(aw_tilt)
-        data['eye'].append(eye)
-        data['dist'].append(test_dist)
-        data['tpair'].append(tpair)
-
-        pd.DataFrame(data).to_csv(csv_filename, index=False)
-
         # end of trial: increase trial & block indices
         trial_idx = trial_idx + 1
 
@@ -694,21 +767,26 @@ def doHVsaccadeTask(ID=None, hemifield=None, location=None):
 
 
 
-    # end of task: stop eye-tracker recording, show end screen
+    # end of task: write what's still waiting, stop eye-tracker recording, show end screen
+    queue.flush()
     tracker.stopcollecting()
     tracker.closefile()
     tracker.shutdown()
 
-    visual.TextStim(win,
-        'THE END\n\nThank you for participating!', 
-        height = 1, 
-        wrapWidth=15,
-        color = 'black').draw()
+    timer.save(eyetracking_path + et_filename + str(x) + '_timing.json', extra={'critical':critical.summary(), 'deferred':queue.summary()})
+
+    if profiler != None:
+        profiler.detach()
+        profiler.saveSummary(eyetracking_path + et_filename + str(x) + '_profile.json')
+        profiler.saveTrace(eyetracking_path + et_filename + str(x) + '_trace.json')
+
+    textScreen(win, end_text).draw()
     win.flip()
     k = ['wait']
     while k[0] not in ['space']:
         k = event.waitKeys()
     
+    forgetTextScreens(win)
     win.close()
 
 
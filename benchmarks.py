@@ -0,0 +1,328 @@
+# benchmarks of the hot paths of the experiments
+#
+# runs without a screen or an eye-tracker: the tracker is the simulated LiveTrack (simLiveTrack.py)
+# measured:
+# -  EyeTracker.lastsample and gazeInFixationWindow (per call)
+# -  LiveTrack.GetBufferedEyePositions and GetFieldAsList (100 - 1000 samples)
+# -  fusionStim.resetProperties (needs psychopy and a window, skipped if those can't be made)
+# -  the per-trial csv write of the tasks (the whole data frame is written after every trial)
+# -  reading and segmenting a LiveTrack data file (samples per second)
+# -  making the session plan of each task
+#
+# results are written as json, with information on the machine (and the git commit)
+# compare mode flags benchmarks that got slower than a stored baseline (exit code 1 if any)
+#
+# usage:
+# -  python benchmarks.py --out benchmarks_baseline.json
+# -  python benchmarks.py --out benchmarks_new.json --compare benchmarks_baseline.json [--tolerance 0.25]
+# -  python benchmarks.py --only lastsample,csv
+
+import os
+import sys
+import time
+import json
+import random
+import platform
+import argparse
+import tempfile
+import subprocess
+import numpy as np
+
+
+def measure(function, number=1000, repeats=7):
+
+    # time `number` calls, `repeats` times, and describe the time per call (in microseconds)
+    # the median over repeats is what gets compared, the minimum shows how fast it can go
+    times = []
+    for repeat in range(repeats):
+        start = time.perf_counter()
+        for i in range(number):
+            function()
+        times.append((time.perf_counter() - start) / number)
+    times = np.array(times) * 1e6
+
+    return({ 'median_us' : float(np.median(times)),
+             'min_us'    : float(np.min(times)),
+             'max_us'    : float(np.max(times)),
+             'number'    : number,
+             'repeats'   : repeats })
+
+
+def machineInfo():
+
+    info = { 'python'    : platform.python_version(),
+             'platform'  : platform.platform(),
+             'processor' : platform.processor() or platform.machine(),
+             'cpus'      : os.cpu_count(),
+             'hostname'  : platform.node(),
+             'numpy'     : np.__version__,
+             'time'      : time.strftime('%Y-%m-%d %H:%M:%S') }
+    try:
+        import pandas
+        info['pandas'] = pandas.__version__
+    except ImportError:
+        pass
+    try:
+        import psychopy
+        info['psychopy'] = psychopy.__version__
+    except ImportError:
+        pass
+    try:
+        info['commit'] = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        pass
+
+    return(info)
+
+
+# setting things up without screen or device:
+
+class virtualClock:
+
+    # time that only moves when told to
+    # tick: seconds added on every reading, so loops that wait for the time to pass still end
+
+    def __init__(self, start=0., tick=0.):
+        self.now = start
+        self.tick = tick
+
+    def __call__(self):
+        self.now += self.tick
+        return(self.now)
+
+    def advance(self, seconds):
+        self.now += seconds
+
+
+def headlessTracker():
+
+    # an EyeTracker on the simulated LiveTrack, without a psychopy window (no calibration screens)
+    from EyeTracking import EyeTracker
+
+    tracker = EyeTracker(tracker='simulated', trackEyes=[True, True], fixationWindow=2, minFixDur=0.2, fixTimeout=3,
+                         psychopyWindow=None, samplemode='average', colors={})
+    tracker.initialize()
+    tracker.LiveTrack.SetResultsTypeCalibrated()
+
+    return(tracker)
+
+
+def simulatedSession(filename, trials=144, seed=0):
+
+    # a LiveTrack data file of a saccade session: fixation, stimulus, two saccades and back, per trial
+    import simLiveTrack
+
+    clock = virtualClock()
+    simLiveTrack.setClock(clock)
+    simLiveTrack.seed(seed)
+    simLiveTrack.Init()
+    simLiveTrack.SetResultsTypeCalibrated()
+    simLiveTrack.StartTracking()
+    simLiveTrack.SetDataFilename(filename)
+
+    rng = random.Random(seed)
+    for trial in range(trials):
+        points = [[rng.choice([-1,1]) * rng.uniform(6, 12), rng.uniform(-4, 4)] for point in range(4)]
+        simLiveTrack.SetDataComment('block %d trial %d'%(trial // 18, trial % 18))
+        for i, point in enumerate(points):
+            simLiveTrack.SetDataComment('point%d %0.4f %0.4f'%(i+1, point[0], point[1]))
+        for t, x, y, comment in [ [1.00, 0, 0, 'stimulus on'],
+                                  [0.75, 0, 0, 'stimulus off'],
+                                  [0.25, points[0][0], points[0][1], None],
+                                  [0.30, points[1][0], points[1][1], None],
+                                  [0.30, 0, 0, 'gaze returned'] ]:
+            clock.advance(t)
+            simLiveTrack.lookAt(x, y)
+            if comment != None:
+                simLiveTrack.SetDataComment(comment)
+        clock.advance(0.5)
+        simLiveTrack.blink(0.15)
+        clock.advance(0.5)
+
+    simLiveTrack.CloseDataFile()
+    simLiveTrack.StopTracking()
+    simLiveTrack.setClock(time.perf_counter)
+
+
+# the benchmarks, each returns a dictionary of results:
+
+def benchLastsample():
+
+    tracker = headlessTracker()
+    results = { 'lastsample'           : measure(tracker.lastsample, number=2000),
+                'gazeInFixationWindow' : measure(tracker.gazeInFixationWindow, number=2000) }
+    tracker.LiveTrack.StopTracking()
+
+    return(results)
+
+
+def benchBuffered():
+
+    import simLiveTrack
+
+    clock = virtualClock()
+    simLiveTrack.setClock(clock)
+    simLiveTrack.Init()
+    simLiveTrack.SetResultsTypeCalibrated()
+    simLiveTrack.StartTracking()
+    clock.advance(3)
+    simLiveTrack.GetResultsCount()
+
+    results = {}
+    for n in [100, 250, 500, 1000]:
+        results['GetBufferedEyePositions_%d'%(n)] = measure(lambda: simLiveTrack.GetBufferedEyePositions(0, n, 0), number=20)
+        data = simLiveTrack.GetBufferedEyePositions(0, n, 0)
+        results['GetFieldAsList_%d'%(n)] = measure(lambda: simLiveTrack.GetFieldAsList(data, 'VectX'), number=100)
+
+    simLiveTrack.StopTracking()
+    simLiveTrack.setClock(time.perf_counter)
+
+    return(results)
+
+
+def benchFusion():
+
+    # needs a window: skipped when there is no display
+    from psychopy import visual
+    from EyeTracking import fusionStim
+
+    win = visual.Window([400, 400], units='pix', fullscr=False, allowGUI=False)
+    try:
+        stim = fusionStim(win, pos=[0,0], units='pix', square=10)
+        results = { 'fusionStim.resetProperties' : measure(stim.resetProperties, number=200) }
+    finally:
+        win.close()
+
+    return(results)
+
+
+def benchCsv():
+
+    import pandas as pd
+
+    # the data of the saccade task, after n trials:
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'data.csv')
+        for n in [1, 72, 144]:
+            data = { 'participant' : ['p01'] * n,
+                     'hemifield'   : ['left'] * n,
+                     'blockno'     : list(range(n)),
+                     'trialno'     : list(range(n)),
+                     'jitter'      : [0.] * n,
+                     'bs_tilt'     : [90] * n,
+                     'aw_tilt'     : [0] * n,
+                     'eye'         : ['both'] * n,
+                     'dist'        : [11.5] * n,
+                     'tpair'       : ['BS'] * n }
+            results['trial csv write_%d'%(n)] = measure(lambda: pd.DataFrame(data).to_csv(filename, index=False), number=20)
+
+    return(results)
+
+
+def benchRawFile():
+
+    from saccadeScoring import readLiveTrackFile, segmentTrials
+
+    results = {}
+    with tempfile.TemporaryDirectory() as folder:
+        filename = os.path.join(folder, 'HVscLH1.csv')
+        simulatedSession(filename, trials=72)
+        samples = len(readLiveTrackFile(filename))
+
+        results['readLiveTrackFile'] = measure(lambda: readLiveTrackFile(filename), number=1, repeats=5)
+        df = readLiveTrackFile(filename)
+        results['segmentTrials'] = measure(lambda: segmentTrials(df), number=5, repeats=5)
+
+    for name in ['readLiveTrackFile', 'segmentTrials']:
+        results[name]['samples'] = samples
+        results[name]['samples_per_s'] = samples / (results[name]['median_us'] / 1e6)
+
+    return(results)
+
+
+def benchSessionPlan():
+
+    # the task modules need psychopy
+    import HVsaccadesBS
+    import HVperceptionBS
+
+    return({ 'sessionPlan saccades'   : measure(HVsaccadesBS.sessionPlan, number=50),
+             'sessionPlan perception' : measure(HVperceptionBS.sessionPlan, number=50) })
+
+
+benchmarks = { 'lastsample'  : benchLastsample,
+               'buffered'    : benchBuffered,
+               'fusion'      : benchFusion,
+               'csv'         : benchCsv,
+               'rawfile'     : benchRawFile,
+               'sessionplan' : benchSessionPlan }
+
+
+def runBenchmarks(only=None):
+
+    results = {}
+    skipped = {}
+    for name, benchmark in benchmarks.items():
+        if only != None and not name in only:
+            continue
+        print('running %s...'%(name))
+        try:
+            results.update(benchmark())
+        except Exception as error:
+            # (missing psychopy, or no display)
+            print('NOTE: skipped %s: %s'%(name, error))
+            skipped[name] = str(error)
+
+    return({'machine':machineInfo(), 'results':results, 'skipped':skipped})
+
+
+def compareResults(results, baseline, tolerance=0.25):
+
+    # benchmarks of which the median time per call went up by more than the tolerance (fraction)
+    if baseline['machine'].get('hostname') != results['machine'].get('hostname'):
+        print('NOTE: baseline is from a different machine (%s), differences may not be due to the code'%(baseline['machine'].get('hostname')))
+
+    regressions = []
+    print('%-36s %12s %12s %8s'%('benchmark', 'baseline us', 'now us', 'ratio'))
+    for name in sorted(results['results'].keys()):
+        if not name in baseline['results'].keys():
+            print('%-36s %12s %12.2f %8s'%(name, '-', results['results'][name]['median_us'], 'new'))
+            continue
+        before = baseline['results'][name]['median_us']
+        after = results['results'][name]['median_us']
+        ratio = after / before
+        flag = ''
+        if ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = '  SLOWER'
+        print('%-36s %12.2f %12.2f %8.2f%s'%(name, before, after, ratio, flag))
+
+    return(regressions)
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='benchmarks of the experiment hot paths')
+    parser.add_argument('--out', default=None, help='json file for the results')
+    parser.add_argument('--compare', default=None, help='json file with baseline results')
+    parser.add_argument('--tolerance', default=0.25, type=float, help='allowed slow-down (fraction) before a benchmark is flagged')
+    parser.add_argument('--only', default=None, help='comma separated benchmarks to run: ' + ','.join(benchmarks.keys()))
+    args = parser.parse_args()
+
+    results = runBenchmarks(only=None if args.only == None else args.only.split(','))
+
+    if args.out != None:
+        with open(args.out, 'w') as out_file:
+            json.dump(results, fp=out_file, indent=4)
+
+    if args.compare != None:
+        with open(args.compare, 'r') as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compareResults(results, baseline, tolerance=args.tolerance)
+        if len(regressions):
+            print('%d benchmark(s) slower than the baseline: %s'%(len(regressions), ', '.join(regressions)))
+            sys.exit(1)
+    else:
+        for name, result in results['results'].items():
+            print('%-36s %12.2f us'%(name, result['median_us']))
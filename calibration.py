@@ -9,10 +9,17 @@ TWCF IIT vs PP experiment 2a
 
 import sys, os
 sys.path.append(os.path.join('..', 'EyeTracking'))
-from EyeTracking import localizeSetup, EyeTracker
+from EyeTracking import localizeSetup, EyeTracker, textScreen, forgetTextScreens
+from participantStore import participantStore
+from fileAllocation import allocateIndex
+from frameTiming import frameTimer
+from screenshots import screenshotWriter
+from blindSpotStaircase import radialMapping
+from inputIntegration import inputIntegrator
 
 import math
 import time
+import json
 import random
 import copy
 import os
@@ -119,6 +126,8 @@ def doColorCalibration(ID=None, task=None, location=None):
 
 
     step = 0.0015 # RGB color space has 256 values so the step should be 2/256, but that moves too fast
+    # (that was per frame: as a rate it's the same speed as at 60 Hz, at any refresh rate)
+    controls = inputIntegrator(rate=step * 60)
 
     frameN = 0
     while 1:
@@ -158,27 +167,19 @@ def doColorCalibration(ID=None, task=None, location=None):
 
         if allow_calibration:
             if glasses == 'RG':
-                if pyg_keyboard[key.LEFT]:
-                    red_col[0]  = max(-1, red_col[0]  - step)
-                if pyg_keyboard[key.RIGHT]:
-                    red_col[0]  = min( 1, red_col[0]  + step)
-                if pyg_keyboard[key.UP]:
-                    blue_col[1] = min( 1, blue_col[1] + step)
-                if pyg_keyboard[key.DOWN]:
-                    blue_col[1] = max(-1, blue_col[1] - step)
+                red_col[0]  = max(-1, red_col[0]  - controls.held('left',  pyg_keyboard[key.LEFT]))
+                red_col[0]  = min( 1, red_col[0]  + controls.held('right', pyg_keyboard[key.RIGHT]))
+                blue_col[1] = min( 1, blue_col[1] + controls.held('up',    pyg_keyboard[key.UP]))
+                blue_col[1] = max(-1, blue_col[1] - controls.held('down',  pyg_keyboard[key.DOWN]))
                 if pyg_keyboard[key.R]:
                     print('threshold found', red_col)
                 if pyg_keyboard[key.B]:
                     print('threshold found', blue_col)
             elif glasses == 'RB':
-                if pyg_keyboard[key.LEFT]:
-                    red_col[0]  = max(-1, red_col[0]  - step)
-                if pyg_keyboard[key.RIGHT]:
-                    red_col[0]  = min( 1, red_col[0]  + step)
-                if pyg_keyboard[key.UP]:
-                    blue_col[2] = min( 1, blue_col[2] + step)
-                if pyg_keyboard[key.DOWN]:
-                    blue_col[2] = max(-1, blue_col[2] - step)
+                red_col[0]  = max(-1, red_col[0]  - controls.held('left',  pyg_keyboard[key.LEFT]))
+                red_col[0]  = min( 1, red_col[0]  + controls.held('right', pyg_keyboard[key.RIGHT]))
+                blue_col[2] = min( 1, blue_col[2] + controls.held('up',    pyg_keyboard[key.UP]))
+                blue_col[2] = max(-1, blue_col[2] - controls.held('down',  pyg_keyboard[key.DOWN]))
 
 
         dot_red_left.fillColor   = red_col
@@ -211,6 +212,7 @@ def doColorCalibration(ID=None, task=None, location=None):
         event.clearEvents(eventType='keyboard')
 
         cfg['hw']['win'].flip()
+        controls.tick()
 
 
         # if calibration_triggered:
@@ -224,8 +226,7 @@ def doColorCalibration(ID=None, task=None, location=None):
         #     calibration_triggered = False
 
     # open file here:
-    x = 1
-    while (filename + str(x) + '.txt') in os.listdir(data_path): x += 1
+    x = allocateIndex(data_path, filename, exists=lambda x: os.path.exists(data_path + filename + str(x) + '.txt'))
     respFile = open(data_path + filename + str(x) + '.txt','w')
     # write data to file:
     respFile.write('background:\t[{:.8f},{:.8f},{:.8f}]\nred:\t[{:.8f},{:.8f},{:.8f}]\ngreen:\t[{:.8f},{:.8f},{:.8f}]'.format( \
@@ -234,6 +235,13 @@ def doColorCalibration(ID=None, task=None, location=None):
     blue_col[0], blue_col[1], blue_col[2]))
     respFile.close()
 
+    # and in the participant store, where the experiments read it:
+    participantStore(task).add( ID, 'color', 
+                                background = [float(c) for c in back_col],
+                                left       = [float(c) for c in red_col],
+                                right      = [float(c) for c in blue_col],
+                                source     = data_path + filename + str(x) + '.txt' )
+
 
     # to CLI:
     print("background: " + str(back_col))
@@ -243,6 +251,7 @@ def doColorCalibration(ID=None, task=None, location=None):
     # cfg['hw']['tracker'].stopcollecting()
     # cfg['hw']['tracker'].closefile()
     cfg['hw']['tracker'].shutdown()
+    forgetTextScreens(cfg['hw']['win'])
     cfg['hw']['win'].close() # should be after tracker shutdown, since tracker may use the window still...
 
 
@@ -253,7 +262,12 @@ def doColorCalibration(ID=None, task=None, location=None):
 
 
 
-def doBlindSpotMapping(ID=None,task=None,location=None,offset=[0,0]):
+def doBlindSpotMapping(ID=None,task=None,location=None,offset=[0,0],screenshot='png',thumbnail=None,mode='manual'):
+
+    # mode: 'manual' (the marker is moved and resized with the keys) or 'automated' (staircases along
+    # radial directions, see automatedMapping, after which the marker can still be adjusted before accepting)
+    # screenshot: format of the picture of the mapped blind spot ('png', 'jpg', 'bmp', or None for no picture)
+    # thumbnail: longest side (pixels) of a downscaled picture, None for the full screen
     
     askQuestions = False
     expInfo = {}
@@ -367,13 +381,37 @@ def doBlindSpotMapping(ID=None,task=None,location=None,offset=[0,0]):
 
     cfg['hw']['tracker'].startcollecting()
 
-    for hemifield in ['left', 'right']:
+    # position and size change at a rate per second (step per frame at 60 Hz), speeding up when keys are held:
+    controls = inputIntegrator(rate=step * 60)
+
+    # time every frame of the mapping loop (one 'trial' per hemifield):
+    timer = frameTimer(budget=cfg['hw']['win'].monitorFramePeriod)
+    cfg['hw']['tracker'].setFrameTimer(timer)
+
+    # screenshots are written by a background thread, the mapping goes on right away:
+    if screenshot != None:
+        writer = screenshotWriter(format=screenshot, thumbnail=thumbnail)
+
+    # the window is shifted away from the mapped blind spot in some tasks (the calibration is for one window position):
+    viewPositions = { 'saccades'                 : {'left':[ 10,-5], 'right':[-10,-5]},
+                      'distUpScaledAsynchronous' : {'left':[ 10, 0], 'right':[-10, 0]} }.get(task, None)
+
+    # once per session: the last good calibration if the participant hasn't moved, otherwise a new one
+    if viewPositions != None:
+        cfg['hw']['win'].viewPos = viewPositions['left']
+    if not cfg['hw']['tracker'].restorecalibration():
+        cfg['hw']['tracker'].calibrate()
+        while not cfg['hw']['tracker'].validate():
+            cfg['hw']['tracker'].calibrate()
+
+    for hemifield_idx, hemifield in enumerate(['left', 'right']):
 
-        if task == 'saccades':
-            if hemifield == 'left':
-                cfg['hw']['win'].viewPos = [ 10,-5]
-            if hemifield == 'right':
-                cfg['hw']['win'].viewPos = [-10,-5]
+        if viewPositions != None and not np.allclose(cfg['hw']['win'].viewPos, viewPositions[hemifield]):
+            # a new window position needs its own calibration:
+            cfg['hw']['win'].viewPos = viewPositions[hemifield]
+            cfg['hw']['tracker'].calibrate()
+            while not cfg['hw']['tracker'].validate():
+                cfg['hw']['tracker'].calibrate()
 
         abort = False
 
@@ -383,20 +421,18 @@ def doBlindSpotMapping(ID=None,task=None,location=None,offset=[0,0]):
             # win = visual.Window([1920,1080],allowGUI=True, monitor='ccni', units='deg', viewPos = [0,0], fullscr = True)
             # win = visual.Window(resolution, allowGUI=True, monitor=mymonitor, units='deg', viewPos = [0,0], fullscr=True, screen=1)
             point = visual.Circle(cfg['hw']['win'], size = [1,1], pos = [-7,-1], fillColor=colors['left'], lineColor = None, units='deg')
-            if task == 'distUpScaledAsynchronous':
-                cfg['hw']['win'].viewPos = [10,0]
-                # cfg['hw']['fusion']['lo'].pos = [-10,-7] # does this even make sense? should just be the old position...
-                # cfg['hw']['fusion']['hi'].pos = [-10,7]
+            # distUpScaledAsynchronous:
+            # cfg['hw']['fusion']['lo'].pos = [-10,-7] # does this even make sense? should just be the old position...
+            # cfg['hw']['fusion']['hi'].pos = [-10,7]
         else:
             colors['ipsi'], colors['contra'] = colors['right'], colors['left']
             filename = ID.lower() + '_RH_blindspot_'
             # win = visual.Window([1920,1080],allowGUI=True, monitor='ccni', units='deg', viewPos = [0,0], fullscr = True)
             # win = visual.Window(resolution, allowGUI=True, monitor=mymonitor, units='deg', viewPos = [0,0], fullscr=True, screen=1)
             point = visual.Circle(cfg['hw']['win'], size = [1,1], pos = [7,-1], fillColor=colors['right'], lineColor = None, units='deg')
-            if task == 'distUpScaledAsynchronous':
-                cfg['hw']['win'].viewPos = [-10,0]
-                # cfg['hw']['fusion']['lo'].pos = [10,-7]
-                # cfg['hw']['fusion']['hi'].pos = [10,7]
+            # distUpScaledAsynchronous:
+            # cfg['hw']['fusion']['lo'].pos = [10,-7]
+            # cfg['hw']['fusion']['hi'].pos = [10,7]
 
         # point.fillColor = [-1,-1,-1]
         # print(point.size)
@@ -404,13 +440,11 @@ def doBlindSpotMapping(ID=None,task=None,location=None,offset=[0,0]):
         cfg['hw']['fusion']['hi'].resetProperties()
         cfg['hw']['fusion']['lo'].resetProperties()
 
-        cfg['hw']['tracker'].calibrate()
         # cfg['hw']['tracker'].startcollecting()
 
 
         # check what the file should be for the participant:
-        x = 1
-        while (filename + str(x) + '.txt') in os.listdir(data_path): x += 1
+        x = allocateIndex(data_path, filename, exists=lambda x: os.path.exists(data_path + filename + str(x) + '.txt'))
         
 
         cfg['hw']['win'].mouseVisible = False
@@ -419,10 +453,36 @@ def doBlindSpotMapping(ID=None,task=None,location=None,offset=[0,0]):
         fixation = fixation_yes
         abort = False
 
+        timer.setTrial(0, hemifield_idx)
+
+        mapping = None
+        if mode == 'automated':
+            # start from the last mapping of this participant, or where blind spots usually are:
+            start = participantStore(task).latest(ID, 'blindspot_' + hemifield)
+            if start == None:
+                start = {'position':[-15 if hemifield == 'left' else 15, -1.5], 'size':[5, 6]}
+
+            textScreen(cfg['hw']['win'], 'keep looking at the cross\n\npress space whenever you see a dot flash\n\npress space to start').draw()
+            cfg['hw']['win'].flip()
+            k = ['wait']
+            while k[0] not in ['space', 'escape']:
+                k = event.waitKeys()
+            if 'escape' in k:
+                print('automated mapping of the %s hemifield skipped: nothing written'%(hemifield))
+                continue
+
+            mapping = automatedMapping(cfg, point, fixation_yes, fixation_no, timer, start)
+            if mapping == None:
+                print('automated mapping of the %s hemifield stopped: nothing written'%(hemifield))
+                continue
+            # the fitted ellipse is shown: space accepts it (or it can be adjusted first, as in manual mapping)
+
         fixation.draw()
         point.draw()
         cfg['hw']['win'].flip()
 
+        timer.setPhase('mapping')
+        controls.reset()
         while 1:
             # k = event.getKeys(['up', 'down', 'left', 'right', 'q', 'w', 'a', 's', 'space', 'escape', '0'])
             k = event.getKeys(['space', 'escape', '0', 'insert'])
@@ -439,47 +499,24 @@ def doBlindSpotMapping(ID=None,task=None,location=None,offset=[0,0]):
 
                 if '0' in k:
                     # cfg['hw']['tracker'].stopcollecting() # do we even have to stop/start collecting?
-                    cfg['hw']['tracker'].calibrate()
+                    cfg['hw']['tracker'].driftcheck()
+                    timer.setPhase('mapping')
+                    controls.reset()
                     # cfg['hw']['tracker'].startcollecting()
 
             if cfg['hw']['tracker'].gazeInFixationWindow():
                 fixation = fixation_yes
                 
-                if pyg_keyboard[key.UP]:
-                    point.pos += [ 0, step]
-                if pyg_keyboard[key.DOWN]:
-                    point.pos += [ 0,-step]
-                if pyg_keyboard[key.LEFT]:
-                    point.pos += [-step, 0]
-                if pyg_keyboard[key.RIGHT]:
-                    point.pos += [ step, 0]
-
-                if pyg_keyboard[key.Q]:
-                    point.size += [step,0]
-                if pyg_keyboard[key.W]:
-                    point.size = [max(step, point.size[0] - step), point.size[1]]
-                if pyg_keyboard[key.A]:
-                    point.size += [0, step]
-                if pyg_keyboard[key.S]:
-                    point.size = [point.size[0], max(step, point.size[1] - step)]
-
-                if pyg_keyboard[key.NUM_UP]:
-                    point.pos += [ 0, step]
-                if pyg_keyboard[key.NUM_DOWN]:
-                    point.pos += [ 0,-step]
-                if pyg_keyboard[key.NUM_LEFT]:
-                    point.pos += [-step, 0]
-                if pyg_keyboard[key.NUM_RIGHT]:
-                    point.pos += [ step, 0]
-
-                if pyg_keyboard[key.NUM_HOME]:
-                    point.size += [step,0]
-                if pyg_keyboard[key.NUM_PAGE_UP]:
-                    point.size = [max(step, point.size[0] - step), point.size[1]]
-                if pyg_keyboard[key.NUM_END]:
-                    point.size += [0, step]
-                if pyg_keyboard[key.NUM_PAGE_DOWN]:
-                    point.size = [point.size[0], max(step, point.size[1] - step)]
+                # arrows / numpad arrows move, Q W A S / numpad home, page up, end, page down resize:
+                point.pos += [ 0, controls.held('up',    pyg_keyboard[key.UP]    or pyg_keyboard[key.NUM_UP])]
+                point.pos += [ 0,-controls.held('down',  pyg_keyboard[key.DOWN]  or pyg_keyboard[key.NUM_DOWN])]
+                point.pos += [-controls.held('left',  pyg_keyboard[key.LEFT]  or pyg_keyboard[key.NUM_LEFT]), 0]
+                point.pos += [ controls.held('right', pyg_keyboard[key.RIGHT] or pyg_keyboard[key.NUM_RIGHT]), 0]
+
+                point.size += [controls.held('wider', pyg_keyboard[key.Q] or pyg_keyboard[key.NUM_HOME]), 0]
+                point.size = [max(step, point.size[0] - controls.held('narrower', pyg_keyboard[key.W] or pyg_keyboard[key.NUM_PAGE_UP])), point.size[1]]
+                point.size += [0, controls.held('taller', pyg_keyboard[key.A] or pyg_keyboard[key.NUM_END])]
+                point.size = [point.size[0], max(step, point.size[1] - controls.held('shorter', pyg_keyboard[key.S] or pyg_keyboard[key.NUM_PAGE_DOWN]))]
             else:
                 fixation = fixation_no
                 
@@ -489,10 +526,18 @@ def doBlindSpotMapping(ID=None,task=None,location=None,offset=[0,0]):
             fixation.draw()
             if ((time.time() % 1) > 0.4):
                 point.draw()
+            timer.lap('draw')
             cfg['hw']['win'].flip()
+            timer.flipped()
+            controls.tick()
 
             # print(point.pos)
 
+        timer.pause()
+
+        if abort:
+            print('mapping of the %s hemifield stopped: nothing written'%(hemifield))
+
         if not abort:
             cfg['hw']['fusion']['hi'].draw()
             cfg['hw']['fusion']['lo'].draw()
@@ -500,15 +545,114 @@ def doBlindSpotMapping(ID=None,task=None,location=None,offset=[0,0]):
             point.draw()
             
             cfg['hw']['win'].flip()
-            cfg['hw']['win'].getMovieFrame()
-            cfg['hw']['win'].saveMovieFrames(data_path + filename + str(x) + '.png')
+            if screenshot != None:
+                writer.capture(cfg['hw']['win'], data_path + filename + str(x))
 
             respFile = open(data_path + filename + str(x) + '.txt','w')
             respFile.write('position:\t[{:.2f},{:.2f}]\nsize:\t[{:.2f},{:.2f}]'.format(point.pos[0], point.pos[1],  point.size[0], point.size[1]))
             respFile.close()
 
+            extra = {}
+            if mapping != None:
+                # all probes and estimates of the automated mapping:
+                with open(data_path + filename + str(x) + '_probes.json', 'w') as probe_file:
+                    json.dump({'trials':mapping.trials, 'estimates':mapping.estimates, 'fit_rms':mapping.fitRms(), 'step':mapping.step()}, fp=probe_file, indent=4)
+                extra = {'method':'automated', 'fit_rms':mapping.fitRms()}
+
+            participantStore(task).add( ID, 'blindspot_' + hemifield,
+                                        position = [round(float(point.pos[0]), 2), round(float(point.pos[1]), 2)],
+                                        size     = [round(float(point.size[0]), 2), round(float(point.size[1]), 2)],
+                                        source   = data_path + filename + str(x) + '.txt',
+                                        **extra )
+
 
     cfg['hw']['tracker'].stopcollecting()
     # close files here? there shouldn't be any...
     cfg['hw']['tracker'].shutdown()
-    cfg['hw']['win'].close()
\ No newline at end of file
+
+    if screenshot != None:
+        writer.close()
+
+    timing_name = ID.lower() + '_blindspot_timing_'
+    timer.save(data_path + timing_name + str(allocateIndex(data_path, timing_name, exists=lambda x: os.path.exists(data_path + timing_name + str(x) + '.json'))) + '.json')
+    forgetTextScreens(cfg['hw']['win'])
+    cfg['hw']['win'].close()
+
+
+def automatedMapping(cfg, point, fixation_yes, fixation_no, timer, start, probeDuration=.15, responseWindow=.8, seed=None):
+
+    # the blind spot is mapped with staircases along radial directions (see blindSpotStaircase.py):
+    # a probe is flashed while the participant fixates, and the participant presses space when it's seen
+    # a probe during which fixation is broken doesn't count (its direction is probed again later)
+    # the number of probes is fixed, so this takes a known time (about 1.5 s per probe)
+    # returns the mapping (None when stopped with escape), the point gets the fitted position and size
+    win = cfg['hw']['win']
+    tracker = cfg['hw']['tracker']
+
+    mapping = radialMapping(centre=start['position'], size=start['size'], seed=seed)
+    probe = visual.Circle(win, size=[.5, .5], pos=point.pos, fillColor=point.fillColor, lineColor=None, units='deg')
+    print('automated mapping: %d probes, about %d s'%(mapping.probes(), mapping.probes() * (.45 + probeDuration + responseWindow)))
+
+    def frame(showProbe=False):
+        # one frame of the mapping screen, returns whether the participant is fixating
+        fixating = tracker.gazeInFixationWindow()
+        cfg['hw']['fusion']['hi'].draw()
+        cfg['hw']['fusion']['lo'].draw()
+        if fixating:
+            fixation_yes.draw()
+        else:
+            fixation_no.draw()
+        if showProbe:
+            probe.draw()
+        timer.lap('draw')
+        win.flip()
+        timer.flipped()
+        return(fixating)
+
+    timer.setPhase('mapping')
+    while not mapping.done():
+
+        index, pos = mapping.next()
+        probe.pos = pos
+
+        # a random fixation duration before the probe, so its onset can't be predicted:
+        delay = random.uniform(.3, .6)
+        fixStart = None
+        while fixStart == None or (time.time() - fixStart) < delay:
+            k = event.getKeys(['escape', '0'])
+            if 'escape' in k:
+                timer.pause()
+                return(None)
+            if '0' in k:
+                tracker.driftcheck()
+                timer.setPhase('mapping')
+                fixStart = None
+            if frame():
+                if fixStart == None:
+                    fixStart = time.time()
+            else:
+                fixStart = None
+
+        event.clearEvents(eventType='keyboard')
+        probeStart = time.time()
+        fixating = True
+        while fixating and (time.time() - probeStart) < probeDuration:
+            fixating = frame(showProbe=True)
+        if not fixating:
+            continue
+
+        seen = False
+        responseStart = time.time()
+        while not seen and (time.time() - responseStart) < responseWindow:
+            seen = 'space' in event.getKeys(['space'])
+            frame()
+        mapping.respond(index, seen)
+
+    timer.pause()
+    centre, size = mapping.ellipse()
+    rms = mapping.fitRms()
+    print('blind spot: position [%0.2f, %0.2f], size [%0.2f, %0.2f] (fit RMS %s deg)'%(centre[0], centre[1], size[0], size[1], 'n/a' if rms == None else '%0.2f'%(rms)))
+    point.pos = centre
+    point.size = size
+
+    return(mapping)
@@ -0,0 +1,166 @@
+# time-critical parts of a trial (stimulus presentation, saccade recording)
+#
+# python's garbage collector can run at any allocation, and take milliseconds: long enough to miss a
+# refresh in the middle of the stimulus. inside a critical section the collector is off, and the
+# collection that was put off is done when the section ends (or later, with collect(), e.g. from the
+# deferred work queue in the inter-trial interval), and timed. only the young generations are collected:
+# what a trial leaves behind is in there, and a full collection would go through all of psychopy,
+# pandas and numpy after every trial
+#
+# optionally (linux only), the thread gets a higher scheduling priority and/or is kept on some CPUs
+# during the section. raising the priority needs permission (root or CAP_SYS_NICE): if that's not there,
+# it's noted once, and the section goes on without it
+#
+# usage:
+# -  from criticalSection import criticalSection
+# -  critical = criticalSection(priority=-10, cpus=[2,3])
+# -  with critical:
+#        ... stimulus loop ...
+#    (or critical.begin() ... critical.end(), the with block also ends the section on an exception)
+# -  critical.summary()
+
+import os
+import gc
+import sys
+import time
+import numpy as np
+
+
+class criticalSection:
+
+    def __init__(self, collect=True, generation=1, priority=None, realtime=False, cpus=None):
+
+        # collect: do the put-off collection at the end of the section (otherwise the collector is just
+        # switched back on, and collect() can be called when there is time)
+        # generation: oldest generation to collect (0-2, 2 is a full collection)
+        # priority: nice value for the section (lower is higher priority, -20 to 19), None to leave it
+        # realtime: use the round-robin real-time scheduler (a stuck loop can freeze the desktop: careful)
+        # cpus: list of CPUs to run on during the section, None to leave it
+        self.collectAtEnd = collect
+        self.generation = generation
+        self.priority = priority
+        self.realtime = realtime
+        self.cpus = cpus
+
+        self.sections = []
+        self.collections = []
+        self.collected = []
+        self.__start = None
+        self.__previous = {}
+        self.__noted = set()
+
+        if (priority != None or realtime or cpus != None) and not sys.platform.startswith('linux'):
+            print('NOTE: scheduling priority and CPU affinity are only set on linux')
+
+    def __enter__(self):
+
+        self.begin()
+        return(self)
+
+    def __exit__(self, *args):
+
+        # (the section may have been ended inside the block, e.g. around a drift check)
+        if self.active():
+            self.end()
+
+    def active(self):
+
+        return(self.__start != None)
+
+    def begin(self):
+
+        if self.__start != None:
+            raise Warning("critical section already started")
+
+        self.__wasEnabled = gc.isenabled()
+        gc.disable()
+
+        if sys.platform.startswith('linux'):
+            self.__raise()
+
+        self.__start = time.perf_counter()
+
+    def end(self):
+
+        if self.__start == None:
+            raise Warning("critical section was not started")
+        self.sections.append(time.perf_counter() - self.__start)
+        self.__start = None
+
+        if sys.platform.startswith('linux'):
+            self.__restore()
+
+        if self.__wasEnabled:
+            gc.enable()
+
+        if self.collectAtEnd:
+            self.collect()
+
+    def collect(self, generation=None):
+
+        # the put-off collection, timed
+        if generation == None:
+            generation = self.generation
+        start = time.perf_counter()
+        self.collected.append(gc.collect(generation))
+        self.collections.append(time.perf_counter() - start)
+
+    def __note(self, what, error):
+
+        if not what in self.__noted:
+            print('NOTE: could not set %s for critical sections: %s'%(what, error))
+            self.__noted.add(what)
+
+    def __raise(self):
+
+        # (on linux, pid 0 is the calling thread for all of these)
+        self.__previous = {}
+
+        if self.cpus != None and not 'affinity' in self.__noted:
+            try:
+                self.__previous['affinity'] = os.sched_getaffinity(0)
+                os.sched_setaffinity(0, self.cpus)
+            except (OSError, ValueError) as error:
+                self.__previous.pop('affinity', None)
+                self.__note('affinity', error)
+
+        if self.realtime and not 'realtime' in self.__noted:
+            try:
+                self.__previous['scheduler'] = [os.sched_getscheduler(0), os.sched_getparam(0)]
+                os.sched_setscheduler(0, os.SCHED_RR, os.sched_param(os.sched_get_priority_min(os.SCHED_RR)))
+            except (OSError, AttributeError) as error:
+                self.__previous.pop('scheduler', None)
+                self.__note('realtime', error)
+
+        if self.priority != None and not 'priority' in self.__noted:
+            try:
+                self.__previous['priority'] = os.getpriority(os.PRIO_PROCESS, 0)
+                os.setpriority(os.PRIO_PROCESS, 0, self.priority)
+            except (OSError, AttributeError) as error:
+                self.__previous.pop('priority', None)
+                self.__note('priority', error)
+
+    def __restore(self):
+
+        # lowering the priority again is always allowed:
+        if 'priority' in self.__previous.keys():
+            os.setpriority(os.PRIO_PROCESS, 0, self.__previous['priority'])
+        if 'scheduler' in self.__previous.keys():
+            os.sched_setscheduler(0, *self.__previous['scheduler'])
+        if 'affinity' in self.__previous.keys():
+            os.sched_setaffinity(0, self.__previous['affinity'])
+
+    def summary(self):
+
+        # how long the sections were, and how long the put-off collections took (ms)
+        def describe(values):
+            if len(values) == 0:
+                return(None)
+            values = np.array(values) * 1000
+            return({'p50':float(np.percentile(values, 50)), 'p90':float(np.percentile(values, 90)), 'max':float(np.max(values))})
+
+        return({ 'sections'      : len(self.sections),
+                 'section_ms'    : describe(self.sections),
+                 'collection_ms' : describe(self.collections),
+                 'collected'     : int(np.sum(self.collected)) if len(self.collected) else 0,
+                 'not_set'       : sorted(self.__noted) })
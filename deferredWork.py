@@ -0,0 +1,121 @@
+# deferred work: things that have to be done, but not right now
+#
+# writing the data file, sending the trial markers to the tracker, reshuffling the fusion stimuli:
+# none of these have to happen at a specific moment, but each can take long enough to miss a refresh
+# the trial loop adds them to a queue, and the queue is worked off in frames where nothing is going on
+# (waiting for a key press, the blink time between trials), a little in every frame: at most `budget`
+# seconds per frame, so those frames are still on time. a job that is expected to take longer than the
+# budget (how long it took the last time) is only run in frames where overrunning is fine
+#
+# jobs run in the order they were added, a job can ask for a gap before the next one (tracker comments
+# need a couple of samples in between), and a job can replace an earlier job with the same name that
+# didn't run yet (only the last data file write matters)
+# flush() runs everything that's left, e.g. right before the stimulus (so the markers are in) and at the end
+#
+# usage:
+# -  from deferredWork import deferredQueue
+# -  queue = deferredQueue(budget=win.monitorFramePeriod / 2)
+# -  queue.add('csv', writeData, replace=True)
+# -  queue.add('marker', tracker.comment, 'trial 1', gap=2/500)
+# -  while waiting: ... queue.drain(); win.flip()
+# -  queue.flush()
+# -  queue.summary()
+
+import time
+from collections import deque
+import numpy as np
+
+
+class deferredQueue:
+
+    def __init__(self, budget=None):
+
+        # budget: seconds of work per frame (default: a third of a 60 Hz frame)
+        self.budget = budget if budget else 1/180
+
+        self.jobs = deque()
+        self.durations = {}
+        self.overruns = {}
+        self.flushed = 0
+        self.__expected = {}
+        self.__gapUntil = 0
+
+    def add(self, name, function, *args, gap=0, replace=False, **kwargs):
+
+        # gap: seconds to wait after this job before running the next one
+        # replace: drop pending jobs with the same name (the new one does what they would have done)
+        if replace:
+            self.jobs = deque(job for job in self.jobs if job[0] != name)
+        self.jobs.append([name, function, args, kwargs, gap])
+
+    def __len__(self):
+
+        return(len(self.jobs))
+
+    def __run(self):
+
+        name, function, args, kwargs, gap = self.jobs.popleft()
+        start = time.perf_counter()
+        function(*args, **kwargs)
+        now = time.perf_counter()
+
+        if not name in self.durations.keys():
+            self.durations[name] = []
+            self.overruns[name] = 0
+        self.durations[name].append(now - start)
+        if now - start > self.budget:
+            self.overruns[name] += 1
+        self.__expected[name] = now - start
+        self.__gapUntil = now + gap
+
+    def drain(self, budget=None, overrun=False):
+
+        # run jobs for at most `budget` seconds (default: the per-frame budget), returns how many ran
+        # a job that doesn't fit in what's left of the budget waits for the next frame, unless
+        # overrun is set and it's the first job in this frame (otherwise it might never run)
+        if budget == None:
+            budget = self.budget
+        start = time.perf_counter()
+
+        ran = 0
+        while len(self.jobs):
+            now = time.perf_counter()
+            if now < self.__gapUntil:
+                break
+            expected = self.__expected.get(self.jobs[0][0], 0)
+            if (now - start) + expected > budget and not (overrun and ran == 0):
+                break
+            self.__run()
+            ran += 1
+
+        return(ran)
+
+    def flush(self):
+
+        # run everything, gaps included (not for frames that have to be on time)
+        ran = 0
+        while len(self.jobs):
+            wait = self.__gapUntil - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            self.__run()
+            ran += 1
+        self.flushed += ran
+
+        return(ran)
+
+    def summary(self):
+
+        # per kind of job: how often it ran, how long it took (ms) and how often that was over the budget
+        summary = { 'budget_ms' : self.budget * 1000,
+                    'flushed'   : self.flushed,
+                    'pending'   : len(self.jobs),
+                    'jobs'      : {} }
+        for name, durations in self.durations.items():
+            values = np.array(durations) * 1000
+            summary['jobs'][name] = { 'runs'     : len(values),
+                                      'p50_ms'   : float(np.percentile(values, 50)),
+                                      'max_ms'   : float(np.max(values)),
+                                      'overruns' : self.overruns[name] }
+
+        return(summary)
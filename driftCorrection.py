@@ -0,0 +1,113 @@
+# drift correction from the central fixation before each trial
+#
+# the LiveTrack calibration drifts slowly over a block, and until now the only fix was a full
+# recalibration ('r' key). every saccade trial starts with a fixation on the centre
+# (tracker.waitForFixation), and the median gaze offset in that period is a measure of the drift
+#
+# online: the EyeTracker feeds each successful fixation into a driftEstimator, shifts its
+# fixation checks by the current estimate, and reports when the drift gets too large
+# offline: the same estimate is made from the samples just before 'stimulus on' and subtracted
+# from the gaze of each trial (see scoreTrials in saccadeScoring.py)
+
+import numpy as np
+
+
+class driftEstimator:
+
+    def __init__(self, threshold=1.5, window=5, maxEpochOffset=None):
+
+        # threshold: drift (in deg) at which recalibration is needed
+        # window: number of recent fixation epochs the estimate is based on (median)
+        # maxEpochOffset: ignore epochs with a larger offset (e.g. participant looked elsewhere)
+        self.threshold = threshold
+        self.window = window
+        self.maxEpochOffset = maxEpochOffset
+        self.reset()
+
+    def reset(self):
+
+        # after a (re)calibration the drift starts at zero again
+        self.offsets = []
+        self.times = []
+
+    def addEpoch(self, x, y, fixloc=[0,0], timestamp=None, maxOffset=None):
+
+        # x, y: gaze samples from one fixation epoch
+        # maxOffset: overrides maxEpochOffset (e.g. the current fixation window of the tracker)
+        if maxOffset == None:
+            maxOffset = self.maxEpochOffset
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if np.all(np.isnan(x)) or np.all(np.isnan(y)):
+            return(None)
+
+        offset = np.array([np.nanmedian(x) - fixloc[0], np.nanmedian(y) - fixloc[1]])
+
+        if maxOffset != None and np.hypot(*offset) > maxOffset:
+            return(None)
+
+        self.offsets.append(offset)
+        self.times.append(timestamp)
+
+        return(offset)
+
+    def setOffset(self, offset, timestamp=None):
+
+        # a measured offset (e.g. from a drift check) replaces the running estimate
+        self.reset()
+        self.offsets.append(np.asarray(offset, dtype=float))
+        self.times.append(timestamp)
+
+    def current(self):
+
+        # robust drift estimate: median over the last few epochs
+        if len(self.offsets) == 0:
+            return(np.zeros(2))
+        return(np.median(np.array(self.offsets[-self.window:]), axis=0))
+
+    def magnitude(self):
+
+        return(float(np.hypot(*self.current())))
+
+    def exceeded(self):
+
+        return(self.magnitude() > self.threshold)
+
+    def correct(self, x, y):
+
+        dx, dy = self.current()
+        return(np.asarray(x) - dx, np.asarray(y) - dy)
+
+
+def trialDriftOffsets(df, trials, epoch=0.2, sampleRate=500, fixloc=[0,0], window=5):
+
+    # offline estimate: median gaze in the last `epoch` seconds before 'stimulus on' of each trial
+    # (the end of tracker.waitForFixation), then a running median over the last `window` trials
+    # of the same block, like the online estimate
+    # returns an array of (dx, dy) per trial, and the raw per-trial offsets
+
+    from saccadeScoring import stackTrials
+
+    n = int(round(epoch * sampleRate))
+    epochs = [dict(t, fixation_start=max(0, t['stimulus_on'] - n)) for t in trials]
+
+    X = stackTrials(df, epochs, 'X', start='fixation_start', end='stimulus_on')
+    Y = stackTrials(df, epochs, 'Y', start='fixation_start', end='stimulus_on')
+
+    has_data = np.any(~np.isnan(X), axis=1) & np.any(~np.isnan(Y), axis=1)
+    raw = np.full((len(trials), 2), np.nan)
+    raw[has_data,0] = np.nanmedian(X[has_data], axis=1) - fixloc[0]
+    raw[has_data,1] = np.nanmedian(Y[has_data], axis=1) - fixloc[1]
+
+    # running median within each block (a handful of trials, so this loop is over trials, not samples):
+    blocks = np.array([t['block'] for t in trials])
+    smoothed = np.full(raw.shape, np.nan)
+    for block in np.unique(blocks):
+        idx = np.flatnonzero(blocks == block)
+        for i, trial_idx in enumerate(idx):
+            recent = raw[idx[max(0, i-window+1):i+1]]
+            recent = recent[~np.isnan(recent[:,0])]
+            if len(recent):
+                smoothed[trial_idx] = np.median(recent, axis=0)
+
+    return(smoothed, raw)
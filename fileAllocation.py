@@ -0,0 +1,75 @@
+# picking the next free index for output files (data files, eye-tracker files, calibrations)
+#
+# instead of trying name_1, name_2, ... until one doesn't exist (listing the folder for every try),
+# each kind of file has a counter in the folder (.alloc_<name>) that holds the next index
+# reading and updating it is protected by a lock file, created with O_EXCL (which is atomic,
+# also on shared network folders), so two stations writing to the same folder never get the same index
+#
+# the first time a counter is made, it starts at the first index that has no file yet
+# (so older data, from before the counters, is not overwritten)
+#
+# usage:
+# -  from fileAllocation import allocateIndex
+# -  x = allocateIndex(data_path, filename, exists=lambda x: os.path.exists(data_path + filename + str(x) + '.csv'))
+
+import os
+import time
+
+
+def allocateIndex(folder, name, exists=None, start=1, timeout=10):
+
+    # name: what the counter is for (the fixed part of the filename)
+    # exists: function that tells if an index is already used by a file
+    #         (only checked for the index about to be handed out, normally once)
+    counter = os.path.join(folder, '.alloc_' + name)
+
+    with allocationLock(counter + '.lock', timeout=timeout):
+
+        index = start
+        if os.path.isfile(counter):
+            with open(counter, 'r') as counter_file:
+                content = counter_file.read().strip()
+            if content.isdigit():
+                index = max(start, int(content))
+
+        # files made without the counter (older data, or copied in):
+        if exists != None:
+            while exists(index):
+                index += 1
+
+        # write the next index to a temporary file, and swap it in:
+        with open(counter + '.tmp', 'w') as counter_file:
+            counter_file.write(str(index + 1))
+        os.replace(counter + '.tmp', counter)
+
+    return(index)
+
+
+class allocationLock:
+
+    def __init__(self, filename, timeout=10):
+
+        self.filename = filename
+        self.timeout = timeout
+
+    def __enter__(self):
+
+        while True:
+            try:
+                fd = os.open(self.filename, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.close(fd)
+                return(self)
+            except FileExistsError:
+                # a lock that is older than the timeout was left behind by a crashed session:
+                try:
+                    if (time.time() - os.path.getmtime(self.filename)) > self.timeout:
+                        print('NOTE: removing stale lock file: %s'%(self.filename))
+                        os.remove(self.filename)
+                        continue
+                except FileNotFoundError:
+                    continue
+                time.sleep(0.01)
+
+    def __exit__(self, *args):
+
+        os.remove(self.filename)
@@ -0,0 +1,203 @@
+# frame timing tools for the psychopy tasks
+#
+# warmUp: the first draw of a stimulus compiles shaders and uploads textures / vertex buffers,
+# which can make that frame miss the screen refresh. drawing every stimulus of the session once
+# at the start (and clearing it before the flip, so nothing is shown) moves that cost out of the trials
+#
+# frameTimer: records where the time of every frame in the trial loops goes (getting the sample,
+# checking fixation, drawing, waiting for the flip), flags frames that miss a refresh, and writes
+# a summary with percentiles at the end of the session
+#
+# usage:
+# -  from frameTiming import warmUp, frameTimer
+# -  warmUp(win, {'fixation': fixation, 'fusion': hiFusion, ...})
+# -  timer = frameTimer(budget=win.monitorFramePeriod)
+
+import time
+import json
+import numpy as np
+
+
+def warmUp(win, stimuli, budget=None, repeats=2):
+
+    # stimuli: dictionary of name: object with a draw() method
+    # budget: frame duration in seconds (default: the measured frame period of the window)
+    # every stimulus is drawn `repeats` times, the first (cold) and last (warm) frame durations are returned
+    # any stimulus of which the first draw takes a frame longer than the budget is reported
+    # (flips wait for the refresh, so a frame is either ~1 budget long, or it missed one: > 1.5)
+
+    if budget == None:
+        # (None when psychopy did not measure the refresh rate)
+        budget = win.monitorFramePeriod if win.monitorFramePeriod else 1/60
+
+    # start from a flip, so the first measured frame isn't the one with the setup before it:
+    win.flip()
+    last = time.perf_counter()
+
+    timings = {}
+    for name, stim in stimuli.items():
+        durations = []
+        for repeat in range(repeats):
+            stim.draw()
+            # the stimulus is not shown:
+            win.clearBuffer()
+            win.flip()
+            now = time.perf_counter()
+            durations.append(now - last)
+            last = now
+        timings[name] = {'first':durations[0], 'warm':durations[-1]}
+
+    slow = [name for name in timings.keys() if timings[name]['first'] > budget * 1.5]
+    for name in slow:
+        print('NOTE: first draw of %s took %0.1f ms (frame budget %0.1f ms, %0.1f ms when warm)'%(name, timings[name]['first']*1000, budget*1000, timings[name]['warm']*1000))
+    if len(slow) == 0:
+        print('warm-up: all %d stimuli drawn within the frame budget'%(len(timings)))
+
+    return(timings)
+
+
+class frameTimer:
+
+    # per-frame timing for the gaze-contingent loops
+    # a frame runs from one flip to the next, and is split in sections with lap():
+    # -  timer.setPhase('stimulus')           (start of a loop: the frame before it doesn't count)
+    # -  ... sample = tracker.lastsample(); timer.lap('sample')
+    # -  ... stim.draw(); timer.lap('draw')
+    # -  win.flip(); timer.flipped()
+    # -  timer.pause()                        (end of the loop: laps after this are not charged to a frame)
+    # everything goes into preallocated arrays (no allocation in the loop), frames longer than
+    # 1.5 budget (a missed refresh) are flagged with the block, trial and phase they happened in
+
+    def __init__(self, budget=None, sections=['sample', 'fixation', 'draw', 'flip'], capacity=250000):
+
+        self.budget = budget if budget else 1/60
+        self.sections = list(sections)
+        self.capacity = capacity
+
+        self.laps      = np.full((capacity, len(self.sections)), np.nan)
+        self.intervals = np.full(capacity, np.nan)
+        self.block     = np.full(capacity, -1, dtype=int)
+        self.trial     = np.full(capacity, -1, dtype=int)
+        self.phase     = np.full(capacity, -1, dtype=int)
+
+        self.phases = []
+        self.count = 0
+        self.__block = -1
+        self.__trial = -1
+        self.__phase = -1
+        self.__mark = None
+        self.__lastFlip = None
+        self.__timing = False
+        self.__full = False
+
+    def setTrial(self, block, trial):
+
+        self.__block = block
+        self.__trial = trial
+
+    def setPhase(self, phase):
+
+        if not phase in self.phases:
+            self.phases.append(phase)
+        self.__phase = self.phases.index(phase)
+        self.pause()
+        self.__timing = True
+
+    def pause(self):
+
+        # the next frame follows something that was not timed (a calibration, waiting for a key):
+        # its duration is not a frame interval, and laps until the next setPhase are not recorded
+        # (gazeInFixationWindow laps in untimed loops too)
+        self.__mark = None
+        self.__lastFlip = None
+        self.__timing = False
+        if self.count < self.capacity:
+            self.laps[self.count] = np.nan
+
+    def lap(self, section):
+
+        if not self.__timing:
+            return
+        now = time.perf_counter()
+        if self.__mark != None and self.count < self.capacity:
+            i = self.sections.index(section)
+            if np.isnan(self.laps[self.count, i]):
+                self.laps[self.count, i] = now - self.__mark
+            else:
+                self.laps[self.count, i] += now - self.__mark
+        self.__mark = now
+
+    def flipped(self):
+
+        # call right after win.flip(): the time since the last lap was spent waiting for the flip
+        if not self.__timing:
+            return
+        if 'flip' in self.sections:
+            self.lap('flip')
+        now = time.perf_counter()
+        self.__mark = now
+
+        if self.count >= self.capacity:
+            if not self.__full:
+                print('NOTE: frame timer is full (%d frames), not recording more frames'%(self.capacity))
+                self.__full = True
+            return
+
+        if self.__lastFlip != None:
+            self.intervals[self.count] = now - self.__lastFlip
+        self.block[self.count] = self.__block
+        self.trial[self.count] = self.__trial
+        self.phase[self.count] = self.__phase
+        self.count += 1
+        self.__lastFlip = now
+
+    def overBudget(self):
+
+        # indices of frames that missed a refresh
+        with np.errstate(invalid='ignore'):
+            return(np.flatnonzero(self.intervals[:self.count] > 1.5 * self.budget))
+
+    def summary(self, percentiles=[50, 90, 99, 100]):
+
+        n = self.count
+        summary = { 'frames'    : int(n),
+                    'budget_ms' : self.budget * 1000 }
+
+        def describe(values):
+            values = values[~np.isnan(values)] * 1000
+            if len(values) == 0:
+                return(None)
+            return({'p%d'%(p): float(v) for p, v in zip(percentiles, np.percentile(values, percentiles))})
+
+        summary['interval_ms'] = describe(self.intervals[:n])
+        summary['sections_ms'] = {section: describe(self.laps[:n, i]) for i, section in enumerate(self.sections)}
+
+        # per phase: how many frames and how many of them over budget
+        over = self.overBudget()
+        summary['phases'] = {}
+        for i, phase in enumerate(self.phases):
+            inPhase = self.phase[:n] == i
+            summary['phases'][phase] = { 'frames'      : int(np.sum(inPhase)),
+                                         'over_budget' : int(np.sum(self.phase[over] == i)),
+                                         'interval_ms' : describe(self.intervals[:n][inPhase]) }
+
+        summary['over_budget'] = [ { 'frame'       : int(i),
+                                     'block'       : int(self.block[i]),
+                                     'trial'       : int(self.trial[i]),
+                                     'phase'       : self.phases[self.phase[i]] if self.phase[i] >= 0 else None,
+                                     'interval_ms' : float(self.intervals[i] * 1000),
+                                     'sections_ms' : {section: (None if np.isnan(self.laps[i,j]) else float(self.laps[i,j] * 1000)) for j, section in enumerate(self.sections)} } for i in over ]
+
+        return(summary)
+
+    def save(self, filename, extra={}):
+
+        # extra: more things to put in the file (e.g. the critical section summary)
+        summary = self.summary()
+        summary.update(extra)
+        with open(filename, 'w') as out_file:
+            json.dump(summary, fp=out_file, indent=4)
+
+        print('frame timing: %d frames, %d over budget (%0.1f ms)'%(summary['frames'], len(summary['over_budget']), self.budget*1000))
+
+        return(summary)
@@ -0,0 +1,234 @@
+# python version of the LiveTrack calibration: pupil-glint vectors to degrees
+#
+# the LiveTrack does its own calibration (CalibrateDevice) and only gives back 16 opaque
+# coefficients, so if a calibration was poor, the gaze in the data file can't be fixed
+# this module fits a bivariate polynomial from the calibration fixations (calibration_<n>.json)
+# or from a later validation block (validation_<n>.json: the median vectors on each target),
+# and applies it to all raw vectors of a recording at once
+#
+# the device writes calibrated gaze only, so the EyeTracker logs the raw vectors of the same
+# samples to <data file>_vectors.csv while a data file is open. samples are matched on their
+# device timestamp (the device clock restarts on a calibration: so within the same restart)
+#
+# usage:
+# -  from gazeCalibration import calibrationFromFile, recalibrateFiles
+# -  models = {'left': calibrationFromFile('validation_3.json', 'left'), 'right': ...}
+# -  recalibrated = recalibrateFiles(['HVscLH1.csv'], models, outfolder='recalibrated')
+
+import os
+import json
+import random
+import warnings
+import numpy as np
+
+
+# columns of the raw vector file written by the EyeTracker (NaN when the eye was not tracked):
+vectorColumns = [ 'Timestamp',
+                  'LeftVectX', 'LeftVectY', 'LeftGlintX', 'LeftGlintY',
+                  'RightVectX', 'RightVectY', 'RightGlintX', 'RightGlintY' ]
+
+
+def nTerms(order):
+
+    return((order+1)*(order+2)//2)
+
+
+def polynomialTerms(vx, vy, order=2):
+
+    # all terms vx^i * vy^j with i+j <= order, along a new last axis:
+    # order 1: 1, vx, vy
+    # order 2: 1, vx, vy, vx^2, vx*vy, vy^2
+    vx = np.asarray(vx, dtype=float)
+    vy = np.asarray(vy, dtype=float)
+    terms = [vx**(total-j) * vy**j for total in range(order+1) for j in range(total+1)]
+
+    return(np.stack(terms, axis=-1))
+
+
+def fitCalibration(targetsX, targetsY, vectX, vectY, order=None):
+
+    targets = np.stack([np.asarray(targetsX, dtype=float), np.asarray(targetsY, dtype=float)], axis=1)
+    vectors = np.stack([np.asarray(vectX, dtype=float), np.asarray(vectY, dtype=float)], axis=1)
+
+    good = np.all(np.isfinite(targets), axis=1) & np.all(np.isfinite(vectors), axis=1)
+    targets, vectors = targets[good], vectors[good]
+
+    # use the highest order the number of points allows (a 5-point calibration is linear):
+    if order == None:
+        order = 2 if len(targets) >= nTerms(2) else 1
+    if len(targets) < nTerms(order):
+        raise Warning("need at least %d calibration points for order %d, got %d"%(nTerms(order), order, len(targets)))
+
+    # vectors are in camera pixels: centre and scale them for a well-conditioned fit
+    centre = np.mean(vectors, axis=0)
+    scale = np.std(vectors, axis=0)
+    scale[scale == 0] = 1
+
+    design = polynomialTerms(*((vectors - centre) / scale).T, order=order)
+    coefficients, _, _, _ = np.linalg.lstsq(design, targets, rcond=None)
+
+    model = { 'order'        : order,
+              'centre'       : centre,
+              'scale'        : scale,
+              'coefficients' : coefficients }
+
+    residuals = np.hypot(*(applyCalibration(model, vectors[:,0], vectors[:,1]) - targets.T))
+    model['residuals'] = residuals
+    model['rms'] = float(np.sqrt(np.mean(residuals**2)))
+
+    return(model)
+
+
+def applyCalibration(model, vectX, vectY):
+
+    # returns gazeX, gazeY (in degrees) for any number of raw vectors
+    vx = (np.asarray(vectX, dtype=float) - model['centre'][0]) / model['scale'][0]
+    vy = (np.asarray(vectY, dtype=float) - model['centre'][1]) / model['scale'][1]
+    gaze = polynomialTerms(vx, vy, order=model['order']) @ model['coefficients']
+
+    return(gaze[...,0], gaze[...,1])
+
+
+def modelToDict(model):
+
+    return({key: (value.tolist() if isinstance(value, np.ndarray) else value) for key, value in model.items()})
+
+
+def modelFromDict(model):
+
+    return({key: (np.array(value) if isinstance(value, list) else value) for key, value in model.items()})
+
+
+def calibrationFromFile(filename, eye, order=None):
+
+    # refit from the fixations stored by EyeTracker.savecalibration() or EyeTracker.validate()
+    with open(filename, 'r') as cal_file:
+        calibration = json.load(cal_file)
+
+    if not 'fixations' in calibration.keys():
+        raise Warning("no fixations stored in %s (older calibration or validation file?)"%(filename))
+    if not eye in calibration['fixations'].keys():
+        raise Warning("no fixations for the %s eye in %s"%(eye, filename))
+
+    fixations = calibration['fixations'][eye]
+
+    return(fitCalibration(fixations['targetX'], fixations['targetY'], fixations['vectX'], fixations['vectY'], order=order))
+
+
+def sampleKeys(timestamps):
+
+    # device timestamps restart on a calibration: a sample is identified by the restart it
+    # comes after and its timestamp
+    timestamps = np.asarray(timestamps, dtype=float)
+    restarts = np.concatenate([[0], np.cumsum(np.diff(timestamps) < 0)])
+
+    return(restarts, timestamps)
+
+
+def readVectorFile(filename):
+
+    import pandas as pd
+
+    vectors = pd.read_csv(filename)
+    # (a re-opened file repeats the header)
+    vectors = vectors[vectors['Timestamp'].astype(str) != 'Timestamp']
+    vectors = vectors.apply(pd.to_numeric, errors='coerce').reset_index(drop=True)
+    vectors['Restart'], vectors['RawTimestamp'] = sampleKeys(vectors['Timestamp'].to_numpy(dtype=float))
+
+    return(vectors.drop(columns=['Timestamp']))
+
+
+def recalibrateRecording(df, vectors, models, suffix=''):
+
+    # df: a recording read with saccadeScoring.readLiveTrackFile, vectors: its readVectorFile
+    # models: per eye ('left', 'right') a model from fitCalibration / calibrationFromFile
+    # gaze columns are overwritten (or written with a suffix), and X / Y are re-averaged
+    # samples without raw vectors (not tracked, or not logged) are NaN
+
+    restarts, raw = sampleKeys(df['RawTimestamp'].to_numpy(dtype=float))
+    keys = df[[]].assign(Restart=restarts, RawTimestamp=raw)
+    matched = keys.merge(vectors, on=['Restart', 'RawTimestamp'], how='left')
+    if len(matched) != len(df):
+        raise Warning("the vector file has more than one sample with the same timestamp")
+
+    df = df.copy()
+    gaze = []
+    for eye in models.keys():
+        prefix = {'left':'Left', 'right':'Right'}[eye]
+        gazeX, gazeY = applyCalibration(models[eye], matched[prefix+'VectX'].to_numpy(dtype=float), matched[prefix+'VectY'].to_numpy(dtype=float))
+        df[prefix+'GazeX'+suffix] = gazeX
+        df[prefix+'GazeY'+suffix] = gazeY
+        gaze.append([gazeX, gazeY])
+
+    gaze = np.array(gaze)
+    with warnings.catch_warnings():
+        # samples where no eye is tracked are NaN:
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        df['X'+suffix] = np.nanmean(gaze[:,0,:], axis=0)
+        df['Y'+suffix] = np.nanmean(gaze[:,1,:], axis=0)
+
+    return(df)
+
+
+def recalibrateFiles(filenames, models, outfolder=None):
+
+    # bulk re-calibration of a set of recordings with the same models
+    # (each recording needs its <name>_vectors.csv, files are done one by one, each in a single pass)
+    from saccadeScoring import readLiveTrackFile
+
+    recalibrated = {}
+    for filename in filenames:
+        vectorFilename = os.path.splitext(filename)[0] + '_vectors.csv'
+        if not os.path.isfile(vectorFilename):
+            raise Warning("no raw vectors for %s (%s)"%(filename, vectorFilename))
+        df = recalibrateRecording(readLiveTrackFile(filename), readVectorFile(vectorFilename), models)
+        if outfolder != None:
+            os.makedirs(outfolder, exist_ok=True)
+            df.to_csv(os.path.join(outfolder, os.path.basename(filename)), index=False)
+        recalibrated[filename] = df
+
+    return(recalibrated)
+
+
+def targetTour(targets, start=0, slack=1.25):
+
+    # order in which to show calibration targets: a short tour that starts and ends at
+    # targets[start] (the centre), so the participant makes small saccades and settles faster
+    # nearest neighbour picks randomly among targets less than `slack` times farther than the
+    # nearest one, then 2-opt removes crossings, and the direction is random:
+    # symmetric target sets have many equally short tours, so the order is still unpredictable
+    # returns a list of indices: [start, ..., start]
+
+    targets = np.asarray(targets, dtype=float)
+    distance = np.hypot(*(targets[:,np.newaxis,:] - targets[np.newaxis,:,:]).transpose(2,0,1))
+
+    tour = [start]
+    remaining = [i for i in range(len(targets)) if i != start]
+    while len(remaining):
+        d = distance[tour[-1], remaining]
+        candidates = [remaining[i] for i in np.flatnonzero(d <= slack * d.min())]
+        tour.append(random.choice(candidates))
+        remaining.remove(tour[-1])
+    tour.append(start)
+
+    # 2-opt: reverse a section of the tour whenever that makes it shorter (start and end stay put)
+    improved = True
+    while improved:
+        improved = False
+        for i in range(1, len(tour)-2):
+            for j in range(i+1, len(tour)-1):
+                a, b, c, d = tour[i-1], tour[i], tour[j], tour[j+1]
+                if distance[a,c] + distance[b,d] < distance[a,b] + distance[c,d] - 1e-9:
+                    tour[i:j+1] = tour[i:j+1][::-1]
+                    improved = True
+
+    if random.random() < 0.5:
+        tour = tour[::-1]
+
+    return(tour)
+
+
+def tourLength(targets, tour):
+
+    targets = np.asarray(targets, dtype=float)[tour]
+    return(float(np.sum(np.hypot(*np.diff(targets, axis=0).T))))
@@ -0,0 +1,222 @@
+# velocity estimation and smoothing for gaze streams
+#
+# all filters work along the last axis, so they take a single trace (1D)
+# or a batch of padded trials (trials x samples, see saccadeScoring.py)
+#
+# the gazeRingBuffer keeps the most recent samples during the experiment,
+# and runs the exact same functions on its tail, so that an online decision
+# uses the same numbers the offline scoring will see for that sample
+#
+# filters with a window are centred: the first and last window//2 samples are NaN
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+
+def centralDifferenceVelocity(t, x, y):
+
+    # speed in units/s, from actual timestamps (t in seconds)
+    t = np.asarray(t, dtype=float)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+
+    speed = np.full(x.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        speed[...,1:-1] = np.hypot(x[...,2:] - x[...,:-2], y[...,2:] - y[...,:-2]) / (t[...,2:] - t[...,:-2])
+
+    return(speed)
+
+
+def savgolCoefficients(window=7, polyorder=2, deriv=1):
+
+    if window % 2 != 1 or window < 3:
+        raise Warning("window must be an odd number of 3 or more samples")
+    if polyorder >= window:
+        raise Warning("polyorder must be smaller than window")
+
+    # least-squares polynomial fit over the window, evaluated at the centre sample:
+    half = window // 2
+    positions = np.arange(-half, half+1, dtype=float)
+    design = positions[:,np.newaxis] ** np.arange(polyorder+1)[np.newaxis,:]
+    coefficients = np.linalg.pinv(design)[deriv] * np.prod(np.arange(1, deriv+1))
+
+    return(coefficients)
+
+
+def savgolFilter(x, window=7, polyorder=2, deriv=0):
+
+    x = np.asarray(x, dtype=float)
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] < window:
+        return(out)
+
+    half = window // 2
+    out[...,half:x.shape[-1]-half] = sliding_window_view(x, window, axis=-1) @ savgolCoefficients(window, polyorder, deriv)
+
+    return(out)
+
+
+def savgolVelocity(x, y, sampleRate, window=7, polyorder=2):
+
+    # assumes a constant sample rate (in Hz), which the trackers have
+    vx = savgolFilter(x, window=window, polyorder=polyorder, deriv=1) * sampleRate
+    vy = savgolFilter(y, window=window, polyorder=polyorder, deriv=1) * sampleRate
+
+    return(np.hypot(vx, vy))
+
+
+def medianSmooth(x, window=5):
+
+    x = np.asarray(x, dtype=float)
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] < window:
+        return(out)
+
+    half = window // 2
+    windows = sliding_window_view(x, window, axis=-1)
+    # all-NaN windows stay NaN, without a warning:
+    valid = ~np.all(np.isnan(windows), axis=-1)
+    smoothed = np.full(windows.shape[:-1], np.nan)
+    smoothed[valid] = np.nanmedian(windows[valid], axis=-1)
+    out[...,half:x.shape[-1]-half] = smoothed
+
+    return(out)
+
+
+def bilateralSmooth(x, window=7, sigmaSamples=2.0, sigmaRange=0.5):
+
+    # edge-preserving: samples far away in value (across a saccade) get little weight
+    # sigmaRange is in the units of x (degrees for gaze)
+    x = np.asarray(x, dtype=float)
+    out = np.full(x.shape, np.nan)
+    if x.shape[-1] < window:
+        return(out)
+
+    half = window // 2
+    windows = sliding_window_view(x, window, axis=-1)
+    centre = windows[...,half:half+1]
+
+    spatial = np.exp(-0.5 * (np.arange(-half, half+1) / sigmaSamples)**2)
+    with np.errstate(invalid='ignore'):
+        weights = spatial * np.exp(-0.5 * ((windows - centre) / sigmaRange)**2)
+    weights = np.where(np.isnan(windows), 0, weights)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        smoothed = np.sum(weights * np.nan_to_num(windows), axis=-1) / np.sum(weights, axis=-1)
+    # a missing centre sample is not invented here, that's what interpolateGaps is for:
+    smoothed[np.isnan(centre[...,0])] = np.nan
+    out[...,half:x.shape[-1]-half] = smoothed
+
+    return(out)
+
+
+def nanRuns(missing):
+
+    # start (inclusive) and end (exclusive) of each run of True values, along the last axis
+    # returns row indices as well, so it works on batches of trials
+    missing = np.atleast_2d(missing)
+    padded = np.zeros((missing.shape[0], missing.shape[1]+2), dtype=np.int8)
+    padded[:,1:-1] = missing
+    edges = np.diff(padded, axis=1)
+    rows, starts = np.nonzero(edges == 1)
+    _, ends = np.nonzero(edges == -1)
+
+    return(rows, starts, ends)
+
+
+def interpolateGaps(t, x, maxGap=0.075):
+
+    # linear interpolation over runs of NaN that are at most maxGap seconds long
+    # (measured between the valid samples on either side of the gap)
+    # gaps at the start or end of a trace, and longer gaps, stay NaN
+    t = np.asarray(t, dtype=float)
+    x = np.array(x, dtype=float)
+    squeeze = x.ndim == 1
+    T = np.atleast_2d(t)
+    X = np.atleast_2d(x)
+
+    rows, starts, ends = nanRuns(np.isnan(X) & ~np.isnan(T))
+    inner = (starts > 0) & (ends < X.shape[1])
+    rows, starts, ends = rows[inner], starts[inner], ends[inner]
+    short = (T[rows, ends] - T[rows, starts-1]) <= maxGap
+    rows, starts, ends = rows[short], starts[short], ends[short]
+
+    if len(rows):
+        # every missing sample in a short gap, with the gap it belongs to:
+        lengths = ends - starts
+        gap = np.repeat(np.arange(len(rows)), lengths)
+        cols = starts[gap] + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        r = rows[gap]
+        t0 = T[r, starts[gap]-1]
+        t1 = T[r, ends[gap]]
+        x0 = X[r, starts[gap]-1]
+        x1 = X[r, ends[gap]]
+        X[r, cols] = x0 + (x1 - x0) * (T[r, cols] - t0) / (t1 - t0)
+
+    if squeeze:
+        return(X[0])
+    return(X)
+
+
+class gazeRingBuffer:
+
+    # fixed-size buffer of the most recent gaze samples (time, x, y and pupil size)
+    # every sample is written twice (at i and i+capacity), so the last n samples
+    # are always one contiguous slice: no copying or re-ordering when reading
+
+    def __init__(self, capacity=1000, sampleRate=None):
+
+        self.capacity   = capacity
+        self.sampleRate = sampleRate
+        self.__data = np.full((4, 2*capacity), np.nan)
+        self.__next = 0
+        self.count  = 0
+
+    def append(self, t, x, y, pupil=np.nan):
+
+        self.__data[:, self.__next] = (t, x, y, pupil)
+        self.__data[:, self.__next + self.capacity] = (t, x, y, pupil)
+        self.__next = (self.__next + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def clear(self):
+
+        self.__data[:] = np.nan
+        self.__next = 0
+        self.count = 0
+
+    def latest(self, n=None):
+
+        # returns t, x, y, pupil of the last n samples, oldest first (views, do not modify)
+        if n == None or n > self.count:
+            n = self.count
+        end = self.__next + self.capacity
+        return(self.__data[:, end-n:end])
+
+    def velocity(self, method='central', window=7, polyorder=2):
+
+        # speed at the most recent sample with a full window
+        # this lags window//2 samples behind the stream (1 sample for central differences),
+        # and is identical to the offline value for that same sample
+        if method == 'central':
+            t, x, y = self.latest(3)[:3]
+            if self.count < 3:
+                return(np.nan)
+            return(centralDifferenceVelocity(t, x, y)[1])
+        if method == 'savgol':
+            if self.sampleRate == None:
+                raise Warning("savgol velocity needs the sampleRate of the buffer")
+            t, x, y = self.latest(window)[:3]
+            if self.count < window:
+                return(np.nan)
+            return(savgolVelocity(x, y, sampleRate=self.sampleRate, window=window, polyorder=polyorder)[window//2])
+        raise Warning("unknown velocity method: %s"%(method))
+
+    def smoothed(self, method='median', window=5, **kwargs):
+
+        # smoothed x and y at the most recent sample with a full window
+        t, x, y = self.latest(window)[:3]
+        if self.count < window:
+            return(np.array([np.nan, np.nan]))
+        smoother = {'median':medianSmooth, 'bilateral':bilateralSmooth}[method]
+        return(np.array([smoother(x, window=window, **kwargs)[window//2], smoother(y, window=window, **kwargs)[window//2]]))
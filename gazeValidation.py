@@ -0,0 +1,95 @@
+# validation of a calibration on new fixations
+#
+# after calibrating, a few targets are shown again and the calibrated gaze samples are collected
+# per target (see EyeTracker.validate). for every target this gives:
+# -  accuracy: distance between the mean gaze and the target (and the x / y offset)
+# -  precision: RMS of the sample-to-sample distances, and the SD of the samples around their mean
+#
+# targets are rows of padded arrays (targets x samples, NaN padded, like the trials in
+# saccadeScoring.py), so all metrics are computed at once
+
+import warnings
+import numpy as np
+
+
+def padSamples(samples):
+
+    # list of per-target (t, x, y) arrays of different lengths -> three NaN padded targets x samples arrays
+    n = max([len(s[0]) for s in samples] + [1])
+    padded = np.full((3, len(samples), n), np.nan)
+    for i, s in enumerate(samples):
+        padded[:, i, :len(s[0])] = s
+
+    return(padded)
+
+
+def validationMetrics(X, Y, targetsX, targetsY):
+
+    # X, Y: targets x samples (NaN for missing or padding)
+    X = np.atleast_2d(np.asarray(X, dtype=float))
+    Y = np.atleast_2d(np.asarray(Y, dtype=float))
+    targetsX = np.asarray(targetsX, dtype=float)
+    targetsY = np.asarray(targetsY, dtype=float)
+
+    valid = ~np.isnan(X) & ~np.isnan(Y)
+    n = np.sum(valid, axis=1)
+
+    with warnings.catch_warnings():
+        # targets without any valid sample get NaN metrics:
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+
+        meanX = np.nanmean(np.where(valid, X, np.nan), axis=1)
+        meanY = np.nanmean(np.where(valid, Y, np.nan), axis=1)
+
+        offsetX = meanX - targetsX
+        offsetY = meanY - targetsY
+
+        # successive valid samples only (a gap is not a sample-to-sample step):
+        steps = np.hypot(np.diff(X, axis=1), np.diff(Y, axis=1))
+        rms_s2s = np.sqrt(np.nanmean(steps**2, axis=1))
+
+        sd = np.sqrt(np.nanvar(np.where(valid, X, np.nan), axis=1) + np.nanvar(np.where(valid, Y, np.nan), axis=1))
+
+    return({ 'targetX'  : targetsX,
+             'targetY'  : targetsY,
+             'samples'  : n,
+             'offsetX'  : offsetX,
+             'offsetY'  : offsetY,
+             'accuracy' : np.hypot(offsetX, offsetY),
+             'rms_s2s'  : rms_s2s,
+             'sd'       : sd })
+
+
+def judgeValidation(metrics, maxAccuracy=1.0, maxPrecision=0.5, minSamples=5):
+
+    # a target passes when it has enough samples, and is accurate and precise enough
+    # the validation is accepted when all targets pass
+    with np.errstate(invalid='ignore'):
+        passed = (metrics['samples'] >= minSamples) & (metrics['accuracy'] <= maxAccuracy) & (metrics['rms_s2s'] <= maxPrecision)
+
+    return(bool(np.all(passed)), passed)
+
+
+def metricsToDict(metrics):
+
+    # json can't store numpy arrays or NaN:
+    out = {}
+    for key, value in metrics.items():
+        value = np.asarray(value)
+        out[key] = [None if (isinstance(v, float) and np.isnan(v)) else v for v in value.tolist()]
+
+    return(out)
+
+
+def spreadTargets(targets, n=5, start=0):
+
+    # subset of n targets that covers the calibrated area: start with targets[start] (the centre),
+    # then keep adding the target farthest away from all the ones picked so far
+    targets = np.asarray(targets, dtype=float)
+    picked = [start]
+    distance = np.hypot(*(targets - targets[start]).T)
+    while len(picked) < min(n, len(targets)):
+        picked.append(int(np.argmax(distance)))
+        distance = np.minimum(distance, np.hypot(*(targets - targets[picked[-1]]).T))
+
+    return(picked)
@@ -0,0 +1,122 @@
+# adjustment controls that don't depend on the frame rate
+#
+# adding a step for every frame a key is held makes the speed of an adjustment depend on the refresh
+# rate (a 144 Hz screen is 2.4 times faster than a 60 Hz one), and on stalls (a dropped frame is a
+# step missed). here the speed is a rate per second instead, and every frame gets the change for the
+# time since the previous flip. holding a key longer speeds up: the rate goes from `rate` up to
+# `rate * boost` over `ramp` seconds of holding (for fine adjustments: tap or hold briefly), and the
+# change is the integral of that curve over the frame, so it adds up to the same amount at any frame rate
+# a stalled frame counts for at most `maxInterval` seconds, so the control doesn't jump after a hiccup
+#
+# mouse movement is a distance already (not a rate), it gets a gain that goes from 1 for slow movements
+# up to `boost` at `fastSpeed` (units per second), so fine adjustments are unchanged but the whole range
+# can be covered quickly. that is for a relative mouse control only: where the mouse position maps
+# directly onto the adjustment (as in the perception task) it is independent of the frame rate already
+#
+# usage:
+# -  from inputIntegration import inputIntegrator
+# -  controls = inputIntegrator(rate=.6)                     (0.6 units per second when just pressed)
+# -  every frame: win.flip(); controls.tick()
+#        point.pos += [0, controls.held('up', pyg_keyboard[key.UP]) - controls.held('down', pyg_keyboard[key.DOWN])]
+#        distance += controls.moved(mouse.getRel()[1])
+# -  controls.reset()                                         (after a pause: the next frame is not an interval)
+
+import time
+
+
+class inputIntegrator:
+
+    def __init__(self, rate=1., boost=3., ramp=1.5, maxInterval=.05, fastSpeed=20., clock=time.perf_counter):
+
+        # rate: change per second when a key is just pressed
+        # boost: how much faster it gets when held for `ramp` seconds (1: no acceleration)
+        # maxInterval: longest time a single frame can count for (seconds)
+        # fastSpeed: mouse speed (units per second) at which the mouse gain reaches `boost`
+        self.rate = rate
+        self.boost = boost
+        self.ramp = ramp
+        self.maxInterval = maxInterval
+        self.fastSpeed = fastSpeed
+        self.clock = clock
+
+        self.__previous = None
+        self.__now = None
+        self.__since = {}
+        self.__used = set()
+
+    def tick(self, now=None):
+
+        # once per frame, right after the flip (now: flip time, on the same clock)
+        # returns the time this frame counts for
+        if now == None:
+            now = self.clock()
+        self.__previous = self.__now
+        self.__now = now
+
+        # keys that were not looked at in the last frame start over:
+        for name in list(self.__since.keys()):
+            if not name in self.__used:
+                del self.__since[name]
+        self.__used = set()
+
+        return(self.interval())
+
+    def reset(self):
+
+        # the next frame follows something that wasn't a frame (a calibration, a break): it doesn't count
+        self.__previous = None
+        self.__now = None
+        self.__since = {}
+
+    def interval(self, clamped=True):
+
+        if self.__previous == None:
+            return(0.)
+        interval = self.__now - self.__previous
+        if clamped:
+            interval = min(interval, self.maxInterval)
+
+        return(max(0., interval))
+
+    def __rampIntegral(self, t, rate, boost):
+
+        # integral of the rate from the start of holding up to t seconds of holding
+        if self.ramp <= 0:
+            return(rate * boost * t)
+        slope = rate * (boost - 1) / self.ramp
+        if t <= self.ramp:
+            return(rate * t + slope * t**2 / 2)
+
+        return(rate * self.ramp + slope * self.ramp**2 / 2 + rate * boost * (t - self.ramp))
+
+    def held(self, name, down, rate=None, boost=None):
+
+        # change (>= 0) for a key that is down (or not) in this frame: the caller gives it a sign
+        # (the key counts as held since the previous frame when it's first seen down)
+        rate = self.rate if rate == None else rate
+        boost = self.boost if boost == None else boost
+        self.__used.add(name)
+
+        if not down:
+            self.__since.pop(name, None)
+            return(0.)
+
+        interval = self.interval()
+        if not name in self.__since.keys():
+            self.__since[name] = 0.
+        start = self.__since[name]
+        self.__since[name] = start + interval
+
+        return(self.__rampIntegral(start + interval, rate, boost) - self.__rampIntegral(start, rate, boost))
+
+    def moved(self, delta, boost=None):
+
+        # change for a mouse movement (in the units of the adjustment) during this frame
+        boost = self.boost if boost == None else boost
+        # (the real frame duration for the speed: the movement of a stalled frame is all there)
+        interval = self.interval(clamped=False)
+        if interval <= 0 or self.fastSpeed <= 0:
+            return(delta)
+        speed = abs(delta) / interval
+
+        return(delta * (1 + (boost - 1) * min(1., speed / self.fastSpeed)))
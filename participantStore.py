@@ -0,0 +1,99 @@
+# per-participant parameters (colour calibration, blind spot position and size) for each task
+#
+# the calibration tasks still write their text files (data/<task>/color/<id>_col_cal_<n>.txt and
+# data/<task>/mapping/<id>_<LH|RH>_blindspot_<n>.txt), but they now also add a record to
+# data/<task>/participants.jsonl, and the experiments read the latest record from there
+# instead of globbing and parsing all files on every launch
+# text files from before this store are imported once per participant (the first time they're needed)
+#
+# kinds of records:
+# -  'color':           background, left, right (RGB colours in psychopy -1..1 units)
+# -  'blindspot_left':  position, size (deg)
+# -  'blindspot_right': position, size (deg)
+#
+# usage:
+# -  from participantStore import participantStore
+# -  colors = participantStore('saccades').latest('p01', 'color')
+
+import os
+import re
+import ast
+from glob import glob
+
+from recordStore import recordStore
+
+
+# one store per file for the whole process (each file is only read once):
+openStores = {}
+
+
+class participantStore:
+
+    def __init__(self, task, folder='data'):
+
+        self.task = task
+        self.folder = os.path.join(folder, task)
+        filename = os.path.join(self.folder, 'participants.jsonl')
+        if not filename in openStores.keys():
+            openStores[filename] = recordStore(filename, indices=[['ID','kind']])
+        self.store = openStores[filename]
+
+    def latest(self, ID, kind):
+
+        ID = ID.lower()
+        if self.store.latest(ID=ID, kind='imported') == None:
+            self.importLegacy(ID)
+
+        return(self.store.latest(ID=ID, kind=kind))
+
+    def add(self, ID, kind, **values):
+
+        # older text files go in first, so they can't end up as more recent than this record:
+        ID = ID.lower()
+        if self.store.latest(ID=ID, kind='imported') == None:
+            self.importLegacy(ID)
+
+        return(self.__append(ID, kind, values))
+
+    def __append(self, ID, kind, values):
+
+        os.makedirs(self.folder, exist_ok=True)
+        return(self.store.append(dict(values, ID=ID, kind=kind)))
+
+    def importLegacy(self, ID):
+
+        # read the old text files of this participant, in order, so the highest index ends up as latest
+        ID = ID.lower()
+
+        for filename in legacyFiles(os.path.join(self.folder, 'color', ID + '_col_cal_*.txt')):
+            values = readLegacyFile(filename)
+            self.__append(ID, 'color', dict(background=values['background'], left=values['red'], right=values['green'], source=filename))
+
+        for hemifield, prefix in [['left', 'LH'], ['right', 'RH']]:
+            for filename in legacyFiles(os.path.join(self.folder, 'mapping', ID + '_' + prefix + '_blindspot_*.txt')):
+                values = readLegacyFile(filename)
+                self.__append(ID, 'blindspot_' + hemifield, dict(position=values['position'], size=values['size'], source=filename))
+
+        # don't look for text files of this participant again:
+        self.__append(ID, 'imported', {})
+
+
+def legacyFiles(pattern):
+
+    # files matching the pattern, sorted by the index at the end of the filename
+    files = [[int(re.search(r'_(\d+)\.txt$', x).group(1)), x] for x in glob(pattern) if re.search(r'_(\d+)\.txt$', x)]
+
+    return([x[1] for x in sorted(files)])
+
+
+def readLegacyFile(filename):
+
+    # lines of 'name:<tab>[values]'
+    values = {}
+    with open(filename, 'r') as param_file:
+        for line in param_file.read().split('\n'):
+            if '\t' in line:
+                name, value = line.split('\t', 1)
+                values[name.strip().rstrip(':')] = list(ast.literal_eval(value.strip()))
+
+    return(values)
@@ -0,0 +1,203 @@
+# profiling of the eye-tracker calls (and window flips)
+#
+# the backend methods of an EyeTracker (lastsample, comment, calibrate, startcollecting, ...) are
+# bound to the object in setupLiveTrack / setupEyeLink / setupMouse, so they can be swapped for
+# timed versions on the object itself, without changing the EyeTracker code
+# nothing is wrapped unless a profiler is attached: when not profiling, there is no cost at all
+# (detach puts the original methods back)
+#
+# per method, the profiler keeps a count and a latency histogram (10 bins per decade, 100 ns to 100 s),
+# and every call as an event, which can be written as a Chrome / Perfetto trace (chrome://tracing or
+# ui.perfetto.dev) so that tracker calls can be seen on the same timeline as the flips
+#
+# usage:
+# -  from profiling import callProfiler
+# -  profiler = callProfiler()
+# -  profiler.attach(tracker)
+# -  profiler.attach(win, methods=['flip'], category='window')
+# -  ... session ...
+# -  profiler.detach()
+# -  profiler.saveSummary(eyetracking_path + 'profile.json')
+# -  profiler.saveTrace(eyetracking_path + 'trace.json')
+#
+# the tasks do this when asked to: doHVsaccadeTask(..., profile=True), or with the environment
+# variable HV_PROFILE=1 (profile=None, the default, looks at the variable); the files go next to the
+# eye-tracking data, as <et file>_profile.json and <et file>_trace.json
+
+import os
+import math
+import time
+import json
+import threading
+import numpy as np
+
+
+# the methods that the setup functions bind (whichever exist on the object are wrapped):
+trackerMethods = [ 'initialize', 'calibrate', 'savecalibration', 'restorecalibration',
+                   'lastsample',
+                   'openfile', 'startcollecting', 'stopcollecting', 'closefile',
+                   'comment', 'flushVectors', 'shutdown' ]
+
+
+def profilingRequested(profile=None):
+
+    # profile: True / False, or None to use the HV_PROFILE environment variable
+    if profile == None:
+        profile = os.environ.get('HV_PROFILE', '').lower() in ['1', 'true', 'yes', 'on']
+
+    return(bool(profile))
+
+
+class callProfiler:
+
+    def __init__(self, maxEvents=1000000, binsPerDecade=10, minDuration=1e-7, maxDuration=100):
+
+        # maxEvents: calls stored for the trace (the counts and histograms keep going after that)
+        self.maxEvents = maxEvents
+        self.binsPerDecade = binsPerDecade
+        self.__minLog = math.log10(minDuration)
+        self.nBins = int(round((math.log10(maxDuration) - self.__minLog) * binsPerDecade))
+        # upper edge of each bin, in seconds:
+        self.edges = 10 ** (self.__minLog + np.arange(1, self.nBins+1) / binsPerDecade)
+
+        self.methods = []
+        self.categories = []
+        # (plain lists: incrementing a python int is cheaper than a numpy element, this runs on every call)
+        self.histograms = []
+        self.totals = []
+        self.maxima = []
+
+        self.events = []
+        self.__dropped = 0
+        self.__attached = []
+        self.__origin = time.perf_counter()
+
+    def attach(self, obj, methods=None, category='tracker'):
+
+        # replace the methods of obj (by default the EyeTracker backend methods) by timed versions
+        if methods == None:
+            methods = [name for name in trackerMethods if name in vars(obj).keys()]
+
+        for name in methods:
+            original = getattr(obj, name, None)
+            if not callable(original):
+                raise Warning("%s has no method %s to profile"%(type(obj).__name__, name))
+            if hasattr(original, 'profiled'):
+                # already attached
+                continue
+            # (methods of the class, like win.flip, get a wrapper on the object only)
+            self.__attached.append([obj, name, original, name in vars(obj).keys()])
+            setattr(obj, name, self.__wrap(self.__index(name, category), original))
+
+        return(self)
+
+    def detach(self):
+
+        # put back the original methods (the recorded calls are kept)
+        for obj, name, original, own in reversed(self.__attached):
+            if own:
+                setattr(obj, name, original)
+            else:
+                delattr(obj, name)
+        self.__attached = []
+
+    def __index(self, name, category):
+
+        label = category + '.' + name
+        if not label in self.methods:
+            self.methods.append(label)
+            self.categories.append(category)
+            self.histograms.append([0] * self.nBins)
+            self.totals.append(0.)
+            self.maxima.append(0.)
+
+        return(self.methods.index(label))
+
+    def __wrap(self, index, method):
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return(method(*args, **kwargs))
+            finally:
+                self.__record(index, start, time.perf_counter() - start)
+
+        timed.profiled = method
+        return(timed)
+
+    def __record(self, index, start, duration):
+
+        if duration > 0:
+            b = int((math.log10(duration) - self.__minLog) * self.binsPerDecade)
+            b = min(max(b, 0), self.nBins - 1)
+        else:
+            b = 0
+        self.histograms[index][b] += 1
+        self.totals[index] += duration
+        if duration > self.maxima[index]:
+            self.maxima[index] = duration
+
+        if len(self.events) < self.maxEvents:
+            self.events.append((index, start, duration, threading.get_ident()))
+        else:
+            self.__dropped += 1
+
+    def percentile(self, index, p):
+
+        # upper edge of the bin the p-th percentile falls in (seconds), None without calls
+        counts = np.cumsum(self.histograms[index])
+        if counts[-1] == 0:
+            return(None)
+
+        return(float(self.edges[np.searchsorted(counts, counts[-1] * p / 100)]))
+
+    def summary(self):
+
+        summary = {}
+        for index, label in enumerate(self.methods):
+            calls = sum(self.histograms[index])
+            if calls == 0:
+                continue
+            summary[label] = { 'calls'    : calls,
+                               'total_ms' : self.totals[index] * 1000,
+                               'mean_ms'  : self.totals[index] * 1000 / calls,
+                               'max_ms'   : self.maxima[index] * 1000 }
+            for p in [50, 90, 99]:
+                summary[label]['p%d_ms'%(p)] = self.percentile(index, p) * 1000
+            # only the bins with calls in them, by upper edge:
+            summary[label]['histogram'] = { '%0.4g'%(self.edges[b] * 1000) : n for b, n in enumerate(self.histograms[index]) if n > 0 }
+
+        return(summary)
+
+    def saveSummary(self, filename):
+
+        summary = self.summary()
+        with open(filename, 'w') as out_file:
+            json.dump(summary, fp=out_file, indent=4)
+
+        return(summary)
+
+    def saveTrace(self, filename):
+
+        # Chrome trace-event format: one complete ('X') event per call, in microseconds
+        pid = os.getpid()
+        threads = {}
+        traceEvents = []
+        for index, start, duration, thread in self.events:
+            if not thread in threads.keys():
+                threads[thread] = len(threads)
+            traceEvents.append({ 'name' : self.methods[index].split('.', 1)[1],
+                                 'cat'  : self.categories[index],
+                                 'ph'   : 'X',
+                                 'ts'   : (start - self.__origin) * 1e6,
+                                 'dur'  : duration * 1e6,
+                                 'pid'  : pid,
+                                 'tid'  : threads[thread] })
+
+        if self.__dropped:
+            print('NOTE: trace holds the first %d calls, %d later calls are only in the histograms'%(self.maxEvents, self.__dropped))
+
+        with open(filename, 'w') as out_file:
+            json.dump({'traceEvents':traceEvents, 'displayTimeUnit':'ms'}, fp=out_file)
+
+        return(len(traceEvents))
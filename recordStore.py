@@ -0,0 +1,77 @@
+# append-only store of records (dictionaries), one json object per line
+#
+# the file is read once when the store is opened, after that the latest record for any
+# combination of indexed fields is kept in memory: appending and looking up are O(1),
+# no matter how many records there are, and there is no globbing or parsing of filenames
+#
+# usage:
+# -  store = recordStore('data/saccades/eyetracking/p01/calibrations.jsonl', indices=[['kind'], ['kind','accepted']])
+# -  store.append({'kind':'calibration', 'accepted':True, ...})
+# -  store.latest(kind='calibration', accepted=True)
+
+import os
+import json
+import time
+
+
+class recordStore:
+
+    def __init__(self, filename, indices=[['kind']]):
+
+        self.filename = filename
+        self.indices = [tuple(sorted(fields)) for fields in indices]
+        self.records = []
+        self.__latest = {fields:{} for fields in self.indices}
+        self.__newline = ''
+
+        if os.path.isfile(filename):
+            line = '\n'
+            with open(filename, 'r') as store_file:
+                for line_no, line in enumerate(store_file):
+                    if len(line.strip()) == 0:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # most likely a line that was cut off when a session crashed:
+                        print('NOTE: skipping unreadable record on line %d of %s'%(line_no+1, filename))
+                        continue
+                    self.__add(record)
+            # after a cut-off line, the next record should still start on a line of its own:
+            if not line.endswith('\n'):
+                self.__newline = '\n'
+
+    def __add(self, record):
+
+        self.records.append(record)
+        for fields in self.indices:
+            if all([field in record.keys() for field in fields]):
+                self.__latest[fields][tuple(record[field] for field in fields)] = record
+
+    def append(self, record):
+
+        record = dict(record)
+        if not 'timestamp' in record.keys():
+            record['timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S')
+
+        # one short write per record, so a crash loses at most the record being written:
+        with open(self.filename, 'a') as store_file:
+            store_file.write(self.__newline + json.dumps(record) + '\n')
+        self.__newline = ''
+
+        self.__add(record)
+
+        return(record)
+
+    def latest(self, **match):
+
+        # the most recent record with these values for the indexed fields (or None)
+        fields = tuple(sorted(match.keys()))
+        if not fields in self.__latest.keys():
+            raise Warning("no index on: %s"%(', '.join(fields)))
+
+        return(self.__latest[fields].get(tuple(match[field] for field in fields)))
+
+    def __len__(self):
+
+        return(len(self.records))
@@ -0,0 +1,307 @@
+# offline scoring of the HVsaccades task
+#
+# reads a LiveTrack raw data file, cuts it into trials using the comments that
+# doHVsaccadeTask writes into the file, detects saccades after 'stimulus off' and
+# scores the first and second saccade against the logged plus (point1) and cross (point2)
+#
+# all trials of a session are padded into 2D arrays (trials x samples) so that
+# velocity, saccade detection and the metrics are computed in one go for the whole session
+#
+# usage:
+# -  from saccadeScoring import scoreSession
+# -  saccades = scoreSession('data/saccades/eyetracking/p01/HVscLH1.csv')
+
+import re
+import warnings
+import numpy as np
+import pandas as pd
+
+from gazeFilters import centralDifferenceVelocity, savgolVelocity
+from blinkDetection import blinkMask, removeBlinks
+from driftCorrection import trialDriftOffsets
+
+
+# columns in the LiveTrack data files (when the results type is calibrated):
+LT_columns = ['Timestamp', 'Trigger', 'LeftGazeX', 'LeftGazeY', 'RightGazeX', 'RightGazeY', 'LeftPupilMajorAxis', 'LeftPupilMinorAxis', 'RightPupilMajorAxis', 'RightPupilMinorAxis', 'Comment']
+
+
+def readLiveTrackFile(filename):
+
+    df = pd.read_csv(filename, dtype={'Comment':str}, skipinitialspace=False)
+
+    # the header gets repeated when the file is re-opened:
+    df = df[df['Timestamp'].astype(str) != 'Timestamp']
+    df = df.drop(columns=[c for c in ['Trigger'] if c in df.columns])
+
+    for colname in df.columns:
+        if colname != 'Comment':
+            df[colname] = pd.to_numeric(df[colname], errors='coerce')
+
+    df['Comment'] = df['Comment'].fillna('').astype(str).str.strip()
+    df = df.reset_index(drop=True)
+
+    # (as written by the device: to match samples with the raw vector file, see gazeCalibration.py)
+    df['RawTimestamp'] = df['Timestamp']
+    df['Timestamp'] = fixTimestamps(df['Timestamp'].to_numpy(dtype=float))
+
+    with warnings.catch_warnings():
+        # samples where neither eye is tracked stay NaN:
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        # gaze averaged over both eyes, ignoring an eye that is not tracked:
+        df['X'] = np.nanmean(df[['LeftGazeX', 'RightGazeX']].to_numpy(dtype=float), axis=1)
+        df['Y'] = np.nanmean(df[['LeftGazeY', 'RightGazeY']].to_numpy(dtype=float), axis=1)
+        # pupil size for blink detection (0 or NaN means the eye was lost):
+        df['Pupil'] = np.nanmean(df[['LeftPupilMajorAxis', 'RightPupilMajorAxis']].to_numpy(dtype=float), axis=1)
+
+    return(df)
+
+
+def fixTimestamps(timestamps, maxStep=2500, fillStep=2000):
+
+    # the LiveTrack restarts its clock on calibration, and sometimes jumps ahead
+    # this is the same correction as fixLiveTrack() in R/tryOneFile.R, without the loops
+
+    timestamps = np.array(timestamps, dtype=float)
+    steps = np.diff(timestamps)
+
+    # time going back down: continue from the last value before the reset
+    steps[steps < 0] = timestamps[1:][steps < 0]
+    # time going up too much: pretend it was a normal step
+    steps[steps > maxStep] = fillStep
+
+    return(np.concatenate([timestamps[:1], timestamps[0] + np.cumsum(steps)]))
+
+
+def segmentTrials(df):
+
+    # only the rows with comments are looped over, not the samples
+    comment_idx = np.flatnonzero(df['Comment'].to_numpy() != '')
+    comments = df['Comment'].to_numpy()[comment_idx]
+
+    trials = []
+    trial = None
+
+    for idx, comment in zip(comment_idx, comments):
+
+        m = re.match(r'block (\d+) trial (\d+)$', comment)
+        if m:
+            trial = { 'block'          : int(m.group(1)),
+                      'trial'          : int(m.group(2)),
+                      'bs_tilt'        : np.nan,
+                      'aw_tilt'        : np.nan,
+                      'tpair'          : '',
+                      'eye'            : '',
+                      'points'         : np.full((4,2), np.nan),
+                      'aborted'        : False,
+                      'trial_start'    : idx,
+                      'stimulus_on'    : None,
+                      'stimulus_off'   : None,
+                      'gaze_returned'  : None }
+            continue
+
+        if trial == None:
+            continue
+
+        if comment.startswith('BS tilt '):
+            trial['bs_tilt'] = float(comment.split(' ')[2])
+        elif comment.startswith('AW tilt '):
+            trial['aw_tilt'] = float(comment.split(' ')[2])
+        elif comment.startswith('target pair '):
+            trial['tpair'] = comment.split(' ')[2]
+        elif comment.startswith('eye '):
+            trial['eye'] = comment.split(' ')[1]
+        elif re.match(r'point[1-4] ', comment):
+            parts = comment.split(' ')
+            trial['points'][int(parts[0][-1])-1,:] = [float(parts[1]), float(parts[2])]
+        elif comment == 'stimulus on':
+            trial['stimulus_on'] = idx
+        elif comment in ['fixation broken', 'trial aborted']:
+            trial['aborted'] = True
+        elif comment == 'stimulus off':
+            trial['stimulus_off'] = idx
+        elif comment == 'gaze returned':
+            trial['gaze_returned'] = idx
+            if trial['stimulus_off'] != None:
+                trials.append(trial)
+            trial = None
+
+    return(trials)
+
+
+def stackTrials(df, trials, column, start='stimulus_off', end='gaze_returned'):
+
+    # pad the samples of each trial into a trials x samples array (NaN after the end of a trial)
+    starts = np.array([t[start] for t in trials], dtype=int)
+    ends   = np.array([t[end] for t in trials], dtype=int)
+    lengths = ends - starts
+
+    values = df[column].to_numpy(dtype=float)
+    stacked = np.full((len(trials), max(lengths.max(initial=0), 1)), np.nan)
+
+    # flat indices of all samples in all trials, without looping over trials:
+    cols = np.arange(stacked.shape[1])
+    valid = cols[np.newaxis,:] < lengths[:,np.newaxis]
+    stacked[valid] = values[(starts[:,np.newaxis] + cols[np.newaxis,:])[valid]]
+
+    return(stacked)
+
+
+def gazeVelocity(T, X, Y, method='central', sampleRate=500, window=7):
+
+    # speed along the sample axis, in deg/s (T in seconds, X and Y in degrees)
+    # same functions as used online on the gazeRingBuffer
+    if method == 'central':
+        return(centralDifferenceVelocity(T, X, Y))
+    if method == 'savgol':
+        return(savgolVelocity(X, Y, sampleRate=sampleRate, window=window))
+    raise Warning("unknown velocity method: %s"%(method))
+
+
+def detectSaccades(T, X, Y, velocityThreshold=30, minDuration=0.010, minAmplitude=1.0, speed=None):
+
+    # returns one row per saccade, for all trials at once:
+    # trial index, onset sample, offset sample (exclusive)
+
+    if speed is None:
+        speed = gazeVelocity(T, X, Y)
+
+    with np.errstate(invalid='ignore'):
+        fast = speed > velocityThreshold
+
+    # rising and falling edges of the above-threshold mask:
+    padded = np.zeros((fast.shape[0], fast.shape[1]+2), dtype=np.int8)
+    padded[:,1:-1] = fast
+    edges = np.diff(padded, axis=1)
+    on_row, on_col = np.nonzero(edges == 1)
+    off_row, off_col = np.nonzero(edges == -1)
+    # np.nonzero is row-major, so onsets and offsets pair up
+
+    duration = T[on_row, off_col-1] - T[on_row, on_col]
+    amplitude = np.hypot(X[on_row, off_col-1] - X[on_row, on_col], Y[on_row, off_col-1] - Y[on_row, on_col])
+
+    with np.errstate(invalid='ignore'):
+        keep = (duration >= minDuration) & (amplitude >= minAmplitude)
+
+    return(on_row[keep], on_col[keep], off_col[keep])
+
+
+def saccadeMetrics(T, X, Y, speed, rows, onsets, offsets, targets):
+
+    # vectorized metrics for a set of saccades
+    # targets has one target position per saccade
+
+    last = offsets - 1
+
+    start = np.stack([X[rows, onsets], Y[rows, onsets]], axis=1)
+    end   = np.stack([X[rows, last], Y[rows, last]], axis=1)
+
+    amplitude = np.hypot(*(end - start).T)
+    target_dist = np.hypot(*(targets - start).T)
+    landing_error = np.hypot(*(end - targets).T)
+
+    # peak velocity per saccade with a single reduceat over the flattened speed array
+    flat = np.append(np.nan_to_num(speed, nan=0).ravel(), 0)
+    bounds = np.empty(2*len(rows), dtype=int)
+    bounds[0::2] = rows * speed.shape[1] + onsets
+    bounds[1::2] = rows * speed.shape[1] + offsets
+    peak = np.maximum.reduceat(flat, bounds)[0::2] if len(rows) else np.zeros(0)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        gain = amplitude / target_dist
+
+    return({ 'start_x'       : start[:,0],
+             'start_y'       : start[:,1],
+             'end_x'         : end[:,0],
+             'end_y'         : end[:,1],
+             'latency'       : T[rows, onsets],
+             'duration'      : T[rows, last] - T[rows, onsets],
+             'amplitude'     : amplitude,
+             'peak_velocity' : peak,
+             'landing_error' : landing_error,
+             'gain'          : gain })
+
+
+def scoreTrials(df, trials, velocityThreshold=30, minDuration=0.010, minAmplitude=1.0, velocityMethod='central', sampleRate=500, blinks=True, maxGap=0.075, driftCorrect=True):
+
+    # the first saccade should land on the plus (point1), the second on the cross (point2)
+
+    if len(trials) == 0:
+        return(pd.DataFrame())
+
+    # time in seconds, relative to 'stimulus off':
+    T = stackTrials(df, trials, 'Timestamp') / 1000000
+    T = T - T[:,:1]
+    X = stackTrials(df, trials, 'X')
+    Y = stackTrials(df, trials, 'Y')
+
+    # drift of the calibration, from the central fixation before each trial:
+    if driftCorrect:
+        drift, _ = trialDriftOffsets(df, trials, sampleRate=sampleRate)
+        drift = np.nan_to_num(drift, nan=0)
+    else:
+        drift = np.zeros((len(trials), 2))
+    X = X - drift[:,0:1]
+    Y = Y - drift[:,1:2]
+
+    # blinks (participants blink before pressing space) and dropouts are removed first,
+    # short dropouts are interpolated, real blinks are padded and stay NaN and can't look like saccades:
+    if blinks:
+        mask = blinkMask(T, pupil=np.nan_to_num(stackTrials(df, trials, 'Pupil'), nan=0), x=X, sampleRate=sampleRate, maxGap=maxGap)
+        mask &= ~np.isnan(T)
+        X, Y = removeBlinks(T, X, Y, mask, interpolate=True, maxGap=maxGap)
+        blink_samples = mask.sum(axis=1)
+    else:
+        blink_samples = np.zeros(len(trials), dtype=int)
+
+    speed = gazeVelocity(T, X, Y, method=velocityMethod, sampleRate=sampleRate)
+    rows, onsets, offsets = detectSaccades(T, X, Y, velocityThreshold=velocityThreshold, minDuration=minDuration, minAmplitude=minAmplitude, speed=speed)
+
+    # number each saccade within its trial (rows are sorted):
+    rank = np.arange(len(rows)) - np.searchsorted(rows, rows)
+
+    points = np.stack([t['points'] for t in trials])
+    aborted = np.array([t['aborted'] for t in trials])
+
+    scored = []
+    for saccade_no in [1, 2]:
+        # one row per trial, NaN if there was no such saccade:
+        sel = rank == (saccade_no - 1)
+        metrics = saccadeMetrics(T, X, Y, speed, rows[sel], onsets[sel], offsets[sel], points[rows[sel], saccade_no-1, :])
+
+        out = pd.DataFrame({ 'block'    : [t['block'] for t in trials],
+                             'trial'    : [t['trial'] for t in trials],
+                             'bs_tilt'  : [t['bs_tilt'] for t in trials],
+                             'aw_tilt'  : [t['aw_tilt'] for t in trials],
+                             'tpair'    : [t['tpair'] for t in trials],
+                             'eye'      : [t['eye'] for t in trials],
+                             'aborted'  : aborted,
+                             'blink_samples' : blink_samples,
+                             'drift_x'  : drift[:,0],
+                             'drift_y'  : drift[:,1],
+                             'saccade'  : saccade_no,
+                             'target_x' : points[:, saccade_no-1, 0],
+                             'target_y' : points[:, saccade_no-1, 1] })
+        for name in metrics.keys():
+            column = np.full(len(trials), np.nan)
+            column[rows[sel]] = metrics[name]
+            out[name] = column
+        scored.append(out)
+
+    scored = pd.concat(scored).sort_values(['block', 'trial', 'saccade'], kind='stable').reset_index(drop=True)
+
+    # aborted trials are kept in the output, but not scored:
+    scored.loc[scored['aborted'], list(metrics.keys())] = np.nan
+
+    return(scored)
+
+
+def scoreSession(filename, outfile=None, **kwargs):
+
+    df = readLiveTrackFile(filename)
+    trials = segmentTrials(df)
+    scored = scoreTrials(df, trials, **kwargs)
+
+    if outfile != None:
+        scored.to_csv(outfile, index=False)
+
+    return(scored)
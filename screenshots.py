@@ -0,0 +1,94 @@
+# screenshots without stalling the window
+#
+# win.saveMovieFrames() encodes and writes the image on the thread that draws: a full HD png takes
+# long enough to freeze the screen for a noticeable moment. here the frame is only read from the
+# window (that has to be done by the drawing thread, and is fast), and the encoding and writing is
+# done by a background thread, so the task can go on right away
+#
+# format: 'png' (lossless, at the fastest compression level), 'jpg' or 'bmp' (cheaper to encode, bmp is big)
+# thumbnail: longest side in pixels of a downscaled copy to save instead of the full frame (None: full size)
+#
+# usage:
+# -  from screenshots import screenshotWriter
+# -  writer = screenshotWriter(format='png', thumbnail=None)
+# -  win.flip(); writer.capture(win, data_path + 'p01_LH_blindspot_1')    (extension is added)
+# -  writer.close()                                                      (waits for the files to be written)
+
+import time
+import queue
+import threading
+
+
+formats = { 'png' : ['.png', {'compress_level':1}],
+            'jpg' : ['.jpg', {'quality':90}],
+            'bmp' : ['.bmp', {}] }
+
+
+class screenshotWriter:
+
+    def __init__(self, format='png', thumbnail=None):
+
+        if not format in formats.keys():
+            raise Warning("screenshot format must be one of: %s"%(', '.join(formats.keys())))
+        self.format = format
+        self.thumbnail = thumbnail
+
+        self.written = []
+        self.failed = []
+        self.__queue = queue.Queue()
+        self.__thread = None
+
+    def capture(self, win, filename, buffer='front'):
+
+        # read the frame (front buffer: what was shown at the last flip), and leave the rest to the writer
+        # returns the full filename the image will be written to
+        win.getMovieFrame(buffer=buffer)
+        # (getMovieFrame keeps the frames in the window, until saveMovieFrames: this one is ours)
+        image = win.movieFrames.pop()
+
+        filename = filename + formats[self.format][0]
+        if self.__thread == None or not self.__thread.is_alive():
+            self.__thread = threading.Thread(target=self.__write, name='screenshotWriter', daemon=True)
+            self.__thread.start()
+        self.__queue.put([image, filename])
+
+        return(filename)
+
+    def __write(self):
+
+        while True:
+            item = self.__queue.get()
+            if item == None:
+                self.__queue.task_done()
+                return
+            image, filename = item
+            try:
+                start = time.perf_counter()
+                if self.thumbnail != None:
+                    image = image.copy()
+                    image.thumbnail([self.thumbnail, self.thumbnail])
+                if self.format == 'jpg' and image.mode != 'RGB':
+                    # (no alpha in jpeg)
+                    image = image.convert('RGB')
+                image.save(filename, **formats[self.format][1])
+                self.written.append([filename, time.perf_counter() - start])
+            except Exception as error:
+                print('NOTE: could not write screenshot %s: %s'%(filename, error))
+                self.failed.append(filename)
+            self.__queue.task_done()
+
+    def pending(self):
+
+        return(self.__queue.unfinished_tasks)
+
+    def close(self, timeout=None):
+
+        # wait for everything to be written (and stop the thread), returns the number of files written
+        if self.__thread != None and self.__thread.is_alive():
+            self.__queue.put(None)
+            self.__thread.join(timeout)
+            if self.__thread.is_alive():
+                print('NOTE: %d screenshot(s) not written yet'%(self.pending()))
+        self.__thread = None
+
+        return(len(self.written))
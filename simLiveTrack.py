@@ -0,0 +1,330 @@
+# simulated LiveTrack, with the same functions as LiveTrack.py but without the device or its library
+#
+# samples are made at the sample rate, on the clock (time.perf_counter, or any function set with
+# setClock, so a session can run on a virtual clock), from a gaze position that can be moved around
+# with lookAt() and interrupted with blink(): enough to run the tasks, calibration included, on any
+# computer, and to benchmark the code that handles the samples
+# when a data file is set, samples are written in the same columns as the LiveTrack data files
+#
+# usage:
+# -  tracker = EyeTracker(tracker='simulated', ...)            (uses this instead of LiveTrack.py)
+# -  import simLiveTrack; simLiveTrack.lookAt(5, 0); simLiveTrack.blink(0.15)
+
+import ctypes
+import time
+import json
+import random
+from collections import deque
+
+from saccadeScoring import LT_columns
+
+
+# same as in LiveTrack.py:
+class T_RESULTS_STRUCT(ctypes.Structure):
+    _pack_ = 1
+    _fields_ = [
+        ("Size", ctypes.c_ushort),
+        ("Timestamp", ctypes.c_ulonglong),
+        ("ResultsType", ctypes.c_ushort),
+        ("ActiveROIs", ctypes.c_uint),
+        ("GlintX", ctypes.c_float),
+        ("GlintY", ctypes.c_float),
+        ("PupilX", ctypes.c_float),
+        ("PupilY", ctypes.c_float),
+        ("PupilMajorAxis", ctypes.c_float),
+        ("PupilMinorAxis", ctypes.c_float),
+        ("VectX", ctypes.c_float),
+        ("VectY", ctypes.c_float),
+        ("GazeX", ctypes.c_float),
+        ("GazeY", ctypes.c_float),
+        ("GazeZ", ctypes.c_float),
+        ("GazeAzimuth", ctypes.c_float),
+        ("GazeElevation", ctypes.c_float),
+        ("GazeLongitude", ctypes.c_float),
+        ("GazeLatitude", ctypes.c_float),
+        ("Tracked", ctypes.c_byte),
+        ("Enabled", ctypes.c_byte),
+        ("Calibrated", ctypes.c_byte),
+        ("Dropped", ctypes.c_byte),
+        ("ROI", ctypes.c_byte),
+        ("ActiveROIsRight", ctypes.c_uint),
+        ("GlintXRight", ctypes.c_float),
+        ("GlintYRight", ctypes.c_float),
+        ("PupilXRight", ctypes.c_float),
+        ("PupilYRight", ctypes.c_float),
+        ("PupilMajorAxisRight", ctypes.c_float),
+        ("PupilMinorAxisRight", ctypes.c_float),
+        ("VectXRight", ctypes.c_float),
+        ("VectYRight", ctypes.c_float),
+        ("GazeXRight", ctypes.c_float),
+        ("GazeYRight", ctypes.c_float),
+        ("GazeZRight", ctypes.c_float),
+        ("GazeAzimuthRight", ctypes.c_float),
+        ("GazeElevationRight", ctypes.c_float),
+        ("GazeLongitudeRight", ctypes.c_float),
+        ("GazeLatitudeRight", ctypes.c_float),
+        ("TrackedRight", ctypes.c_byte),
+        ("EnabledRight", ctypes.c_byte),
+        ("CalibratedRight", ctypes.c_byte),
+        ("DroppedRight", ctypes.c_byte),
+        ("ROIRight", ctypes.c_byte),
+        ("DigitalIO", ctypes.c_uint),
+        ("FixationDetected", ctypes.c_byte)]
+
+
+# camera coordinates: the pupil-glint vector is a linear function of gaze (a calibration can always be fit)
+glint = [320., 240.]
+vectorGain = 0.02
+pupilSize = 40.
+
+# state of the simulated device:
+state = { 'clock'      : time.perf_counter,
+          'sampleRate' : 500,
+          'noise'      : 0.03,
+          'gaze'       : [0., 0.],
+          'blinkUntil' : None,
+          'tracking'   : False,
+          'eyes'       : [True, True],
+          'calibrated' : False,
+          'start'      : None,
+          'next'       : None,
+          'last'       : None,
+          'comments'   : deque(),
+          'file'       : None }
+
+buffer = deque(maxlen=500*120)
+calibrations = {}
+rng = random.Random(0)
+
+
+# controls of the simulation (these are not in LiveTrack.py):
+
+def setClock(clock):
+    # a function returning the time in seconds
+    state['clock'] = clock
+    state['start'] = None
+    state['next'] = None
+
+def setSampleRate(rate):
+    state['sampleRate'] = rate
+
+def setNoise(sd):
+    # SD of the gaze position of every sample (deg)
+    state['noise'] = sd
+
+def lookAt(x, y):
+    # (samples up to now are still at the previous position)
+    __advance()
+    state['gaze'] = [float(x), float(y)]
+
+def blink(duration):
+    # no pupil (not tracked) for the next `duration` seconds
+    __advance()
+    state['blinkUntil'] = state['clock']() + duration
+
+def seed(value):
+    rng.seed(value)
+
+
+def __makeSample(t):
+
+    sample = T_RESULTS_STRUCT()
+    sample.Size = ctypes.sizeof(T_RESULTS_STRUCT)
+    sample.Timestamp = int((t - state['start']) * 1e6)
+    sample.ResultsType = 1 if state['calibrated'] else 0
+
+    blinking = state['blinkUntil'] != None and t < state['blinkUntil']
+    for eye, suffix in [[0, ''], [1, 'Right']]:
+        tracked = state['eyes'][eye] and not blinking
+        x = state['gaze'][0] + rng.gauss(0, state['noise'])
+        y = state['gaze'][1] + rng.gauss(0, state['noise'])
+        setattr(sample, 'Tracked' + suffix, int(tracked))
+        setattr(sample, 'Enabled' + suffix, int(state['eyes'][eye]))
+        setattr(sample, 'Calibrated' + suffix, int(state['calibrated']))
+        if tracked:
+            setattr(sample, 'GlintX' + suffix, glint[0])
+            setattr(sample, 'GlintY' + suffix, glint[1])
+            setattr(sample, 'VectX' + suffix, x * vectorGain)
+            setattr(sample, 'VectY' + suffix, y * vectorGain)
+            setattr(sample, 'PupilMajorAxis' + suffix, pupilSize)
+            setattr(sample, 'PupilMinorAxis' + suffix, pupilSize * 0.9)
+            if state['calibrated']:
+                setattr(sample, 'GazeX' + suffix, x)
+                setattr(sample, 'GazeY' + suffix, y)
+
+    return(sample)
+
+def __writeSample(sample):
+
+    # one comment per sample:
+    comment = state['comments'].popleft() if len(state['comments']) else ''
+    state['file'].write('%d,0,%0.4f,%0.4f,%0.4f,%0.4f,%0.2f,%0.2f,%0.2f,%0.2f,%s\n'%( sample.Timestamp,
+                        sample.GazeX, sample.GazeY, sample.GazeXRight, sample.GazeYRight,
+                        sample.PupilMajorAxis, sample.PupilMinorAxis, sample.PupilMajorAxisRight, sample.PupilMinorAxisRight,
+                        comment ))
+
+def __advance():
+
+    # make all samples up to now (at most 10 seconds of them, when nothing asked for samples for longer)
+    now = state['clock']()
+    if state['start'] == None:
+        state['start'] = now
+        state['next'] = now
+    if now - state['next'] > 10:
+        state['next'] = now - 10
+
+    interval = 1 / state['sampleRate']
+    while state['next'] <= now:
+        sample = __makeSample(state['next'])
+        state['last'] = sample
+        if state['tracking']:
+            buffer.append(sample)
+            if state['file'] != None:
+                __writeSample(sample)
+        state['next'] += interval
+
+
+# the functions of LiveTrack.py:
+
+def Init():
+    print('LiveTrack: simulated device initialised.')
+    state['start'] = None
+    buffer.clear()
+    return 1
+
+def Close():
+    CloseDataFile()
+    state['tracking'] = False
+    print('LiveTrack: Successfully closed simulated device')
+    return 0
+
+def GetFirmwareVersion():
+    return 0
+
+def GetLibraryVersion():
+    return 0
+
+def GetSerialNumber():
+    return 'simulated'
+
+def GetLastResult():
+    __advance()
+    if state['last'] == None:
+        state['last'] = __makeSample(state['clock']())
+    return state['last']
+
+def GetTracking():
+    return state['eyes'][0], state['eyes'][1]
+
+def SetTracking(leftEye,rightEye):
+    state['eyes'] = [bool(leftEye), bool(rightEye)]
+    return 0
+
+def ClearDataBuffer():
+    __advance()
+    buffer.clear()
+    return 0
+
+def GetResultsCount():
+    __advance()
+    return len(buffer)
+
+def StartTracking():
+    __advance()
+    state['tracking'] = True
+    return 0
+
+def StopTracking():
+    __advance()
+    state['tracking'] = False
+    return 0
+
+def GetBufferedEyePositions(removeFromBuffer=1,maximumPoints=-1,fromBeginning=1):
+    # same as LiveTrack.py: a new struct per sample
+    count = GetResultsCount()
+    if maximumPoints==-1 or maximumPoints>count:
+        maximumPoints = count
+    start = 0 if fromBeginning else int(count-maximumPoints)
+    dataArray = []
+    for x in range(start, start + int(maximumPoints)):
+        dataArray.append(T_RESULTS_STRUCT.from_buffer_copy(buffer[x]))
+    if removeFromBuffer:
+        for x in range(int(maximumPoints)):
+            if fromBeginning:
+                buffer.popleft()
+            else:
+                buffer.pop()
+    if maximumPoints == 0:
+        print('LiveTrack: No samples in buffer')
+    return dataArray
+
+def SetPupilCalibration(diameter, pixels):
+    return 0
+
+def GetPupilCalibration():
+    return 1.
+
+def SetCalibration(eye, cal, viewDist, xGlintMedian, yGlintMedian):
+    calibrations[eye] = [list(cal), viewDist, xGlintMedian, yGlintMedian]
+    return 0
+
+def GetCalibration(eye):
+    if not eye in calibrations.keys():
+        return [0.]*16, 0., 0., 0.
+    cal, viewDist, xGlintMedian, yGlintMedian = calibrations[eye]
+    return list(cal) + [0.]*(16-len(cal)), viewDist, xGlintMedian, yGlintMedian
+
+def SetResultsTypeCalibrated():
+    state['calibrated'] = True
+    return 0
+
+def SetResultsTypeRaw():
+    state['calibrated'] = False
+    return 0
+
+def CalibrateDevice(eye, numberOfFixationTargets, targetsX, targetsY, vectX, vectY, viewDist, xGlintMedian=0, yGlintMedian=0):
+    # the simulated vectors are a linear function of gaze: any calibration is perfect
+    calibrations[eye] = [[vectorGain, 0., 0., vectorGain], viewDist, xGlintMedian, yGlintMedian]
+    return 0
+
+def SaveCalibration(filename):
+    with open(filename, 'w') as cal_file:
+        json.dump({str(eye):calibration for eye, calibration in calibrations.items()}, fp=cal_file)
+    return 0
+
+def LoadCalibration(filename):
+    with open(filename, 'r') as cal_file:
+        calibrations.update({int(eye):calibration for eye, calibration in json.load(cal_file).items()})
+    return 0
+
+def CalcGaze(eye, numberOfGazePoints, vectX, vectY):
+    return vectX / vectorGain, vectY / vectorGain
+
+def GetCaptureConfig():
+    return 640, 480, state['sampleRate'], 0, 0
+
+def GetFieldAsList(data, field_name):
+    dataOut = []
+    for x in range(0, len(data)):
+        dataOut.append(getattr(data[x], field_name))
+    return dataOut
+
+def SetDataFilename(filename):
+    CloseDataFile()
+    __advance()
+    state['file'] = open(filename, 'a')
+    state['file'].write(','.join(LT_columns) + '\n')
+    return 0
+
+def CloseDataFile():
+    __advance()
+    if state['file'] != None:
+        state['file'].close()
+        state['file'] = None
+    return 0
+
+def SetDataComment(comment):
+    __advance()
+    # goes with the next sample that doesn't have a comment yet:
+    state['comments'].append(comment.replace(',', ';'))
+    return 0
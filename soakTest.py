@@ -0,0 +1,436 @@
+# soak test: run the tasks for hours of (simulated) time, and check that nothing keeps growing
+#
+# the tasks run unchanged, on the 'simulated' location (a window on the first screen, and the
+# simulated LiveTrack from simLiveTrack.py), with:
+# -  a virtual clock: time.time() and time.sleep() use it, and every flip moves it on by one frame,
+#    so a session takes as long as the drawing does, not as long as the session would
+# -  a simulated participant: looks at the fixation cross and calibration targets (after a latency),
+#    makes the two saccades after 'stimulus off', blinks between trials, and sometimes breaks fixation
+# -  a simulated operator: answers every waitKeys() with space, and presses space (end of trial,
+#    response) or r (drift check) in getKeys() at random, as often as set
+#
+# every `sampleEvery` simulated seconds, the resident memory, the number of objects (all, and of
+# some psychopy types), and the real time per frame and per lastsample() call are stored
+# at the end, a measure that grows steadily (most steps up, and more than its limit from the first to
+# the last third of the samples) fails the test (exit code 1), results are written as json
+# a run with too few samples for any verdict (less than 7) doesn't pass either (exit code 2): run
+# longer, or sample more often
+#
+# usage (on a computer without a screen, run it in a virtual frame buffer):
+# -  xvfb-run -s "-screen 0 1920x1080x24" python soakTest.py --task saccades --hours 2 --out soak.json
+# -  python soakTest.py --task perception --hours 4 --blocks 16
+
+import os
+import gc
+import sys
+import time
+import json
+import atexit
+import random
+import argparse
+import tempfile
+import numpy as np
+
+import simLiveTrack
+from benchmarks import virtualClock
+
+
+# relative growth (last third vs first third of the samples) that fails each measure:
+growthLimits = { 'rss_mb'          : 0.10,
+                 'objects'         : 0.05,
+                 'TextStim'        : 0.05,
+                 'ElementArrayStim': 0.05,
+                 'ShapeStim'       : 0.05,
+                 'DataFrame'       : 0.05,
+                 'frame_ms'        : 0.25,
+                 'frame_p99_ms'    : 0.50,
+                 'lastsample_us'   : 0.25 }
+
+# psychopy (and pandas) objects of which the number should stay the same over a session:
+watchedTypes = ['TextStim', 'ElementArrayStim', 'ShapeStim', 'DataFrame']
+
+
+def residentMemory():
+
+    # resident set size in MB (psutil if there is one, /proc on linux, otherwise the peak from resource)
+    try:
+        import psutil
+        return(psutil.Process().memory_info().rss / 2**20)
+    except ImportError:
+        pass
+    if os.path.isfile('/proc/self/statm'):
+        with open('/proc/self/statm', 'r') as statm:
+            return(int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2**20)
+    import resource
+    return(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2**10)
+
+
+def objectCounts():
+
+    gc.collect()
+    objects = gc.get_objects()
+    counts = {name:0 for name in watchedTypes}
+    for obj in objects:
+        name = type(obj).__name__
+        if name in counts.keys():
+            counts[name] += 1
+    counts['objects'] = len(objects)
+
+    return(counts)
+
+
+def steadyGrowth(values, limit, minUpSteps=0.7):
+
+    # values keep going up: most steps that change go up, and the last third is more than `limit`
+    # (relative) above the first third (the first sample is skipped: that's the warm-up)
+    values = np.array(values[1:], dtype=float)
+    values = values[~np.isnan(values)]
+    if len(values) < 6:
+        return(False, np.nan)
+
+    third = len(values) // 3
+    first = np.median(values[:third])
+    last = np.median(values[-third:])
+    growth = (last - first) / first if first > 0 else (np.inf if last > 0 else 0.)
+
+    steps = np.diff(values)
+    steps = steps[steps != 0]
+    upSteps = np.mean(steps > 0) if len(steps) else 0.
+
+    return(bool(growth > limit and upSteps >= minUpSteps), float(growth))
+
+
+class simulatedParticipant:
+
+    def __init__(self, clock, seed=0, latency=0.2, abortRate=0.05, blinkDuration=0.15):
+
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.latency = latency
+        self.abortRate = abortRate
+        self.blinkDuration = blinkDuration
+
+        self.attractor = [0., 0.]
+        self.attractorTime = 0.
+        self.looking = None
+        self.gaze = None
+        self.schedule = []
+        self.points = {}
+
+        # all comments go through the simulated device (runSoak puts self.comment in its place):
+        self.__setDataComment = simLiveTrack.SetDataComment
+
+    def watch(self, stim, interrupts=False):
+
+        # look at this stimulus whenever it's drawn
+        # (interrupts: the stimulus asks for fixation, e.g. a calibration or drift check target,
+        # so it also ends the saccades the participant was making)
+        draw = stim.draw
+        def watchedDraw(*args, **kwargs):
+            pos = [float(stim.pos[0]), float(stim.pos[1])]
+            if interrupts and len(self.schedule):
+                self.schedule = []
+                self.looking = None
+                self.attractorTime = self.clock.now
+            if pos != self.attractor:
+                self.attractor = pos
+                self.attractorTime = self.clock.now
+            return(draw(*args, **kwargs))
+        stim.draw = watchedDraw
+
+    def comment(self, comment):
+
+        now = self.clock.now
+        if comment.startswith('point'):
+            parts = comment.split(' ')
+            self.points[parts[0]] = [float(parts[1]), float(parts[2])]
+        if comment == 'stimulus on' and self.rng.random() < self.abortRate:
+            # look at the plus too early:
+            self.schedule = [[now + 0.3, self.points.get('point1', [5, 0])], [now + 0.6, None]]
+        if comment == 'stimulus off':
+            # plus, cross, back to the middle (None: back to whatever is drawn):
+            latency = self.latency + self.rng.uniform(-0.05, 0.05)
+            self.schedule = [ [now + latency,       self.points.get('point1', [5, 0])],
+                              [now + latency + 0.3, self.points.get('point2', [5, 5])],
+                              [now + latency + 0.6, [0., 0.]],
+                              [now + latency + 1.2, None] ]
+        if comment in ['gaze returned', 'space pressed']:
+            simLiveTrack.blink(self.blinkDuration)
+
+        return(self.__setDataComment(comment))
+
+    def update(self):
+
+        # whenever the device makes samples: where to look now
+        now = self.clock.now
+        target = None
+        while len(self.schedule) and self.schedule[0][0] <= now:
+            target = self.schedule.pop(0)[1]
+            if target == None:
+                self.looking = None
+        if target != None:
+            self.looking = target
+        elif len(self.schedule) == 0 and (now - self.attractorTime) >= self.latency:
+            self.looking = self.attractor
+
+        # (lookAt() makes the samples up to now first, which updates again: only move when it changes)
+        if self.looking != None and self.looking != self.gaze:
+            self.gaze = self.looking
+            simLiveTrack.lookAt(self.looking[0], self.looking[1])
+
+
+class simulatedOperator:
+
+    def __init__(self, clock, seed=0, responseTime=1.0, driftcheckInterval=600, framePeriod=1/60):
+
+        # responseTime: average seconds until space is pressed when the task waits for it
+        # driftcheckInterval: average seconds between drift checks ('r')
+        self.clock = clock
+        self.rng = random.Random(seed)
+        self.pSpace = framePeriod / responseTime
+        self.pDrift = framePeriod / driftcheckInterval
+
+    def waitKeys(self, *args, **kwargs):
+
+        self.clock.advance(0.5)
+        return(['space'])
+
+    def getKeys(self, keyList=None, *args, **kwargs):
+
+        if keyList == None:
+            return([])
+        if 'r' in keyList and self.rng.random() < self.pDrift:
+            return(['r'])
+        if 'space' in keyList and self.rng.random() < self.pSpace:
+            return(['space'])
+        return([])
+
+
+class soakMonitor:
+
+    def __init__(self, clock, sampleEvery=60):
+
+        self.clock = clock
+        self.sampleEvery = sampleEvery
+        self.samples = []
+        self.frameTimes = []
+        self.lastsampleTimes = []
+        self.__lastFlip = None
+        self.__nextSample = clock.now
+
+    def watchTracker(self, tracker):
+
+        lastsample = tracker.lastsample
+        def timedLastsample(*args, **kwargs):
+            start = time.perf_counter()
+            sample = lastsample(*args, **kwargs)
+            self.lastsampleTimes.append(time.perf_counter() - start)
+            return(sample)
+        tracker.lastsample = timedLastsample
+
+    def beforeFlip(self):
+
+        # the real time spent on the frame, up to the flip:
+        if self.__lastFlip != None:
+            self.frameTimes.append(time.perf_counter() - self.__lastFlip)
+
+    def afterFlip(self):
+
+        self.__lastFlip = time.perf_counter()
+        if self.clock.now >= self.__nextSample:
+            self.sample()
+            self.__nextSample = self.clock.now + self.sampleEvery
+            self.__lastFlip = time.perf_counter()
+
+    def pause(self):
+
+        # (waiting for keys, or between sessions: not a frame)
+        self.__lastFlip = None
+
+    def sample(self):
+
+        sample = { 'time_s'  : self.clock.now,
+                   'real_s'  : time.perf_counter(),
+                   'rss_mb'  : residentMemory() }
+        sample.update(objectCounts())
+        frames = np.array(self.frameTimes) * 1000
+        sample['frames'] = len(frames)
+        sample['frame_ms'] = float(np.median(frames)) if len(frames) else np.nan
+        sample['frame_p99_ms'] = float(np.percentile(frames, 99)) if len(frames) else np.nan
+        calls = np.array(self.lastsampleTimes) * 1e6
+        sample['lastsample_us'] = float(np.median(calls)) if len(calls) else np.nan
+        self.frameTimes = []
+        self.lastsampleTimes = []
+
+        self.samples.append(sample)
+        print('soak: %6.0f s simulated, %6.1f MB, %d objects, frame %0.2f ms, lastsample %0.1f us'%(sample['time_s'], sample['rss_mb'], sample['objects'], sample['frame_ms'], sample['lastsample_us']))
+
+    def verdicts(self):
+
+        verdicts = {}
+        for name, limit in growthLimits.items():
+            values = [sample.get(name, np.nan) for sample in self.samples]
+            growing, growth = steadyGrowth(values, limit)
+            verdicts[name] = {'growing':growing, 'growth':growth, 'limit':limit}
+
+        return(verdicts)
+
+
+def seedParticipant(ID, task):
+
+    # colour calibration and blind spots, as if the calibration tasks were done
+    from participantStore import participantStore
+    store = participantStore(task)
+    store.add(ID, 'color', background=[0.5, 0.5, -1.0], left=[0.5, -1.0, -1.0], right=[-1.0, 0.5, -1.0])
+    store.add(ID, 'blindspot_left',  position=[-15.0, -1.5], size=[4.0, 5.0])
+    store.add(ID, 'blindspot_right', position=[ 15.0, -1.5], size=[4.0, 5.0])
+
+
+def runSoak(task='saccades', hours=2, blocks=None, sampleEvery=60, seed=0, folder=None, responseTime=1.0, abortRate=0.05, driftcheckInterval=600):
+
+    from psychopy import visual, event
+    import HVsaccadesBS
+    import HVperceptionBS
+
+    module, runTask = { 'saccades'   : [HVsaccadesBS, HVsaccadesBS.doHVsaccadeTask],
+                        'perception' : [HVperceptionBS, HVperceptionBS.doHVperceptionTask] }[task]
+
+    clock = virtualClock(start=1e6, tick=0.0005)
+    participant = simulatedParticipant(clock, seed=seed, abortRate=abortRate)
+    operator = simulatedOperator(clock, seed=seed, responseTime=responseTime, driftcheckInterval=driftcheckInterval)
+    monitor = soakMonitor(clock, sampleEvery=sampleEvery)
+
+    # everything that gets swapped out, to put back at the end:
+    patches = [ [time, 'time', time.time], [time, 'sleep', time.sleep],
+                [event, 'waitKeys', event.waitKeys], [event, 'getKeys', event.getKeys], [event, 'clearEvents', event.clearEvents],
+                [visual.Window, 'flip', visual.Window.flip],
+                [module, 'localizeSetup', module.localizeSetup], [module, 'sessionPlan', module.sessionPlan],
+                [simLiveTrack, 'SetDataComment', simLiveTrack.SetDataComment],
+                [atexit, 'register', atexit.register] ]
+    simClock = simLiveTrack.state['clock']
+
+    # the participant moves their eyes whenever the device makes samples, not only on flips
+    # (calibration waits for a fixation without flipping):
+    def deviceClock():
+        now = clock()
+        participant.update()
+        return(now)
+
+    flip = visual.Window.flip
+    def simulatedFlip(win, *args, **kwargs):
+        monitor.beforeFlip()
+        result = flip(win, *args, **kwargs)
+        clock.advance(win.monitorFramePeriod if win.monitorFramePeriod else 1/60)
+        monitor.afterFlip()
+        return(result)
+
+    def waitKeys(*args, **kwargs):
+        monitor.pause()
+        return(operator.waitKeys(*args, **kwargs))
+
+    # psychopy keeps every window until exit (to close it then), which here would add one window
+    # per session: the tasks close their own windows, so those don't need it
+    register = atexit.register
+    def registerAtExit(function, *args, **kwargs):
+        if function.__qualname__ == 'Window.__init__.<locals>.close_on_exit':
+            return(function)
+        return(register(function, *args, **kwargs))
+
+    localizeSetup = module.localizeSetup
+    def simulatedSetup(*args, **kwargs):
+        kwargs['location'] = 'simulated'
+        setup = localizeSetup(*args, **kwargs)
+        setup['win'].waitBlanking = False
+        participant.watch(setup['fixation'])
+        participant.watch(setup['fixation_x'])
+        participant.watch(setup['tracker'].target, interrupts=True)
+        monitor.watchTracker(setup['tracker'])
+        return(setup)
+
+    sessionPlan = module.sessionPlan
+    def longerSession(n_blocks):
+        return(sessionPlan(n_blocks=n_blocks if blocks == None else blocks))
+
+    workdir = os.getcwd()
+    if folder == None:
+        folder = tempfile.mkdtemp(prefix='soak_')
+    print('soak test in: %s'%(folder))
+
+    try:
+        time.time = clock
+        time.sleep = clock.advance
+        event.waitKeys = waitKeys
+        event.getKeys = operator.getKeys
+        event.clearEvents = lambda *args, **kwargs: None
+        visual.Window.flip = simulatedFlip
+        module.localizeSetup = simulatedSetup
+        module.sessionPlan = longerSession
+        simLiveTrack.SetDataComment = participant.comment
+        atexit.register = registerAtExit
+        simLiveTrack.setClock(deviceClock)
+        simLiveTrack.seed(seed)
+
+        # the tasks use paths relative to the working directory:
+        os.chdir(folder)
+        ID = 'soak%d'%(seed)
+        seedParticipant(ID, task)
+
+        start = clock.now
+        sessions = 0
+        while (clock.now - start) < hours * 3600:
+            hemifield = ['left', 'right'][sessions % 2]
+            print('soak: session %d (%s), %0.2f of %0.2f hours'%(sessions+1, hemifield, (clock.now - start)/3600, hours))
+            runTask(ID=ID, hemifield=hemifield, location='simulated')
+            monitor.pause()
+            sessions += 1
+
+        monitor.sample()
+
+    finally:
+        os.chdir(workdir)
+        for obj, name, original in patches:
+            setattr(obj, name, original)
+        simLiveTrack.setClock(simClock)
+
+    verdicts = monitor.verdicts()
+    failed = [name for name in verdicts.keys() if verdicts[name]['growing']]
+
+    return({ 'task'     : task,
+             'hours'    : hours,
+             'sessions' : sessions,
+             'folder'   : folder,
+             'samples'  : monitor.samples,
+             'verdicts' : verdicts,
+             'failed'   : failed })
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='soak test of the tasks, on a virtual clock with a simulated eye-tracker and participant')
+    parser.add_argument('--task', default='saccades', choices=['saccades', 'perception'])
+    parser.add_argument('--hours', default=2, type=float, help='simulated hours to run for (whole sessions)')
+    parser.add_argument('--blocks', default=None, type=int, help='blocks per session (default: as in the task)')
+    parser.add_argument('--sample-every', default=60, type=float, help='simulated seconds between measurements')
+    parser.add_argument('--seed', default=0, type=int)
+    parser.add_argument('--out', default=None, help='json file for the measurements and verdicts')
+    args = parser.parse_args()
+
+    # the tasks' folders are in the working directory, and these modules next to this file:
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    result = runSoak(task=args.task, hours=args.hours, blocks=args.blocks, sampleEvery=args.sample_every, seed=args.seed)
+
+    if args.out != None:
+        with open(args.out, 'w') as out_file:
+            json.dump(result, fp=out_file, indent=4)
+
+    for name, verdict in result['verdicts'].items():
+        print('%-18s growth %7.1f%% (limit %4.0f%%)%s'%(name, verdict['growth']*100, verdict['limit']*100, '  GROWING' if verdict['growing'] else ''))
+
+    if len(result['failed']):
+        print('FAILED: steady growth of %s'%(', '.join(result['failed'])))
+        sys.exit(1)
+    if all(np.isnan(verdict['growth']) for verdict in result['verdicts'].values()):
+        print('NO VERDICT: %d samples is too few, run longer or lower --sample-every'%(len(result['samples'])))
+        sys.exit(2)
+    print('no steady growth in %0.1f simulated hours (%d sessions)'%(result['hours'], result['sessions']))